@@ -0,0 +1,284 @@
+# alerts.py
+# Titan SOP V82.1 - Incremental Alert Engine
+# 狀態: SOP 進出場警示引擎 (規則註冊一次，資料異動時增量評估)
+# 修正重點:
+# 1. [增量評估] 每條規則宣告依賴欄位，只有該 CB 的相關欄位異動時才重新評估 (O(異動) 而非 O(全市場 × 規則))。
+# 2. [去重限流] 邊緣觸發 (條件由否轉是才發)、同一規則同一檔冷卻時間、全域每分鐘上限 (以事件 / K 棒時間計，回放不受牆鐘影響)。
+# 3. [可插拔輸出] 本地 JSONL 檔、Webhook 替身 (有 URL 則 POST，否則寫入 outbox 目錄)、記憶體收集。
+
+import json
+import logging
+import time
+import urllib.request
+import numpy as np
+import pandas as pd
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from config import Config, LOG_DIR
+from fingerprint import row_fingerprints
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# 輸出端 (Sinks)
+# ==========================================
+class FileAlertSink:
+    """逐行 JSON 寫入本地檔案"""
+
+    def __init__(self, path: Path = LOG_DIR / "alerts.jsonl"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, alert: Dict):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(alert, ensure_ascii=False, default=str) + "\n")
+
+
+class WebhookAlertSink:
+    """Webhook 替身: 有 url 時以 JSON POST 送出；否則每則警示寫成 outbox 目錄下的一個 .json 檔"""
+
+    def __init__(self, url: Optional[str] = None, outbox_dir: Path = LOG_DIR / "webhook_outbox", timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+        self.outbox_dir = Path(outbox_dir)
+        if not url:
+            self.outbox_dir.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, alert: Dict):
+        payload = json.dumps(alert, ensure_ascii=False, default=str).encode('utf-8')
+        if self.url:
+            req = urllib.request.Request(self.url, data=payload, headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(req, timeout=self.timeout).close()
+        else:
+            name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{alert['rule']}_{alert['key']}.json"
+            (self.outbox_dir / name).write_bytes(payload)
+
+
+class MemoryAlertSink(list):
+    """收集於記憶體 (供 UI 顯示)"""
+
+    def __call__(self, alert: Dict):
+        self.append(alert)
+
+
+# ==========================================
+# 預設 SOP 規則
+# ==========================================
+def _num(record: Dict, field: str) -> float:
+    try:
+        value = float(record.get(field, np.nan))
+    except (TypeError, ValueError):
+        return np.nan
+    return value
+
+
+SOP_ALERT_RULES = [
+    {
+        "name": "sweet_spot_entry", "level": "entry",
+        "fields": ["price", "stock_price", "MA87"],
+        "when": lambda r: (Config.SWEET_SPOT_LOW <= _num(r, 'price') <= Config.SWEET_SPOT_HIGH)
+                          and _num(r, 'stock_price') > _num(r, 'MA87') > 0,
+        "message": lambda r: f"🍬 {r.get('name')} ({r.get('key')}) 進入甜蜜點 {_num(r, 'price'):.2f} 元，且標的站上 87MA。",
+    },
+    {
+        "name": "ma87_break", "level": "exit",
+        "fields": ["stock_price", "MA87"],
+        "when": lambda r: 0 < _num(r, 'stock_price') < _num(r, 'MA87'),
+        "message": lambda r: f"🛑 {r.get('name')} ({r.get('key')}) 標的 {_num(r, 'stock_price'):.2f} 跌破 87MA {_num(r, 'MA87'):.2f}。",
+    },
+    {
+        "name": "death_cross", "level": "exit",
+        "fields": ["MA87", "MA284"],
+        "when": lambda r: 0 < _num(r, 'MA87') < _num(r, 'MA284'),
+        "message": lambda r: f"☠️ {r.get('name')} ({r.get('key')}) 87MA 死亡交叉 284MA，正式進入空頭。",
+    },
+    {
+        "name": "chips_loose", "level": "risk",
+        "fields": ["converted_ratio"],
+        "when": lambda r: _num(r, 'converted_ratio') > 30,
+        "message": lambda r: f"☠️ {r.get('name')} ({r.get('key')}) 已轉換 {_num(r, 'converted_ratio'):.1f}%，超過 30% 警戒線 (主力下車)。",
+    },
+    {
+        "name": "high_premium", "level": "risk",
+        "fields": ["premium"],
+        "when": lambda r: _num(r, 'premium') > 20,
+        "message": lambda r: f"⚠️ {r.get('name')} ({r.get('key')}) 溢價率 {_num(r, 'premium'):.1f}% 超過 20% (肉少湯喝)。",
+    },
+]
+
+
+class TitanAlertEngine:
+    """
+    增量警示引擎
+    記錄每檔 CB 的最新欄位值與每條規則的上次判定；資料到達時只評估依賴欄位有變的規則。
+    """
+
+    def __init__(self, rules: Optional[List[Dict]] = None, sinks: Optional[List[Callable[[Dict], None]]] = None,
+                 cooldown: float = 3600.0, max_per_minute: int = 60):
+        self.rules: Dict[str, Dict] = {}
+        self._rules_by_field: Dict[str, List[str]] = {}
+        self.sinks: List[Callable[[Dict], None]] = list(sinks or [])
+        self.cooldown = cooldown
+        self.max_per_minute = max_per_minute
+
+        self.records: Dict[str, Dict] = {}
+        self._state: Dict[tuple, bool] = {}         # (rule, key) → 上次判定
+        self._last_sent: Dict[tuple, float] = {}    # (rule, key) → 上次發送時間
+        self._sent_window: deque = deque()
+        self._row_fp: Optional[pd.Series] = None
+        self._stock_map: Dict[str, List[str]] = {}
+        self.evaluations = 0
+        self.suppressed = 0
+
+        for rule in (SOP_ALERT_RULES if rules is None else rules):
+            self.register(rule)
+
+    def register(self, rule: Dict):
+        """註冊規則: name, fields (依賴欄位), when(record)->bool, message(record)->str, level, cooldown (選填)"""
+        self.rules[rule["name"]] = rule
+        for field in rule["fields"]:
+            self._rules_by_field.setdefault(field, [])
+            if rule["name"] not in self._rules_by_field[field]:
+                self._rules_by_field[field].append(rule["name"])
+
+    def add_sink(self, sink: Callable[[Dict], None]):
+        self.sinks.append(sink)
+
+    # ------------------------------------------------------------------
+    # 核心: 單檔增量更新
+    # ------------------------------------------------------------------
+    def update(self, key: str, fields: Dict, ts=None, prime: bool = False) -> List[Dict]:
+        """
+        合併一檔 CB 的新欄位值，只評估依賴欄位確實改變的規則；回傳本次送出的警示。
+        prime=True 只記錄規則狀態 (建立基準)，不送出、不佔用冷卻與全域限流額度。
+        """
+        key = str(key)
+        record = self.records.setdefault(key, {"key": key})
+        changed = [f for f, v in fields.items() if f not in record or not _same(record[f], v)]
+        record.update(fields)
+        if not changed:
+            return []
+
+        rule_names = dict.fromkeys(n for f in changed for n in self._rules_by_field.get(f, []))
+        alerts = []
+        now = _event_clock(ts)
+        for name in rule_names:
+            rule = self.rules[name]
+            self.evaluations += 1
+            try:
+                hit = bool(rule["when"](record))
+            except Exception:
+                hit = False
+            was = self._state.get((name, key), False)
+            self._state[(name, key)] = hit
+            if hit and not was and not prime:
+                alert = self._emit(rule, record, now, ts)
+                if alert:
+                    alerts.append(alert)
+        return alerts
+
+    def _emit(self, rule: Dict, record: Dict, now: float, ts) -> Optional[Dict]:
+        """冷卻與全域限流檢查後送往所有輸出端"""
+        key = (rule["name"], record["key"])
+        if now - self._last_sent.get(key, -np.inf) < rule.get("cooldown", self.cooldown):
+            self.suppressed += 1
+            return None
+        while self._sent_window and now - self._sent_window[0] > 60:
+            self._sent_window.popleft()
+        if len(self._sent_window) >= self.max_per_minute:
+            self.suppressed += 1
+            return None
+
+        self._last_sent[key] = now
+        self._sent_window.append(now)
+        alert = {
+            "ts": str(ts or datetime.now()), "rule": rule["name"], "level": rule.get("level", "info"),
+            "key": record["key"], "name": record.get("name", ""), "message": rule["message"](record),
+        }
+        for sink in self.sinks:
+            try:
+                sink(alert)
+            except Exception as e:
+                logger.warning("警示輸出失敗 (%s): %s", rule['name'], e)
+        return alert
+
+    # ------------------------------------------------------------------
+    # 資料入口: 即時事件 / CB 快照 / 日 K 棒
+    # ------------------------------------------------------------------
+    def on_event(self, event: Dict) -> List[Dict]:
+        """TitanRealtimeState 變化事件 (可直接 subscribe)"""
+        fields = {f: event[f] for f in event if f not in ("ts", "code", "changes", "source")}
+        return self.update(event["code"], fields, event.get("ts"))
+
+    def on_snapshot(self, df: pd.DataFrame, key_col: str = 'code', prime: bool = False) -> List[Dict]:
+        """CB 清單或掃描結果快照: 以逐列指紋比對，只有內容異動的列才進入規則評估 (prime 同 update)"""
+        if df is None or df.empty or key_col not in df.columns:
+            return []
+        keys = df[key_col].astype(str).to_numpy()
+        fp = row_fingerprints(df)
+        fp.index = keys
+        if self._row_fp is not None:
+            prev = self._row_fp.reindex(keys)
+            dirty = prev.isna().to_numpy() | (prev.to_numpy() != fp.to_numpy())
+        else:
+            dirty = np.ones(len(df), dtype=bool)
+        self._row_fp = fp[~fp.index.duplicated(keep='last')]
+
+        if 'stock_code' in df.columns:
+            stock_map: Dict[str, List[str]] = {}
+            for key, stock in zip(keys, df['stock_code'].astype(str)):
+                stock_map.setdefault(stock, []).append(key)
+            self._stock_map = stock_map
+
+        alerts = []
+        for rec in df[dirty].to_dict('records'):
+            alerts.extend(self.update(rec[key_col], rec, prime=prime))
+        return alerts
+
+    def on_bar(self, stock_code: str, bars: pd.DataFrame, ts=None) -> List[Dict]:
+        """標的新日 K 棒: 重算現價/87MA/284MA 後更新所有對應 CB"""
+        close = bars['Close'].dropna() if bars is not None and 'Close' in bars.columns else pd.Series(dtype=float)
+        if close.empty:
+            return []
+        fields = {
+            "stock_price": float(close.iloc[-1]),
+            "MA87": float(close.iloc[-Config.MA_LIFE_LINE:].mean()) if len(close) >= Config.MA_LIFE_LINE else 0.0,
+            "MA284": float(close.iloc[-Config.MA_LONG_TERM:].mean()) if len(close) >= Config.MA_LONG_TERM else 0.0,
+        }
+        alerts = []
+        for key in self._stock_map.get(str(stock_code), []):
+            alerts.extend(self.update(key, fields, ts or close.index[-1]))
+        return alerts
+
+    def active(self) -> pd.DataFrame:
+        """目前成立中的所有 (規則, CB)"""
+        rows = [{"rule": r, "key": k, "name": self.records.get(k, {}).get("name", "")}
+                for (r, k), hit in self._state.items() if hit]
+        return pd.DataFrame(rows, columns=["rule", "key", "name"])
+
+
+def _event_clock(ts) -> float:
+    """冷卻 / 限流使用的時間 (秒)：有事件時間時取事件時間 (報價回放、歷史 K 棒)，否則取現在"""
+    if ts is not None:
+        try:
+            stamp = pd.Timestamp(ts)
+            if not pd.isna(stamp):
+                return stamp.timestamp()
+        except (TypeError, ValueError):
+            pass
+    return time.time()
+
+
+def _same(a, b) -> bool:
+    try:
+        if pd.isna(a) and pd.isna(b):
+            return True
+    except (TypeError, ValueError):
+        pass
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
@@ -18,7 +18,23 @@ from knowledge_base import TitanKnowledgeBase
 from macro_risk import MacroRiskEngine
 from strategy import TitanStrategyEngine
 from intelligence import IntelligenceIngestor
-from execution import CalendarAgent
+from execution import CalendarAgent, TimeArbitrageIndex
+from fingerprint import frame_fingerprint, config_fingerprint
+from price_panel import trailing_stats
+from scan_history import TitanScanHistory
+from realtime import TitanRealtimeState, ReplayQuoteSource
+from alerts import TitanAlertEngine, FileAlertSink, MemoryAlertSink
+from cb_pricing import TitanCBPricer
+from relative_strength import TitanRelativeStrength
+from backtest import hysteresis_position, ma_strategy_matrix, backtest_positions, MA_STRATEGY_RULES
+from grid_search import TitanGridSearch, build_grid
+from walk_forward import TitanWalkForward
+from cb_history import TitanCBHistory, last_trading_day
+from monte_carlo import TitanMonteCarlo
+from result_store import TitanResultStore, data_fingerprint
+from event_study import TitanEventStudy, EVENT_LABELS
+from batch_backtest import TitanBatchBacktest, STRATEGY_ID as FAST_STRATEGY_ID, trend_backtest, cash_backtest, split_curves, join_curves
+import metrics
 import pdfplumber
 import re
 from datetime import datetime, timedelta
@@ -95,6 +111,11 @@ st.session_state.last_active_time = now
 # ==========================================
 # [V80 Core Logic] All helper functions are preserved
 # ==========================================
+@st.cache_resource
+def get_result_store():
+    """回測結果庫 (SQLite，跨重啟/行程共用；鍵含 K 棒資料指紋，資料更新即自然失效)"""
+    return TitanResultStore()
+
 def run_fast_backtest(ticker, start_date="2023-01-01", initial_capital=1000000):
     """
     [UPGRADED V78.3] 極速向量化回測引擎 (Vectorized Backtest Engine)
@@ -108,20 +129,7 @@ def run_fast_backtest(ticker, start_date="2023-01-01", initial_capital=1000000):
     try:
         # Handle CASH asset
         if ticker.upper() in ['CASH', 'USD', 'TWD']:
-            dates = yf.download('^TWII', start=start_date, progress=False).index
-            if dates.empty: return None
-            df = pd.DataFrame(index=dates)
-            df['Close'] = 1.0
-            df['Strategy_Return'] = 0.0
-            df['Equity'] = initial_capital
-            df['Drawdown'] = 0.0
-            
-            return {
-                "cagr": 0.0, "sharpe_ratio": 0.0, "max_drawdown": 0.0,
-                "win_rate": 0.0, "profit_factor": 0.0, "kelly": 0.0,
-                "equity_curve": df['Equity'], "drawdown_series": df['Drawdown'],
-                "latest_price": 1.0
-            }
+            return cash_backtest(yf.download('^TWII', start=start_date, progress=False).index, initial_capital)
 
         # 1. 智慧代碼處理 (增強版：支援混合型代號如 00675L)
         original_ticker = ticker
@@ -145,68 +153,48 @@ def run_fast_backtest(ticker, start_date="2023-01-01", initial_capital=1000000):
 
         if df.empty or len(df) < 21: return None
 
-        # 3. 策略信號生成
-        df['MA20'] = df['Close'].rolling(window=20).mean()
-        df['Signal'] = 0
-        df.loc[df['Close'] > df['MA20'], 'Signal'] = 1
-        
-        # 4. 績效計算
-        df['Pct_Change'] = df['Close'].pct_change()
-        df['Strategy_Return'] = df['Signal'].shift(1) * df['Pct_Change']
-        df['Equity'] = (1 + df['Strategy_Return'].fillna(0)).cumprod() * initial_capital
-        
-        # 5. 凱利參數計算
-        trade_days = df[df['Signal'].shift(1) == 1]
-        if len(trade_days) < 10:
-            win_rate, profit_factor, kelly = 0, 0, 0
-        else:
-            wins = trade_days[trade_days['Strategy_Return'] > 0]['Strategy_Return']
-            losses = trade_days[trade_days['Strategy_Return'] < 0]['Strategy_Return']
-            
-            win_rate = len(wins) / len(trade_days)
-            avg_win = wins.mean() if len(wins) > 0 else 0
-            avg_loss = abs(losses.mean()) if len(losses) > 0 else 1
-            profit_factor = avg_win / avg_loss if avg_loss != 0 else 0
-            
-            if profit_factor > 0:
-                kelly = win_rate - ((1 - win_rate) / profit_factor)
-            else:
-                kelly = 0
-        
-        # 6. 新增專業指標
-        df['Drawdown'] = (df['Equity'] / df['Equity'].cummax()) - 1
-        max_drawdown = df['Drawdown'].min()
-
-        num_years = len(df) / 252
-        total_return = df['Equity'].iloc[-1] / initial_capital - 1
-        cagr = ((1 + total_return) ** (1 / num_years)) - 1 if num_years > 0 else 0
-
-        risk_free_rate = 0.02
-        daily_returns = df['Strategy_Return'].dropna()
-        if daily_returns.std() > 0:
-            sharpe_ratio = (daily_returns.mean() * 252 - risk_free_rate) / (daily_returns.std() * np.sqrt(252))
-        else:
-            sharpe_ratio = 0.0
-
-        return {
-            "cagr": cagr, "sharpe_ratio": sharpe_ratio, "max_drawdown": max_drawdown,
-            "win_rate": win_rate, "profit_factor": profit_factor, "kelly": max(0, kelly),
-            "equity_curve": df['Equity'], "drawdown_series": df['Drawdown'],
-            "latest_price": df['Close'].iloc[-1]
-        }
+        # 結果庫: 同代號/參數且 K 棒未變 → 直接取回指標與權益曲線
+        store = get_result_store()
+        store_params = {"ticker": original_ticker, "start_date": str(start_date), "initial_capital": initial_capital}
+        data_fp = data_fingerprint(df)
+        stored = store.get(FAST_STRATEGY_ID, store_params, data_fp)
+        if stored:
+            return join_curves(stored)
+
+        # 3. 策略信號與績效 (batch_backtest.trend_backtest，與 4.2 批次回測共用)
+        result = trend_backtest(df, initial_capital)
+        if result:
+            store.put(FAST_STRATEGY_ID, store_params, data_fp, *split_curves(result))
+        return result
     except Exception:
         return None
 
 # --- [V81.1] 效能補丁: 10 分鐘戰術緩存 ---
+# 引擎與 DataFrame 本身不參與雜湊 (底線參數)，改以內容指紋與設定指紋作為快取鍵：
+# 同一份清單重新上傳會命中，資料或設定一改就失效。
 @st.cache_data(ttl=600)
+def _cached_macro_data(_macro, _df, data_key, config_key):
+    return _macro.check_market_status(cb_df=_df)
+
 def get_macro_data(_macro, _df):
     """快取宏觀風控數據"""
-    return _macro.check_market_status(cb_df=_df)
+    return _cached_macro_data(_macro, _df, frame_fingerprint(_df), config_fingerprint())
 
-@st.cache_data(ttl=600)
 def get_scan_result(_strat, _df):
-    """快取策略掃描結果"""
-    return _strat.scan_entire_portfolio(_df)
+    """
+    策略掃描 (增量掃描：只重算異動的 CB 列)。
+    不經 st.cache_data: 快取命中會跳過掃描，引擎的 last_enriched / last_scan_stats 仍停在上一份清單；
+    同一份清單的重用由 scan_incremental 的逐列指紋負責。
+    """
+    return _strat.scan_incremental(_df)
+
+@st.cache_data(ttl=7200)
+def _cached_bootstrap(_returns, data_key, n_paths, block, horizon_years):
+    return TitanMonteCarlo(n_paths=n_paths, block=block, seed=42).from_returns(_returns, horizon_years=horizon_years)
+
+def get_bootstrap(returns, n_paths=10000, block=20, horizon_years=10):
+    """快取日報酬區塊重抽樣 (以報酬序列指紋為鍵，切換標的或重繪頁面不重算)"""
+    return _cached_bootstrap(returns, frame_fingerprint(returns.to_frame().reset_index()), n_paths, block, horizon_years)
 
 @st.cache_data(ttl=7200)
 def run_stress_test(portfolio_text):
@@ -340,9 +328,9 @@ def run_stress_test(portfolio_text):
 
 # ==================== Tab 4.3 均線戰法回測引擎 ====================
 @st.cache_data(ttl=7200)
-def run_ma_strategy_backtest(ticker, strategy_name, start_date="2015-01-01", initial_capital=1000000):
+def run_ma_strategy_lab(ticker, start_date="2015-01-01", initial_capital=1000000):
     """
-    【Tab 4.3 核心】執行 15 種均線策略回測
+    【Tab 4.3 核心】一次執行全部 15 種均線策略回測 (只下載一次、均線只算一次)
     
     策略列表：
     1-5: 價格穿越單一均線 (20, 43, 60, 87, 284MA)
@@ -350,6 +338,9 @@ def run_ma_strategy_backtest(ticker, strategy_name, start_date="2015-01-01", ini
     7-13: 均線交叉策略 (20/60, 20/87, 20/284, 43/87, 43/284, 60/87, 60/284)
     14: 核心戰法 (87MA ↗ 284MA)
     15: 雙確認 (P>20 & P>60 進 / P<60 出)
+    
+    訊號矩陣 (日期 × 15 策略) 由向量化狀態機一次求解，權益/CAGR/回撤亦以矩陣同時計算；
+    回傳依策略順序排列的結果清單 (格式同 run_ma_strategy_backtest)。
     """
     try:
         # 智慧代碼處理 (與主回測函數一致)
@@ -363,101 +354,54 @@ def run_ma_strategy_backtest(ticker, strategy_name, start_date="2015-01-01", ini
                 ticker_two = f"{original_ticker}.TWO"
                 df = yf.download(ticker_two, start=start_date, progress=False)
             if df.empty:
-                return None
+                return []
         
         if isinstance(df.columns, pd.MultiIndex):
             df.columns = df.columns.get_level_values(0)
         
-        if df.empty or len(df) < 300: return None  # 需要足夠數據計算 284MA
-        
-        # 計算所有需要的均線
-        df['MA20'] = df['Close'].rolling(window=20).mean()
-        df['MA43'] = df['Close'].rolling(window=43).mean()
-        df['MA60'] = df['Close'].rolling(window=60).mean()
-        df['MA87'] = df['Close'].rolling(window=87).mean()
-        df['MA284'] = df['Close'].rolling(window=284).mean()
-        
-        # 策略邏輯分派
-        df['Signal'] = 0
-        
-        if strategy_name == "價格 > 20MA":
-            df.loc[df['Close'] > df['MA20'], 'Signal'] = 1
-        elif strategy_name == "價格 > 43MA":
-            df.loc[df['Close'] > df['MA43'], 'Signal'] = 1
-        elif strategy_name == "價格 > 60MA":
-            df.loc[df['Close'] > df['MA60'], 'Signal'] = 1
-        elif strategy_name == "價格 > 87MA":
-            df.loc[df['Close'] > df['MA87'], 'Signal'] = 1
-        elif strategy_name == "價格 > 284MA":
-            df.loc[df['Close'] > df['MA284'], 'Signal'] = 1
-        
-        elif strategy_name == "非對稱: P>20進 / P<60出":
-            # 進場：價格突破 20MA
-            # 出場：價格跌破 60MA
-            in_position = False
-            for i in range(1, len(df)):
-                if not in_position and df['Close'].iloc[i] > df['MA20'].iloc[i]:
-                    in_position = True
-                elif in_position and df['Close'].iloc[i] < df['MA60'].iloc[i]:
-                    in_position = False
-                df.iloc[i, df.columns.get_loc('Signal')] = 1 if in_position else 0
-        
-        elif strategy_name == "20/60 黃金/死亡交叉":
-            df['Signal'] = 0
-            df.loc[df['MA20'] > df['MA60'], 'Signal'] = 1
-        elif strategy_name == "20/87 黃金/死亡交叉":
-            df.loc[df['MA20'] > df['MA87'], 'Signal'] = 1
-        elif strategy_name == "20/284 黃金/死亡交叉":
-            df.loc[df['MA20'] > df['MA284'], 'Signal'] = 1
-        elif strategy_name == "43/87 黃金/死亡交叉":
-            df.loc[df['MA43'] > df['MA87'], 'Signal'] = 1
-        elif strategy_name == "43/284 黃金/死亡交叉":
-            df.loc[df['MA43'] > df['MA284'], 'Signal'] = 1
-        elif strategy_name == "60/87 黃金/死亡交叉":
-            df.loc[df['MA60'] > df['MA87'], 'Signal'] = 1
-        elif strategy_name == "60/284 黃金/死亡交叉":
-            df.loc[df['MA60'] > df['MA284'], 'Signal'] = 1
-        
-        elif strategy_name == "🔥 核心戰法: 87MA ↗ 284MA":
-            # 進場：87MA 向上穿越 284MA
-            # 出場：87MA 向下穿越 284MA
-            df.loc[df['MA87'] > df['MA284'], 'Signal'] = 1
-        
-        elif strategy_name == "雙確認: P>20 & P>60 進 / P<60 出":
-            in_position = False
-            for i in range(1, len(df)):
-                if not in_position and (df['Close'].iloc[i] > df['MA20'].iloc[i] and df['Close'].iloc[i] > df['MA60'].iloc[i]):
-                    in_position = True
-                elif in_position and df['Close'].iloc[i] < df['MA60'].iloc[i]:
-                    in_position = False
-                df.iloc[i, df.columns.get_loc('Signal')] = 1 if in_position else 0
+        if df.empty or len(df) < 300: return []  # 需要足夠數據計算 284MA
         
-        # 績效計算
-        df['Pct_Change'] = df['Close'].pct_change()
-        df['Strategy_Return'] = df['Signal'].shift(1) * df['Pct_Change']
-        df['Equity'] = (1 + df['Strategy_Return'].fillna(0)).cumprod() * initial_capital
-        df['Drawdown'] = (df['Equity'] / df['Equity'].cummax()) - 1
+        # 結果庫: 策略清單 (名稱) 也納入參數，新增/改名戰法即重算
+        store = get_result_store()
+        store_params = {"ticker": original_ticker, "start_date": str(start_date),
+                        "initial_capital": initial_capital, "strategies": list(MA_STRATEGY_RULES)}
+        data_fp = data_fingerprint(df)
+        stored = store.get("ma_lab", store_params, data_fp)
+        if stored:
+            return [{**row, "equity_curve": stored['curves'][f"{row['strategy_name']}|Equity"].rename('Equity'),
+                     "drawdown_series": stored['curves'][f"{row['strategy_name']}|Drawdown"].rename('Drawdown')}
+                    for row in stored['metrics']]
         
-        # 計算 CAGR
-        num_years = len(df) / 252
-        total_return = df['Equity'].iloc[-1] / initial_capital - 1
-        cagr = ((1 + total_return) ** (1 / num_years)) - 1 if num_years > 0 else 0
+        close = df['Close'].to_numpy(dtype=float)
+        names, positions = ma_strategy_matrix(close)
+        perf = backtest_positions(close, positions, initial_capital)
         
-        # 財富推演：未來 10 年預期
-        future_10y_capital = initial_capital * ((1 + cagr) ** 10)
-        
-        return {
-            "strategy_name": strategy_name,
-            "cagr": cagr,
-            "final_equity": df['Equity'].iloc[-1],
-            "max_drawdown": df['Drawdown'].min(),
-            "equity_curve": df['Equity'],
-            "drawdown_series": df['Drawdown'],
-            "future_10y_capital": future_10y_capital,
-            "num_years": num_years
-        }
+        rows, curves = [], {}
+        for j, name in enumerate(names):
+            cagr = float(perf['cagr'][j])
+            rows.append({
+                "strategy_name": name,
+                "cagr": cagr,
+                "final_equity": float(perf['final_equity'][j]),
+                "max_drawdown": float(perf['max_drawdown'][j]),
+                "sharpe": float(perf['sharpe'][j]),
+                "calmar": float(perf['calmar'][j]),
+                # 財富推演：未來 10 年預期
+                "future_10y_capital": initial_capital * ((1 + cagr) ** 10),
+                "num_years": float(perf['num_years'])
+            })
+            curves[f"{name}|Equity"] = pd.Series(perf['equity'][:, j], index=df.index, name='Equity')
+            curves[f"{name}|Drawdown"] = pd.Series(perf['drawdown'][:, j], index=df.index, name='Drawdown')
+        store.put("ma_lab", store_params, data_fp, rows, curves)
+        return [{**row, "equity_curve": curves[f"{row['strategy_name']}|Equity"],
+                 "drawdown_series": curves[f"{row['strategy_name']}|Drawdown"]} for row in rows]
     except Exception as e:
-        return None
+        return []
+
+def run_ma_strategy_backtest(ticker, strategy_name, start_date="2015-01-01", initial_capital=1000000):
+    """單一策略查詢 (取自 run_ma_strategy_lab 的同一次計算結果)"""
+    results = run_ma_strategy_lab(ticker, start_date, initial_capital)
+    return next((res for res in results if res['strategy_name'] == strategy_name), None)
 
 # ==========================================
 # [Helper Functions] Core Logic & Safety
@@ -947,64 +891,37 @@ def render_radar():
                     if 'issue_date' not in work_df.columns and 'list_date' in work_df.columns:
                         work_df['issue_date'] = work_df['list_date']
 
-                    # 2. 普查迴圈
+                    # 2. 普查：重用策略引擎的共用行情面板 (掃描時已批次下載)，均線以向量化欄位一次算完
                     scan_results_df = get_scan_result(strategy, work_df)
-                    records = scan_results_df.to_dict('records')
-                    
-                    total = len(records)
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    enriched_data = []
-                    
-                    for i, row in enumerate(records):
-                        name = row.get('name', '')
-                        status_text.text(f"普查進行中 ({i+1}/{total}): {name}...")
-                        
-                        code = str(row.get('stock_code', '')).strip()
-                        row['stock_price_real'] = 0.0
-                        row['ma87'] = 0.0
-                        row['ma284'] = 0.0
-                        row['trend_status'] = "⚠️ 資料不足"
-                        
-                        # 數據傳遞：確保關鍵數據寫入
-                        row['cb_price'] = row.get('price', 0.0)
-                        row['conv_price_val'] = row.get('conv_price', 0.0)
-                        row['conv_value_val'] = row.get('conv_value', 0.0)
+                    scan_stats = strategy.last_scan_stats
+                    if scan_stats:
+                        st.caption(f"⚡ 增量掃描：重新評分 {scan_stats['rescored']}/{scan_stats['rows']} 檔，重新下載 {scan_stats['refetched']} 檔標的歷史。")
 
-                        if code:
-                            try:
-                                hist = pd.DataFrame()
-                                try: hist = yf.Ticker(f"{code}.TW").history(period="2y")
-                                except: pass
-                                
-                                if hist.empty:
-                                    try: hist = yf.Ticker(f"{code}.TWO").history(period="2y")
-                                    except: pass
-                                    
-                                if not hist.empty and len(hist) > 284:
-                                    curr = float(hist['Close'].iloc[-1])
-                                    ma87 = float(hist['Close'].rolling(87).mean().iloc[-1])
-                                    ma284 = float(hist['Close'].rolling(284).mean().iloc[-1])
-                                    
-                                    row['stock_price_real'] = curr
-                                    row['ma87'] = ma87
-                                    row['ma284'] = ma284
-                                    
-                                    # [關鍵修正]：只要 87MA > 284MA 即判定為中期多頭 (不強制現價 > 87)
-                                    if ma87 > ma284:
-                                        row['trend_status'] = "✅ 中期多頭"
-                                        row['score'] = min(100, row.get('score', 0) + 20)
-                                    else:
-                                        row['trend_status'] = "整理/空頭"
-                            except: pass
-                        
-                        enriched_data.append(row)
-                        progress_bar.progress((i + 1) / total)
+                    status_text = st.empty()
+                    status_text.text(f"普查進行中：{len(scan_results_df)} 檔標的均線計算...")
+
+                    full_df_enriched = scan_results_df.copy()
+                    # 數據傳遞：確保關鍵數據寫入
+                    full_df_enriched['cb_price'] = full_df_enriched['price'] if 'price' in full_df_enriched.columns else 0.0
+                    full_df_enriched['conv_price_val'] = full_df_enriched['conv_price'] if 'conv_price' in full_df_enriched.columns else 0.0
+                    full_df_enriched['conv_value_val'] = full_df_enriched['conv_value'] if 'conv_value' in full_df_enriched.columns else 0.0
+
+                    census_codes = full_df_enriched.get('stock_code', pd.Series('', index=full_df_enriched.index)).fillna('').astype(str).str.strip()
+                    closes = strategy.price_panel.close_panel([c for c in census_codes.unique() if c], period="2y")
+                    trend = trailing_stats(closes, [87, 284]).reindex(census_codes.to_numpy())
+
+                    enough = (trend['count'] > 284).fillna(False).to_numpy()
+                    full_df_enriched['stock_price_real'] = np.where(enough, trend['last'], 0.0)
+                    full_df_enriched['ma87'] = np.where(enough, trend['ma87'], 0.0)
+                    full_df_enriched['ma284'] = np.where(enough, trend['ma284'], 0.0)
+
+                    # [關鍵修正]：只要 87MA > 284MA 即判定為中期多頭 (不強制現價 > 87)
+                    is_bull = enough & (full_df_enriched['ma87'] > full_df_enriched['ma284']).to_numpy()
+                    full_df_enriched['trend_status'] = np.select([is_bull, enough], ["✅ 中期多頭", "整理/空頭"], default="⚠️ 資料不足")
+                    base_score = pd.to_numeric(full_df_enriched.get('score', 0), errors='coerce').fillna(0)
+                    full_df_enriched['score'] = np.where(is_bull, np.minimum(100, base_score + 20), base_score)
                     
                     # 3. 資料分流
-                    full_df_enriched = pd.DataFrame(enriched_data)
-                    
                     # 確保有必要的欄位供後續篩選
                     if 'price' not in full_df_enriched.columns: full_df_enriched['price'] = 0.0
                     if 'conv_rate' not in full_df_enriched.columns: full_df_enriched['conv_rate'] = 0.0
@@ -1018,6 +935,8 @@ def render_radar():
                     
                     st.session_state['scan_results'] = sop_results
                     st.session_state['full_census_data'] = full_df_enriched.to_dict('records')
+                    # 每日快照持久化 (供 2.5 日對日差異比對)
+                    TitanScanHistory().save(full_df_enriched)
                     
                     status_text.text("✅ 普查完成！資料已同步至戰情室與全系統。")
                     st.success(f"全市場掃描結束。符合「SOP 黃金標準」共 {len(sop_results)} 檔。")
@@ -1697,6 +1616,110 @@ def render_radar():
         else:
             st.info("請先執行本頁上方的掃描以獲取買進建議。")
 
+    with st.expander("2.5 每日快照差異 (Day-over-Day Diff)", expanded=False):
+        history = TitanScanHistory()
+        snapshot_dates = history.dates()
+        if len(snapshot_dates) < 2:
+            st.info("至少需要兩天的普查快照才能比較 (每次執行 2.1 普查會自動存檔)。")
+        else:
+            d_col1, d_col2 = st.columns(2)
+            new_date = d_col1.selectbox("比較日", snapshot_dates[::-1], index=0, key="snap_new_date")
+            older = [d for d in snapshot_dates if d < new_date][::-1]
+            if not older:
+                st.info("所選日期之前沒有快照。")
+            else:
+                old_date = d_col2.selectbox("基準日", older, index=0, key="snap_old_date")
+                snap_diff = history.diff(new_date, old_date)
+
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("🆕 新進強力買進", len(snap_diff['new_entries']))
+                m2.metric("📤 掉出強力買進", len(snap_diff['dropouts']))
+                m3.metric("➕ 新掛牌 CB", len(snap_diff['listed']))
+                m4.metric("➖ 消失 CB", len(snap_diff['delisted']))
+
+                st.markdown(f"**🆕 新進「🔥 強力買進」({old_date} → {new_date})**")
+                st.dataframe(snap_diff['new_entries'], use_container_width=True)
+                st.markdown("**📤 掉出「🔥 強力買進」**")
+                st.dataframe(snap_diff['dropouts'], use_container_width=True)
+                st.markdown("**📊 分數變化 (依變動幅度排序)**")
+                st.dataframe(snap_diff['score_delta'][snap_diff['score_delta']['score_delta'] != 0].head(50), use_container_width=True)
+
+    with st.expander("2.6 盤中即時模式 (Intraday Replay)", expanded=False):
+        st.caption("以最近一次普查的日線條件為底，逐筆套用盤中報價 (CSV: ts,symbol,price)；只重算受影響的 CB 並列出變化事件。")
+        if strategy.last_enriched.empty:
+            st.info("請先執行 2.1 全市場普查，建立即時模式的底稿。")
+        else:
+            f_quotes = st.file_uploader("上傳報價回放檔 (CSV)", type=['csv'], key="rt_quote_file")
+            if f_quotes is not None and st.button("▶️ 開始回放", key="rt_replay_btn"):
+                rt_state = TitanRealtimeState.from_strategy(strategy)
+                rt_events = []
+                rt_state.subscribe(rt_events.append)
+
+                # 警示引擎: 先以收盤底稿建立基準狀態 (prime: 不發送、不佔冷卻與限流)，回放期間只推播新成立的進出場條件
+                alert_engine = TitanAlertEngine()
+                alert_engine.on_snapshot(strategy.last_enriched, prime=True)
+                rt_alerts = MemoryAlertSink()
+                alert_engine.add_sink(rt_alerts)
+                alert_engine.add_sink(FileAlertSink())
+                rt_state.subscribe(alert_engine.on_event)
+
+                n_quotes = rt_state.run(ReplayQuoteSource(f_quotes))
+                st.success(f"回放完成：{n_quotes} 筆報價，{len(rt_events)} 筆變化事件，{len(rt_alerts)} 則 SOP 警示 (抑制 {alert_engine.suppressed} 則)。")
+                if rt_alerts:
+                    st.markdown("**🚨 SOP 進出場警示**")
+                    st.dataframe(pd.DataFrame(rt_alerts)[['ts', 'level', 'key', 'name', 'message']], use_container_width=True)
+                if rt_events:
+                    ev_df = pd.DataFrame([{
+                        "時間": e['ts'], "代號": e['code'], "名稱": e['name'],
+                        "變化": ", ".join(e['changes']), "CB 價": e['price'], "現股": e['stock_price'],
+                        "溢價率": e['premium'], "評分": e['score'], "建議": e['action']
+                    } for e in rt_events])
+                    st.dataframe(ev_df, use_container_width=True)
+                st.session_state['realtime_state'] = rt_state
+                st.session_state['alert_engine'] = alert_engine
+
+    with st.expander("2.7 CB 理論價值排行 (Fair Value Ranking)", expanded=False):
+        st.caption("以二元樹 (含賣回條款) 批次計算全清單理論價值；評價落差 = (理論價 - 市價) / 市價，正值代表市價低於理論價。")
+        if strategy.last_enriched.empty or 'valuation_gap' not in strategy.last_enriched.columns:
+            st.info("請先執行 2.1 全市場普查。")
+        else:
+            ranked = TitanCBPricer.rank(strategy.last_enriched)
+            fv_df = ranked[['code', 'name', 'price', 'fair_value', 'bond_floor', 'valuation_gap', 'cb_delta', 'hedge_ratio', 'volatility', 'premium', 'score']].rename(columns={
+                'code': '代號', 'name': '名稱', 'price': 'CB 價', 'fair_value': '理論價', 'bond_floor': '債底',
+                'valuation_gap': '評價落差%', 'cb_delta': 'Delta', 'hedge_ratio': '避險比率', 'volatility': '波動率',
+                'premium': '溢價率%', 'score': 'SOP 評分'
+            })
+            st.dataframe(fv_df.round(3), use_container_width=True)
+
+    with st.expander("2.8 標的相對強度排行 (Relative Strength)", expanded=False):
+        st.caption("多週期報酬 (20/60/120/250 日) 百分位加權為綜合 RS；族群內 RS 落後者即潛在風口豬。每日只增量抓取近 5 日行情。")
+        if strategy.last_enriched.empty:
+            st.info("請先執行 2.1 全市場普查。")
+        else:
+            cb_sectors = (strategy.last_enriched[['stock_code', 'sector']].dropna()
+                          .assign(stock_code=lambda d: d['stock_code'].astype(str).str.strip())
+                          .drop_duplicates('stock_code').set_index('stock_code')['sector'].to_dict())
+            if st.button("📈 更新相對強度", key="rs_update_btn"):
+                rs_engine = st.session_state.get('rs_engine') or TitanRelativeStrength(strategy.price_panel)
+                with st.spinner("計算相對強度..."):
+                    rs_engine.update(list(cb_sectors), cb_sectors)
+                st.session_state['rs_engine'] = rs_engine
+
+            rs_engine = st.session_state.get('rs_engine')
+            if rs_engine is not None and not rs_engine.table.empty:
+                rs_cols = ['rs_rating', 'rs_composite', 'ret_20d', 'ret_60d', 'ret_120d', 'ret_250d', 'sector', 'sector_rank_pct']
+                rs_sectors = ["全部"] + rs_engine.sector_summary().index.tolist()
+                rs_pick = st.selectbox("族群", rs_sectors, key="rs_sector_pick")
+                if rs_pick == "全部":
+                    st.dataframe(rs_engine.query(50)[rs_cols].round(2), use_container_width=True)
+                else:
+                    rs_split = rs_engine.sector_split(rs_pick)
+                    c_lead, c_lag = st.columns(2)
+                    c_lead.markdown("**🚀 族群領漲**")
+                    c_lead.dataframe(rs_split['leaders'][rs_cols].round(2), use_container_width=True)
+                    c_lag.markdown("**🐷 族群落後 (補漲候選)**")
+                    c_lag.dataframe(rs_split['laggards'][rs_cols].round(2), use_container_width=True)
+
 # --- 🎯 單兵狙擊 (Sniper) ---
 @st.fragment
 def render_sniper_tab():
@@ -2185,16 +2208,31 @@ def render_decision():
             if portfolio_df.empty:
                 st.warning("請先在 4.1 配置您的戰略資產。")
             else:
-                with st.spinner("正在對全球資產執行回測..."):
-                    backtest_results = []
-                    for index, row in portfolio_df.iterrows():
-                        ticker = str(row['資產代號']).strip()
-                        result = run_fast_backtest(ticker, initial_capital=1000000)
-                        if result:
-                            result['Ticker'] = ticker
-                            backtest_results.append(result)
-                    
-                    st.session_state.backtest_results = backtest_results
+                # 批次回測: 一次下載計畫 + 行程池平行模擬，逐檔完成即回報
+                tickers = [t for t in dict.fromkeys(str(t).strip() for t in portfolio_df['資產代號']) if t]
+                progress = st.progress(0.0, text="正在下載全球資產行情...")
+                live_table = st.empty()
+                finished = {}
+                engine = TitanBatchBacktest(panel=strategy.price_panel, store=get_result_store())
+                for ticker, result in engine.run(tickers, initial_capital=1000000):
+                    finished[ticker] = result
+                    progress.progress(len(finished) / len(tickers), text=f"已完成 {len(finished)}/{len(tickers)}：{ticker}")
+                    live_table.dataframe(pd.DataFrame([
+                        {'代號': t, '年化報酬 (CAGR)': r['cagr'] if r else None,
+                         '最大回撤': r['max_drawdown'] if r else None, '狀態': '✅' if r else '❌ 無資料'}
+                        for t, r in finished.items()
+                    ]), use_container_width=True)
+                progress.empty()
+                live_table.empty()
+
+                # 依投資組合原順序呈現
+                backtest_results = []
+                for ticker in tickers:
+                    result = finished.get(ticker)
+                    if result:
+                        result['Ticker'] = ticker
+                        backtest_results.append(result)
+                st.session_state.backtest_results = backtest_results
 
         if 'backtest_results' in st.session_state:
             results = st.session_state.backtest_results
@@ -2215,7 +2253,10 @@ def render_decision():
                         '最新價': res['latest_price'],
                         '年化報酬 (CAGR)': res['cagr'],
                         '投資性價比 (Sharpe)': res['sharpe_ratio'],
+                        'Sortino': res['sortino_ratio'],
                         '最大回撤': res['max_drawdown'],
+                        '最長套牢 (日)': res['max_drawdown_days'],
+                        'Calmar': res['calmar'],
                         '凱利建議 %': conservative_kelly,
                         '建議動作': advice
                     })
@@ -2225,7 +2266,9 @@ def render_decision():
                     '最新價': '{:.2f}',
                     '年化報酬 (CAGR)': '{:.2%}',
                     '投資性價比 (Sharpe)': '{:.2f}',
+                    'Sortino': '{:.2f}',
                     '最大回撤': '{:.2%}',
+                    'Calmar': '{:.2f}',
                     '凱利建議 %': '{:.2%}',
                 }), use_container_width=True)
                 st.divider()
@@ -2259,6 +2302,110 @@ def render_decision():
                         fig_drawdown.update_yaxes(ticksuffix="%")
                         st.plotly_chart(fig_drawdown, use_container_width=True)
 
+                        st.markdown("**🎲 蒙地卡羅穩健度 (10,000 條 10 年路徑，20 日區塊重抽日報酬)**")
+                        mc_returns = selected_result['equity_curve'].pct_change().dropna()
+                        mc_result = get_bootstrap(mc_returns)
+                        if mc_result:
+                            mc_c1, mc_c2 = st.columns([1, 2])
+                            mc_c1.metric("10 年虧損機率", f"{mc_result['prob_loss']:.1%}")
+                            mc_c1.dataframe(mc_result['bands'].rename(index={'cagr': '年化報酬', 'mdd': '最大回撤', 'kelly': '凱利值'})
+                                            .style.format('{:.2%}'), use_container_width=True)
+                            mc_fan = mc_result['fan'] * 1000000
+                            mc_fan.index.name = '年'
+                            fig_fan = px.line(mc_fan, title=f"{selected_ticker} 權益百分位扇形圖 (初始 1,000,000)",
+                                              labels={'value': '資金 (元)', 'variable': '百分位'})
+                            mc_c2.plotly_chart(fig_fan, use_container_width=True)
+                        else:
+                            st.caption("報酬樣本不足，無法進行重抽樣。")
+
+        st.divider()
+        st.subheader("📦 組合回測 (Portfolio Backtest)")
+        st.caption("多檔標的共用同一筆資金與日期軸；訊號轉弱即出場，有空位才進場。")
+        pf_universe = st.radio("標的池", ["4.1 戰略資產", "CB 普查標的 (SOP)"], horizontal=True, key="pf_universe")
+        pf_c1, pf_c2, pf_c3 = st.columns(3)
+        pf_sizing = pf_c1.selectbox("部位配置", ["equal", "half_kelly", "score"],
+                                    format_func={"equal": "等權重", "half_kelly": "半凱利", "score": "SOP 評分加權"}.get, key="pf_sizing")
+        pf_max = pf_c2.number_input("最大同時持股數", min_value=1, max_value=50, value=10, key="pf_max_positions")
+        pf_strategy = pf_c3.selectbox("進出場訊號", list(MA_STRATEGY_RULES.keys()), index=list(MA_STRATEGY_RULES.keys()).index("價格 > 87MA"), key="pf_strategy")
+
+        if st.button("🧮 執行組合回測", key="pf_run_btn"):
+            pf_scores = None
+            if pf_universe == "4.1 戰略資產":
+                pf_source = st.session_state.get('portfolio_df', pd.DataFrame())
+                pf_codes = [] if pf_source.empty else [str(c).strip() for c in pf_source['資產代號'] if str(c).strip().upper() not in ['CASH', 'USD', 'TWD']]
+            else:
+                pf_enriched = strategy.last_enriched
+                pf_codes = [] if pf_enriched.empty else pf_enriched['stock_code'].astype(str).str.strip().unique().tolist()
+                if not pf_enriched.empty:
+                    pf_scores = pf_enriched.assign(stock_code=pf_enriched['stock_code'].astype(str).str.strip()).groupby('stock_code')['score'].max().to_dict()
+            if not pf_codes:
+                st.warning("標的池為空：請先配置 4.1 資產或執行 2.1 全市場普查。")
+            else:
+                with st.spinner(f"批次下載 {len(pf_codes)} 檔並模擬組合..."):
+                    backtester.panel = strategy.price_panel
+                    st.session_state.portfolio_backtest = backtester.run_portfolio(
+                        pf_codes, start_date="2020-01-01", strategy_name=pf_strategy,
+                        sizing=pf_sizing, max_positions=int(pf_max), scores=pf_scores
+                    )
+
+        pf_result = st.session_state.get('portfolio_backtest')
+        if pf_result:
+            pf_stats = pf_result['stats']
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("期末資金", f"{pf_stats['final_equity']:,.0f}")
+            m2.metric("年化報酬 (CAGR)", f"{pf_stats['cagr']:.2%}")
+            m3.metric("最大回撤", f"{pf_stats['max_drawdown']:.2%}")
+            m4.metric("已平倉交易 / 勝率", f"{pf_stats['trades']} / {pf_stats['win_rate']:.1%}")
+            pf_eq = pf_result['equity'].reset_index()
+            pf_eq.columns = ['Date', 'Equity']
+            st.plotly_chart(px.line(pf_eq, x='Date', y='Equity', title="組合權益曲線 (Portfolio Equity)"), use_container_width=True)
+            st.markdown("**📒 交易明細 (Trade Blotter)**")
+            st.dataframe(pf_result['blotter'].style.format({
+                'entry_price': '{:.2f}', 'exit_price': '{:.2f}', 'shares': '{:,.0f}',
+                'cost': '{:,.0f}', 'pnl': '{:+,.0f}', 'roi': '{:.2%}'
+            }), use_container_width=True)
+
+        st.divider()
+        st.subheader("🎯 CB 真實價格 SOP 回測")
+        st.caption("以本地 CB 日價格庫回測：CB 價 106-110 (且不超過 115) 且標的站上 87MA 進場；CB 價達 152 或標的跌破 87MA 出場。")
+        cb_hist = TitanCBHistory()
+        cbh_c1, cbh_c2 = st.columns([2, 1])
+        cbh_file = cbh_c1.file_uploader("匯入 CB 日價格 CSV (長格式: 日期/代號/收盤價；或寬格式: 日期 × 代號)", type=['csv'], key="cb_history_csv")
+        if cbh_file is not None and st.session_state.get('cb_history_csv_name') != cbh_file.name:
+            try:
+                st.success(f"✅ 匯入 {cb_hist.import_csv(cbh_file)} 筆 CB 日價格")
+                st.session_state['cb_history_csv_name'] = cbh_file.name
+            except Exception as e:
+                st.error(f"CSV 匯入失敗: {e}")
+        if cbh_c2.button("📚 由普查快照回補", key="cb_history_backfill"):
+            st.info(f"回補 {cb_hist.backfill_from_scans(TitanScanHistory())} 筆")
+        cbh_summary = cb_hist.summary()
+        if cbh_summary.empty:
+            st.info("CB 日價格庫目前為空：上傳 CB 清單、匯入 CSV 或由普查快照回補後即可回測。")
+        else:
+            st.caption(f"庫存 {len(cbh_summary)} 檔 CB、{len(cb_hist.dates)} 個交易日 ({cb_hist.dates[0]} ~ {cb_hist.dates[-1]})")
+            cbh_max = st.number_input("最大同時持有 CB 數", min_value=1, max_value=50, value=10, key="cbh_max_positions")
+            if st.button("🎯 執行 CB SOP 回測", key="cbh_run_btn"):
+                with st.spinner("全部 CB 一次回測中..."):
+                    backtester.panel = strategy.price_panel
+                    st.session_state.cb_sop_backtest = backtester.run_cb_sop(cb_hist, max_positions=int(cbh_max))
+            cbh_result = st.session_state.get('cb_sop_backtest')
+            if cbh_result:
+                cbh_stats = cbh_result['stats']
+                c1, c2, c3, c4 = st.columns(4)
+                c1.metric("期末資金", f"{cbh_stats['final_equity']:,.0f}")
+                c2.metric("年化報酬 (CAGR)", f"{cbh_stats['cagr']:.2%}")
+                c3.metric("最大回撤", f"{cbh_stats['max_drawdown']:.2%}")
+                c4.metric("已平倉交易 / 勝率", f"{cbh_stats['trades']} / {cbh_stats['win_rate']:.1%}")
+                cbh_eq = cbh_result['equity'].reset_index()
+                cbh_eq.columns = ['Date', 'Equity']
+                st.plotly_chart(px.line(cbh_eq, x='Date', y='Equity', title="CB SOP 組合權益曲線"), use_container_width=True)
+                cbh_signals = cbh_result['signals']
+                st.markdown("**出場原因分布 (訊號層級，全部 CB)**")
+                st.dataframe(cbh_signals.groupby('reason')['roi'].agg(['count', 'mean']).rename(columns={'count': '次數', 'mean': '平均報酬'})
+                             .style.format({'平均報酬': '{:.2%}'}), use_container_width=True)
+                st.dataframe(cbh_signals.style.format({'entry_price': '{:.2f}', 'exit_price': '{:.2f}', 'roi': '{:.2%}'}), use_container_width=True)
+
     # ==================== 4.3 均線戰法回測實驗室 [V81 匯出] ====================
     with st.expander("4.3 🧪 均線戰法回測實驗室 (MA Strategy Lab)", expanded=False):
         st.info("選擇一檔標的，自動執行 15 種均線策略回測，推演 10 年財富變化。")
@@ -2280,14 +2427,8 @@ def render_decision():
             
             if st.button("🔬 啟動 15 種均線實驗", key="start_ma_lab"):
                 with st.spinner(f"正在對 {selected_lab_ticker} 執行 15 種均線策略回測..."):
-                    ma_results = []
-                    for strategy in ma_strategies:
-                        result = run_ma_strategy_backtest(
-                            ticker=selected_lab_ticker, strategy_name=strategy,
-                            start_date="2015-01-01", initial_capital=1000000
-                        )
-                        if result: ma_results.append(result)
-                    st.session_state.ma_lab_results = ma_results
+                    lab_results = run_ma_strategy_lab(selected_lab_ticker, start_date="2015-01-01", initial_capital=1000000)
+                    st.session_state.ma_lab_results = [res for res in lab_results if res['strategy_name'] in ma_strategies]
             
             if 'ma_lab_results' in st.session_state and st.session_state.get('ma_lab_ticker') == selected_lab_ticker:
                 results = st.session_state.ma_lab_results
@@ -2301,13 +2442,16 @@ def render_decision():
                         wealth_data.append({
                             '策略名稱': res['strategy_name'], '年化報酬 (CAGR)': res['cagr'],
                             '回測期末資金': res['final_equity'], '最大回撤': res['max_drawdown'],
+                            'Sharpe': res['sharpe'], 'Calmar': res['calmar'],
                             '未來 10 年預期資金': res['future_10y_capital'], '回測年數': res['num_years']
                         })
                     
                     wealth_df = pd.DataFrame(wealth_data).sort_values('年化報酬 (CAGR)', ascending=False)
+                    wealth_df.insert(0, '排名', range(1, len(wealth_df) + 1))
                     st.dataframe(wealth_df.style.format({
                         '年化報酬 (CAGR)': '{:.2%}', '回測期末資金': '{:,.0f}',
-                        '最大回撤': '{:.2%}', '未來 10 年預期資金': '{:,.0f}', '回測年數': '{:.1f}'
+                        '最大回撤': '{:.2%}', 'Sharpe': '{:.2f}', 'Calmar': '{:.2f}',
+                        '未來 10 年預期資金': '{:,.0f}', '回測年數': '{:.1f}'
                     }), use_container_width=True)
                     
                     output = io.BytesIO()
@@ -2342,6 +2486,66 @@ def render_decision():
                         fig_dd.update_yaxes(ticksuffix="%")
                         st.plotly_chart(fig_dd, use_container_width=True)
 
+            st.divider()
+            st.subheader("🗺️ 參數敏感度網格 (Grid Search)")
+            st.caption("以 4.1 全部戰略資產為標的池，掃描生命線 / 長期線週期組合 (進場: 價格 > 生命線 且 生命線 > 長期線；出場: 跌破生命線)。")
+            gs_c1, gs_c2 = st.columns(2)
+            gs_life = gs_c1.slider("生命線週期範圍", 20, 200, (40, 140), step=5, key="gs_life")
+            gs_long = gs_c2.slider("長期線週期範圍", 100, 500, (150, 400), step=25, key="gs_long")
+            if st.button("🧮 執行參數網格", key="gs_run_btn"):
+                gs_codes = [str(c).strip() for c in ticker_list if str(c).strip().upper() not in ['CASH', 'USD', 'TWD']]
+                gs_grid = build_grid(life=range(gs_life[0], gs_life[1] + 1, 5), long=range(gs_long[0], gs_long[1] + 1, 25))
+                with st.spinner(f"{len(gs_codes)} 檔 × {len(gs_grid)} 組參數回測中..."):
+                    gs_engine = TitanGridSearch.from_codes(gs_codes, start_date="2015-01-01", panel=strategy.price_panel)
+                    st.session_state.grid_search_results = gs_engine.run(gs_grid)
+
+            gs_results = st.session_state.get('grid_search_results')
+            if gs_results is not None and not gs_results.empty:
+                gs_metric = st.radio("熱圖指標", ["cagr", "mdd", "win_rate"], horizontal=True, key="gs_metric",
+                                     format_func={"cagr": "年化報酬", "mdd": "最大回撤", "win_rate": "勝率"}.get)
+                gs_pivot = TitanGridSearch.heatmap(gs_results, value=gs_metric)
+                fig_gs = px.imshow(gs_pivot, text_auto='.1%', aspect='auto', color_continuous_scale='RdYlGn',
+                                   labels={'x': '長期線', 'y': '生命線', 'color': gs_metric})
+                st.plotly_chart(fig_gs, use_container_width=True)
+                st.dataframe(gs_results[['life', 'long', 'cagr', 'mdd', 'win_rate', 'trades', 'exposure']]
+                             .sort_values('cagr', ascending=False).style.format({
+                                 'cagr': '{:.2%}', 'mdd': '{:.2%}', 'win_rate': '{:.1%}', 'exposure': '{:.1%}'
+                             }), use_container_width=True)
+
+            st.divider()
+            st.subheader("🚶 Walk-Forward 樣本外驗證")
+            st.caption("以 3 年訓練窗挑選最佳候選、於接下來 1 年樣本外持有，逐年滾動並串接樣本外權益；對照「全期回測最佳」同期間的表現。")
+            wf_c1, wf_c2 = st.columns(2)
+            wf_candidates = wf_c1.radio("候選集", ["15 種均線戰法", "均線週期網格"], horizontal=True, key="wf_candidates")
+            wf_metric = wf_c2.selectbox("訓練窗選擇指標", ["sharpe", "cagr", "calmar"], key="wf_metric")
+            if st.button("🚶 執行 Walk-Forward", key="wf_run_btn"):
+                wf_codes = [str(c).strip() for c in ticker_list if str(c).strip().upper() not in ['CASH', 'USD', 'TWD']]
+                with st.spinner(f"{len(wf_codes)} 檔標的滾動驗證中..."):
+                    wf_closes = strategy.price_panel.close_panel(wf_codes, start="2015-01-01")
+                    wf_engine = st.session_state.get('wf_engine') or TitanWalkForward()
+                    wf_engine.metric = wf_metric
+                    if wf_candidates == "均線週期網格":
+                        wf_streams = wf_engine.grid_streams(wf_closes, build_grid(life=range(gs_life[0], gs_life[1] + 1, 5), long=range(gs_long[0], gs_long[1] + 1, 25)))
+                    else:
+                        wf_streams = wf_engine.ma_streams(wf_closes)
+                    st.session_state.wf_engine = wf_engine
+                    st.session_state.wf_result = wf_engine.run(wf_streams) if not wf_closes.empty else {}
+
+            wf_result = st.session_state.get('wf_result')
+            if wf_result == {}:
+                st.warning("歷史長度不足一個訓練窗 + 測試窗 (約 4 年)，無法進行 Walk-Forward。")
+            elif wf_result:
+                wf_oos, wf_is = wf_result['stats'], wf_result['in_sample']
+                w1, w2, w3 = st.columns(3)
+                w1.metric("樣本外 CAGR", f"{wf_oos['cagr']:.2%}", f"{wf_oos['cagr'] - wf_is['cagr']:+.2%} vs 全期最佳")
+                w2.metric("樣本外最大回撤", f"{wf_oos['mdd']:.2%}")
+                w3.metric("樣本外 Sharpe", f"{wf_oos['sharpe']:.2f}", f"全期最佳: {wf_is['candidate']}", delta_color="off")
+                wf_curve = pd.DataFrame({'樣本外 (Walk-Forward)': wf_result['oos_equity'], '全期最佳 (樣本內挑選)': wf_result['in_sample_equity']})
+                st.plotly_chart(px.line(wf_curve, title="樣本外串接權益 vs 樣本內最佳"), use_container_width=True)
+                st.dataframe(wf_result['folds'].style.format({
+                    f"train_{wf_result['metric']}": '{:.2f}', 'test_cagr': '{:.2%}', 'test_mdd': '{:.2%}', 'test_sharpe': '{:.2f}'
+                }), use_container_width=True)
+
     # ==================== 4.4 智慧調倉計算機 [V81.1 優化] ====================
     with st.expander("4.4 ⚖️ 智慧調倉計算機 (Rebalancing Calculator)"):
         portfolio_df = st.session_state.get('portfolio_df', pd.DataFrame()).copy()
@@ -2469,6 +2673,32 @@ def render_data():
                 else:
                     st.warning("無法載入時間套利規則。")
 
+                # 事件研究: 以歷史行情實測四大時間套利 (相對加權指數的異常報酬與勝率)
+                st.markdown("#### 📊 實證檢驗 (Event Study)")
+                if df.empty:
+                    st.info("請先上傳 CB 清單，即可以標的股歷史行情實測上述時間套利法則。")
+                elif st.button("🔬 執行事件研究", key="event_study_btn"):
+                    with st.spinner("正在對齊事件視窗並計算異常報酬..."):
+                        st.session_state.event_study = TitanEventStudy(
+                            panel=strategy.price_panel, calendar=calendar, store=get_result_store()
+                        ).run(df)
+
+                study = st.session_state.get('event_study')
+                if study:
+                    st.caption(f"樣本事件數: {study['n_events']} | 基準: 加權指數 | 報酬以事件前一交易日收盤為基準")
+                    evidence = study['summary'].pivot_table(
+                        index='label', columns='horizon', values=['mean_abnormal', 'median_abnormal', 'hit_rate', 'events'])
+                    metric_names = {'mean_abnormal': '平均異常', 'median_abnormal': '中位數異常', 'hit_rate': '勝率', 'events': '樣本'}
+                    evidence.columns = [f"{metric_names[m]} T+{h}" for m, h in evidence.columns]
+                    st.dataframe(evidence.style.format(
+                        {c: ('{:.0f}' if c.startswith('樣本') else '{:.2%}') for c in evidence.columns}),
+                        use_container_width=True)
+                    car = study['car'].rename(columns=EVENT_LABELS)
+                    fig_car = px.line(car, labels={'offset': '事件日位移 (交易日)', 'value': '平均累積異常報酬', 'variable': '事件'})
+                    fig_car.add_vline(x=0, line_dash="dash", line_color="gray")
+                    fig_car.update_layout(yaxis_tickformat='.1%', height=400)
+                    st.plotly_chart(fig_car, use_container_width=True)
+
             with tab2_w7:
                 st.subheader("SOP 進出場規則原文 (摘錄)")
                 entry_exit_rules = all_rules.get("entry_exit", {})
@@ -2559,30 +2789,22 @@ def render_data():
     with st.expander("5.4 時間套利行事曆 (Event Calendar)", expanded=False):
         if not df.empty:
             days_ahead = st.slider("選擇要掃描的未來天數", 7, 90, 30)
-            
-            upcoming_events = []
             today = datetime.now().date()
-            future_date = today + timedelta(days=days_ahead)
-
-            for _, row in df.iterrows():
-                events = calendar.calculate_time_traps(str(row['code']), str(row.get('list_date', '')), str(row.get('put_date', '')))
-                for event in events:
-                    event_date = pd.to_datetime(event['date']).date()
-                    if today <= event_date <= future_date:
-                        upcoming_events.append({
-                            "name": row['name'],
-                            "date": event_date,
-                            "event": event['event'],
-                            "desc": event['desc']
-                        })
 
-            if upcoming_events:
-                upcoming_events.sort(key=lambda x: x['date'])
+            # 事件索引於上傳時建立，此處僅做二分搜尋區間查詢
+            event_index = st.session_state.get('event_index')
+            if event_index is None:
+                event_index = TimeArbitrageIndex(calendar).build(df)
+                st.session_state['event_index'] = event_index
+            upcoming_events = event_index.upcoming(days_ahead, include_calendar=True, today=today)
+
+            if not upcoming_events.empty:
                 st.subheader(f"未來 {days_ahead} 天的關鍵事件")
                 
-                for event in upcoming_events:
-                    days_to_event = (event['date'] - today).days
-                    st.markdown(f"📅 **{days_to_event}天後 ({event['date'].strftime('%Y-%m-%d')})**: `{event['name']}` - **{event['event']}**")
+                for event in upcoming_events.to_dict('records'):
+                    event_date = pd.Timestamp(event['date']).date()
+                    days_to_event = (event_date - today).days
+                    st.markdown(f"📅 **{days_to_event}天後 ({event_date.strftime('%Y-%m-%d')})**: `{event['name']}` - **{event['event']}**")
                     st.caption(event['desc'])
             else:
                 st.info(f"未來 {days_ahead} 天內無觸發任何時間套利事件。")
@@ -2607,6 +2829,9 @@ from scipy.stats import linregress
 import plotly.graph_objects as go
 import google.generativeai as genai
 from config import WAR_THEATERS
+from meta_geometry import (MONTH_END, GEOMETRY_WINDOWS, RATING_TABLE, DEFAULT_ENTRY, DEFAULT_EXIT, SIZING_MODES,
+                           rolling_log_regression, rolling_geometry, geometry_snapshot, rate_geometry,
+                           TitanGeometrySandbox)
 import io
 import altair as alt
 
@@ -2671,7 +2896,7 @@ def download_full_history(ticker, start="1990-01-01"):
             df.index = pd.to_datetime(df.index)
         
         # 轉換為月K
-        df_monthly = df.resample('M').agg({
+        df_monthly = df.resample(MONTH_END).agg({
             'Open': 'first',
             'High': 'max',
             'Low': 'min',
@@ -2698,6 +2923,7 @@ def download_full_history(ticker, start="1990-01-01"):
 def calculate_geometry_metrics(df, months):
     """
     計算單一時間窗口的幾何指標
+    (對數價格回歸改由 meta_geometry.rolling_log_regression 前綴和計算，結果同 linregress)
     
     Args:
         df: 完整月K DataFrame
@@ -2706,32 +2932,16 @@ def calculate_geometry_metrics(df, months):
     Returns:
         dict: {'angle': float, 'r2': float, 'slope': float}
     """
-    if df is None or df.empty:
+    if df is None or df.empty or len(df) < 3:
         return {'angle': 0, 'r2': 0, 'slope': 0}
     
-    # 切割數據
-    slice_df = get_time_slice(df, months)
-    
-    if len(slice_df) < 3:
-        return {'angle': 0, 'r2': 0, 'slope': 0}
-    
-    # 對數價格回歸
-    log_prices = np.log(slice_df['Close'].values)
-    x = np.arange(len(log_prices))
-    
-    slope, intercept, r_value, p_value, std_err = linregress(x, log_prices)
-    
-    # 將斜率轉換為角度 (-90 到 90 度)
-    # 標準化: 假設 slope=0.01 對應 45度
-    angle = np.arctan(slope * 100) * (180 / np.pi)
-    angle = np.clip(angle, -90, 90)
-    
-    r2 = r_value ** 2
+    # 取最後一個月份的滾動回歸 (歷史不足 months 時取全部，與 get_time_slice 相同)
+    reg = rolling_log_regression(df['Close'].to_numpy(), months)
     
     return {
-        'angle': round(angle, 2),
-        'r2': round(r2, 4),
-        'slope': round(slope, 6)
+        'angle': round(float(reg['angle'][-1]), 2),
+        'r2': round(float(reg['r2'][-1]), 4),
+        'slope': round(float(reg['slope'][-1]), 6)
     }
 
 
@@ -2739,6 +2949,7 @@ def compute_7d_geometry(ticker):
     """
     [V90.2 核心] 計算 7 維度完整幾何掃描
     使用 yf.download(period='max') 抓取全歷史數據
+    (7 個窗口以 meta_geometry.rolling_geometry 一次算出，取最新月份)
     
     Returns:
         dict: {
@@ -2758,31 +2969,8 @@ def compute_7d_geometry(ticker):
     if df is None:
         return None
     
-    # 定義 7 個時間窗口 (月)
-    periods = {
-        '35Y': 420,
-        '10Y': 120,
-        '5Y': 60,
-        '3Y': 36,
-        '1Y': 12,
-        '6M': 6,
-        '3M': 3
-    }
-    
-    results = {}
-    
-    for label, months in periods.items():
-        results[label] = calculate_geometry_metrics(df, months)
-    
-    # 計算加速度
-    acceleration = results['3M']['angle'] - results['1Y']['angle']
-    results['acceleration'] = round(acceleration, 2)
-    
-    # Phoenix 信號
-    phoenix = (results['10Y']['angle'] < 0) and (results['6M']['angle'] > 25)
-    results['phoenix_signal'] = phoenix
-    
-    return results
+    # 7 個時間窗口 (月) 見 GEOMETRY_WINDOWS；加速度 = 3M 角度 - 1Y 角度；Phoenix = 10Y < 0 且 6M > 25
+    return geometry_snapshot(rolling_geometry(df['Close']))
 
 
 # ==========================================
@@ -2792,6 +2980,7 @@ def compute_7d_geometry(ticker):
 def titan_rating_system(geo):
     """
     22 階信評邏輯樹
+    (判斷條件集中於 meta_geometry.rate_geometry，單筆與回測沙盒的全歷史評等共用)
     
     Args:
         geo: 7D 幾何數據字典
@@ -2802,106 +2991,14 @@ def titan_rating_system(geo):
     if geo is None:
         return ("N/A", "無數據", "數據不足", "#808080")
     
-    # 提取關鍵指標
-    angle_35y = geo['35Y']['angle']
-    angle_10y = geo['10Y']['angle']
-    angle_5y = geo['5Y']['angle']
-    angle_1y = geo['1Y']['angle']
-    angle_6m = geo['6M']['angle']
-    angle_3m = geo['3M']['angle']
-    
-    r2_1y = geo['1Y']['r2']
-    r2_3m = geo['3M']['r2']
-    
-    acceleration = geo['acceleration']
-    phoenix = geo['phoenix_signal']
-    
-    # ===== SSS 級 =====
-    if all([angle_35y > 45, angle_10y > 45, angle_1y > 45, angle_3m > 45]):
-        return ("SSS", "Titan (泰坦)", "全週期超過45度，神級標的", "#FFD700")
-    
-    # ===== AAA 級 =====
-    if angle_1y > 40 and angle_6m > 45 and angle_3m > 50 and acceleration > 20:
-        return ("AAA", "Dominator (統治者)", "短期加速向上，完美趨勢", "#FF4500")
-    
-    # ===== Phoenix 級 (特殊) =====
-    if phoenix and angle_3m > 30:
-        return ("Phoenix", "Phoenix (浴火重生)", "長空短多，逆轉信號", "#FF6347")
-    
-    # ===== Launchpad 級 (特殊) =====
-    if r2_1y > 0.95 and 20 < angle_1y < 40 and acceleration > 0:
-        return ("Launchpad", "Launchpad (發射台)", "線性度極高，蓄勢待發", "#32CD32")
-    
-    # ===== AA+ 級 =====
-    if angle_1y > 35 and angle_3m > 40 and r2_3m > 0.85:
-        return ("AA+", "Elite (精英)", "一年期強勢上攻", "#FFA500")
-    
-    # ===== AA 級 =====
-    if angle_1y > 30 and angle_6m > 35:
-        return ("AA", "Strong Bull (強多)", "中短期穩定上升", "#FFD700")
-    
-    # ===== AA- 級 =====
-    if angle_1y > 25 and angle_3m > 30:
-        return ("AA-", "Steady Bull (穩健多)", "趨勢健康向上", "#ADFF2F")
-    
-    # ===== A+ 級 =====
-    if angle_6m > 20 and angle_3m > 25:
-        return ("A+", "Moderate Bull (溫和多)", "短期表現良好", "#7FFF00")
-    
-    # ===== A 級 =====
-    if angle_3m > 15:
-        return ("A", "Weak Bull (弱多)", "短期微幅上揚", "#98FB98")
-    
-    # ===== BBB+ 級 (中性偏多) =====
-    if -5 < angle_3m < 15 and angle_1y > 0:
-        return ("BBB+", "Neutral+ (中性偏多)", "盤整偏多", "#F0E68C")
-    
-    # ===== BBB 級 (中性) =====
-    if -10 < angle_3m < 10 and -10 < angle_1y < 10:
-        return ("BBB", "Neutral (中性)", "橫盤震蕩", "#D3D3D3")
-    
-    # ===== BBB- 級 (中性偏空) =====
-    if -15 < angle_3m < 5 and angle_1y < 0:
-        return ("BBB-", "Neutral- (中性偏空)", "盤整偏弱", "#DDA0DD")
-    
-    # ===== Divergence 級 (特殊警告) =====
-    if angle_1y > 20 and angle_3m < -10:
-        return ("Divergence", "Divergence (背離)", "價格創高但動能衰竭", "#FF1493")
-    
-    # ===== BB+ 級 =====
-    if -25 < angle_3m < -15 and angle_1y > -10:
-        return ("BB+", "Weak Bear (弱空)", "短期下跌", "#FFA07A")
-    
-    # ===== BB 級 =====
-    if -35 < angle_3m < -25:
-        return ("BB", "Moderate Bear (中等空)", "下跌趨勢明確", "#FF6347")
-    
-    # ===== BB- 級 =====
-    if -45 < angle_3m < -35:
-        return ("BB-", "Strong Bear (強空)", "跌勢凌厲", "#DC143C")
-    
-    # ===== B+ 級 =====
-    if angle_3m < -45 and angle_1y < -30:
-        return ("B+", "Severe Bear (重度空)", "崩跌模式", "#8B0000")
-    
-    # ===== B 級 =====
-    if angle_10y < -30 and angle_3m < -40:
-        return ("B", "Depression (蕭條)", "長期熊市", "#800000")
-    
-    # ===== C 級 =====
-    if angle_35y < -20 and angle_10y < -35:
-        return ("C", "Structural Decline (結構衰退)", "世代熊市", "#4B0082")
-    
-    # ===== D 級 =====
-    if angle_3m < -60:
-        return ("D", "Collapse (崩盤)", "極度危險", "#000000")
-    
-    # ===== 觸底反彈 級 (特殊) =====
-    if angle_10y < -20 and angle_3m > 15 and acceleration > 30:
-        return ("Reversal", "Reversal (觸底反彈)", "熊市中的V型反轉", "#00CED1")
-    
-    # ===== 預設 =====
-    return ("N/A", "Unknown (未分類)", "無法歸類", "#808080")
+    features = pd.DataFrame([{
+        **{f"angle_{k}": geo[k]['angle'] for k in GEOMETRY_WINDOWS},
+        **{f"r2_{k}": geo[k]['r2'] for k in GEOMETRY_WINDOWS},
+        "acceleration": geo['acceleration'],
+        "phoenix": geo['phoenix_signal'],
+    }])
+    code = str(rate_geometry(features)[0])
+    return (code, *RATING_TABLE[code])
 
 
 # ==========================================
@@ -4029,6 +4126,21 @@ def render_meta_trend():
         st.caption("V90.2 升級：掃描 + 索敵 + 🤖 瓦爾基里自動情報")
         st.markdown("---")
 
+        with st.expander("📈 戰區相對強度排行 (Theater RS Ranking)", expanded=False):
+            rs_theaters = st.multiselect("選擇戰區", list(WAR_THEATERS.keys()), default=list(WAR_THEATERS.keys())[:1], key="rs_theater_pick")
+            if st.button("計算戰區相對強度", key="rs_theater_btn") and rs_theaters:
+                theater_universe = TitanRelativeStrength.theater_universe(rs_theaters)
+                theater_rs = TitanRelativeStrength()
+                with st.spinner(f"批次下載 {len(theater_universe)} 檔標的..."):
+                    theater_rs.build(list(theater_universe), theater_universe)
+                st.session_state['theater_rs'] = theater_rs
+            theater_rs = st.session_state.get('theater_rs')
+            if theater_rs is not None and not theater_rs.table.empty:
+                st.markdown("**戰區 RS 中位數**")
+                st.dataframe(theater_rs.sector_summary().round(2), use_container_width=True)
+                st.markdown("**RS 前 30 名**")
+                st.dataframe(theater_rs.query(30)[['rs_rating', 'ret_20d', 'ret_60d', 'ret_120d', 'ret_250d', 'sector']].round(2), use_container_width=True)
+
         with st.expander("🎯 獵殺控制台 (Mission Control)", expanded=True):
             # 戰區選擇
             theater_options = list(WAR_THEATERS.keys())
@@ -4276,7 +4388,7 @@ def render_meta_trend():
                 st.info("未發現符合條件的目標，請嘗試其他戰區。")
     
     # ==========================================
-    # [TAB 5-6] 維修中插槽 (完全保留)
+    # [TAB 5] 維修中插槽 (完全保留) / [TAB 6] 回測沙盒
     # ==========================================
     with tab5:
         st.subheader("🔧 宏觀對沖 (Macro Hedge)")
@@ -4291,14 +4403,74 @@ def render_meta_trend():
     
     with tab6:
         st.subheader("🔧 回測沙盒 (Backtest Sandbox)")
-        st.warning("""
-        **功能預覽**：
-        - 基於 7D 幾何信號的自動化回測
-        - 動態倉位管理模擬
-        - 夏普比率與最大回撤計算
-        
-        🚧 此功能正在開發中，敬請期待...
-        """)
+        st.caption("全歷史 7D 幾何 (前綴和滾動回歸) × 22 階信評 → 月底評等、次月持倉的戰區輪動回測")
+
+        sb_col1, sb_col2 = st.columns([3, 1])
+        with sb_col1:
+            sandbox_theater = st.selectbox("回測戰區", list(WAR_THEATERS.keys()), key="sandbox_theater")
+        with sb_col2:
+            st.write("")
+            st.write("")
+            if st.button("📥 載入戰區歷史", use_container_width=True, key="sandbox_load_btn"):
+                with st.spinner(f"批次下載 {len(WAR_THEATERS[sandbox_theater])} 檔全歷史並計算幾何特徵..."):
+                    sandbox = TitanGeometrySandbox(panel=strategy.price_panel).load(WAR_THEATERS[sandbox_theater])
+                st.session_state.geometry_sandbox = (sandbox_theater, sandbox)
+                st.session_state.pop('sandbox_result', None)
+
+        loaded = st.session_state.get('geometry_sandbox')
+        if loaded is None or loaded[1].ratings.empty:
+            st.info("請先選擇戰區並載入歷史數據。")
+        else:
+            loaded_theater, sandbox = loaded
+            st.caption(f"已載入 **{loaded_theater}**：{len(sandbox.features)} 檔 × {len(sandbox.closes)} 個月")
+            rating_codes = list(RATING_TABLE.keys())
+            entry_codes = st.multiselect("進場信評", rating_codes, default=list(DEFAULT_ENTRY), key="sandbox_entry")
+            exit_codes = st.multiselect("出場信評", rating_codes, default=list(DEFAULT_EXIT), key="sandbox_exit")
+            p_col1, p_col2, p_col3 = st.columns(3)
+            with p_col1:
+                sizing = st.radio("倉位模式", SIZING_MODES, horizontal=True, key="sandbox_sizing",
+                                  format_func={"equal": "等權", "rating": "信評加權", "inverse_vol": "波動反比"}.get)
+            with p_col2:
+                max_weight = st.slider("單檔上限", 0.05, 1.0, 0.25, 0.05, key="sandbox_max_weight")
+            with p_col3:
+                cost = st.number_input("換手成本 (單邊)", 0.0, 0.02, 0.003, 0.001, format="%.3f", key="sandbox_cost")
+
+            if st.button("▶️ 執行沙盒回測", type="primary", key="sandbox_run_btn"):
+                st.session_state.sandbox_result = sandbox.run(entry_codes, exit_codes, sizing=sizing,
+                                                              max_weight=max_weight, cost=cost)
+
+            sb_result = st.session_state.get('sandbox_result')
+            if sb_result:
+                sb_stats = sb_result['stats']
+                m1, m2, m3, m4, m5 = st.columns(5)
+                m1.metric("年化報酬 (CAGR)", f"{sb_stats['cagr']:.2%}")
+                m2.metric("Sharpe", f"{sb_stats['sharpe']:.2f}")
+                m3.metric("最大回撤 (MDD)", f"{sb_stats['max_drawdown']:.2%}")
+                m4.metric("Calmar", f"{sb_stats['calmar']:.2f}")
+                m5.metric("平均持股數", f"{sb_stats['avg_holdings']:.1f}")
+                st.caption(f"進場次數: {sb_stats['trades']} | 曝險月份: {sb_stats['exposure']:.0%} | "
+                           f"年換手率: {sb_stats['turnover']:.1f}x | Sortino: {sb_stats['sortino']:.2f}")
+
+                fig_sb = go.Figure()
+                fig_sb.add_trace(go.Scatter(x=sb_result['equity'].index, y=sb_result['equity'], name="權益", line=dict(color="#00FF7F")))
+                fig_sb.add_trace(go.Scatter(x=sb_result['drawdown'].index, y=sb_result['drawdown'], name="回撤",
+                                            yaxis="y2", fill='tozeroy', line=dict(color="rgba(255,69,0,0.6)")))
+                fig_sb.update_layout(height=420, template="plotly_dark", yaxis=dict(title="權益"),
+                                     yaxis2=dict(title="回撤", overlaying="y", side="right", tickformat=".0%"))
+                st.plotly_chart(fig_sb, use_container_width=True)
+
+                st.markdown("**各信評等級的次月報酬 (信評預測力)**")
+                st.dataframe(sb_result['rating_returns'].style.format(
+                    {'mean': '{:.2%}', 'median': '{:.2%}', 'hit_rate': '{:.1%}'}), use_container_width=True)
+
+                latest_weights = sb_result['weights'].iloc[-1]
+                latest_weights = latest_weights[latest_weights > 0].sort_values(ascending=False)
+                if not latest_weights.empty:
+                    st.markdown("**最新持倉權重**")
+                    st.dataframe(pd.DataFrame({
+                        "權重": latest_weights,
+                        "信評": sandbox.ratings.iloc[-2].reindex(latest_weights.index),
+                    }).style.format({'權重': '{:.1%}'}), use_container_width=True)
 
 # --- 🏠 戰情指揮首頁 (Home) [在此之前結束] ---
 
@@ -4399,6 +4571,8 @@ with st.sidebar:
     st.divider()
     st.header("📂 CB 資料上傳")
     f_cb_list = st.file_uploader("1. 上傳 CB 清單 (Excel/CSV)", type=['csv','xlsx'])
+    cb_list_date = st.date_input("清單資料日期 (寫入 CB 日價格庫)", value=last_trading_day().date(), key="cb_list_date",
+                                 help="清單沒有日期欄時，以此日期作為價格快照的交易日；預設為最近一個已收盤交易日。")
     if f_cb_list:
         try:
             df_raw = pd.read_excel(f_cb_list) if f_cb_list.name.endswith('.xlsx') else pd.read_csv(f_cb_list)
@@ -4451,6 +4625,18 @@ with st.sidebar:
                     if vol_col: df.rename(columns={vol_col: 'avg_volume'}, inplace=True)
                     else: df['avg_volume'] = 100
                 st.session_state['df'] = df
+                # 時間套利事件索引：同一份清單重複上傳時只做增量比對
+                if 'event_index' not in st.session_state:
+                    st.session_state['event_index'] = TimeArbitrageIndex(calendar)
+                st.session_state['event_index'].update(df)
+                # 每份上傳清單即為所選資料日期的 CB 價格快照，併入本地 CB 日價格庫 (同一份檔案 + 日期只寫入一次)
+                cb_list_fp = f"{frame_fingerprint(df)}|{cb_list_date}"
+                if st.session_state.get('cb_history_fp') != cb_list_fp:
+                    try:
+                        TitanCBHistory().ingest_cb_list(df, date=cb_list_date)
+                        st.session_state['cb_history_fp'] = cb_list_fp
+                    except Exception as e:
+                        st.warning(f"⚠️ CB 歷史庫寫入失敗: {e}")
                 st.success(f"✅ 載入 {len(df)} 筆 CB")
         except Exception as e:
             st.error(f"檔案讀取或格式清洗失敗: {e}")
@@ -5,20 +5,270 @@
 # 1. [SOP 驗證] 模擬「甜蜜點(106-110) 進場」與「152元 中位數出場」的績效。
 # 2. [紀律執行] 嚴格執行「跌破 87MA」停損邏輯。
 # 3. [報酬計算] 產出勝率、最大回撤 (MDD)、總報酬率。
+# [V82.1]: 新增向量化狀態機核心 hysteresis_position / extract_trades，
+#          run_simulation 與 app 端 15 種均線戰法全部改建於其上 (不再逐列迴圈)。
+# [V82.1]: 新增多標的組合回測 run_portfolio (共用資金、部位上限、等權 / 半凱利 / 評分加權)。
+# [V82.1]: 新增 ma_strategy_matrix / backtest_positions，一次計算 15 種均線戰法的訊號矩陣與績效。
+# [V82.1]: 新增 run_cb_sop，以本地 CB 日價格庫 (cb_history.py) 的真實 CB 價格回測甜蜜點進場 / 152 出場 / 標的跌破 87MA 停損。
+# [V82.1]: generate_report 附加交易序列蒙地卡羅重抽樣的 CAGR / MDD / 凱利 信賴區間。
+# [V82.1]: 績效指標統一改用 metrics.py (generate_report 的最大回檔改為逐筆複利權益的回撤，不再是單筆最差報酬)。
 
 import pandas as pd
 import numpy as np
 import yfinance as yf
 from config import Config
+from price_panel import TitanPricePanel
+from monte_carlo import TitanMonteCarlo
+import metrics
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# ==========================================
+# 向量化狀態機核心 (Hysteresis Kernel)
+# ==========================================
+def _ffill_index(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """沿時間軸 (axis 0) 回傳「最近一次 mask 為真的列號」與「是否已出現過」"""
+    rows = np.arange(mask.shape[0]).reshape((-1,) + (1,) * (mask.ndim - 1))
+    last = np.maximum.accumulate(np.where(mask, rows, 0), axis=0)
+    seen = np.logical_or.accumulate(mask, axis=0)
+    return last, seen
+
+
+def hysteresis_position(entry: np.ndarray, exit: np.ndarray, initial: int = 0) -> np.ndarray:
+    """
+    進出場布林訊號 → 持倉狀態 (0/1)，完全向量化，支援 1-D (時間) 與 2-D (時間 × 標的)。
+    規則等同逐根 K 棒的狀態機:
+    - 只有進場訊號 → 1；只有出場訊號 → 0
+    - 同時出現 → 狀態翻轉 (空手則進場、持有則出場)
+    - 皆無 → 維持前一狀態
+    作法: 單邊訊號向前填補得到基準狀態，再以「上次單邊訊號後的衝突次數」奇偶決定是否翻轉。
+    """
+    entry = np.asarray(entry, dtype=bool)
+    exit = np.asarray(exit, dtype=bool)
+    decisive = entry ^ exit
+    conflict = entry & exit
+
+    last, seen = _ffill_index(decisive)
+    base = np.where(seen, np.take_along_axis(entry, last, axis=0), bool(initial))
+
+    flips = np.cumsum(conflict, axis=0)
+    flips_at_last = np.where(seen, np.take_along_axis(flips, last, axis=0), 0)
+    parity = (flips - flips_at_last) & 1
+    return (base ^ parity.astype(bool)).astype(np.int8)
+
+
+def extract_trades(position: np.ndarray, prices: np.ndarray, index=None, columns=None,
+                   include_open: bool = False) -> pd.DataFrame:
+    """
+    持倉陣列 → 交易明細 (進場 = 由 0 轉 1 的 K 棒收盤，出場 = 由 1 轉 0 的 K 棒收盤)。
+    支援 1-D 與 2-D；2-D 時附 asset 欄位 (columns 提供標的名稱)。
+    include_open=True 時，期末仍持有的部位以最後一根收盤計為未平倉交易。
+    """
+    pos = np.asarray(position, dtype=np.int8)
+    px = np.asarray(prices, dtype=float)
+    one_d = pos.ndim == 1
+    if one_d:
+        pos, px = pos[:, None], px[:, None]
+    n = pos.shape[0]
+    edges = np.diff(np.vstack([np.zeros((1, pos.shape[1]), np.int8), pos, np.zeros((1, pos.shape[1]), np.int8)]), axis=0)
+
+    # 以 (標的, 時間) 排序後，同一標的的進出場必然成對
+    asset_e, t_entry = np.nonzero(edges.T == 1)
+    _, t_exit = np.nonzero(edges.T == -1)
+    is_open = t_exit == n
+    if not include_open:
+        keep = ~is_open
+        asset_e, t_entry, t_exit, is_open = asset_e[keep], t_entry[keep], t_exit[keep], is_open[keep]
+    t_exit_bar = np.minimum(t_exit, n - 1)
+
+    entry_price = px[t_entry, asset_e]
+    exit_price = px[t_exit_bar, asset_e]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roi = (exit_price - entry_price) / entry_price
+    idx = np.asarray(index) if index is not None else np.arange(n)
+
+    trades = pd.DataFrame({
+        "entry_date": idx[t_entry],
+        "exit_date": idx[t_exit_bar],
+        "entry_price": entry_price,
+        "exit_price": exit_price,
+        "roi": roi,
+        "bars_held": t_exit_bar - t_entry,
+        "open": is_open,
+    })
+    if not one_d:
+        names = np.asarray(columns) if columns is not None else np.arange(pos.shape[1])
+        trades.insert(0, "asset", names[asset_e])
+    return trades
+
+
+# ==========================================
+# 均線戰法定義 (進場, 出場) — 皆交由 hysteresis_position 轉為持倉
+# ==========================================
+MA_WINDOWS = (20, 43, 60, 87, 284)
+
+
+def _above(a: str, b: str) -> Callable:
+    """a 在 b 之上持有、之下出場 (單純狀態型策略)"""
+    return lambda m: (m[a] > m[b], ~(m[a] > m[b]))
+
+
+MA_STRATEGY_RULES: Dict[str, Callable[[Dict[str, np.ndarray]], Tuple[np.ndarray, np.ndarray]]] = {
+    "價格 > 20MA": _above('Close', 'MA20'),
+    "價格 > 43MA": _above('Close', 'MA43'),
+    "價格 > 60MA": _above('Close', 'MA60'),
+    "價格 > 87MA": _above('Close', 'MA87'),
+    "價格 > 284MA": _above('Close', 'MA284'),
+    "非對稱: P>20進 / P<60出": lambda m: (m['Close'] > m['MA20'], m['Close'] < m['MA60']),
+    "20/60 黃金/死亡交叉": _above('MA20', 'MA60'),
+    "20/87 黃金/死亡交叉": _above('MA20', 'MA87'),
+    "20/284 黃金/死亡交叉": _above('MA20', 'MA284'),
+    "43/87 黃金/死亡交叉": _above('MA43', 'MA87'),
+    "43/284 黃金/死亡交叉": _above('MA43', 'MA284'),
+    "60/87 黃金/死亡交叉": _above('MA60', 'MA87'),
+    "60/284 黃金/死亡交叉": _above('MA60', 'MA284'),
+    "🔥 核心戰法: 87MA ↗ 284MA": _above('MA87', 'MA284'),
+    "雙確認: P>20 & P>60 進 / P<60 出": lambda m: ((m['Close'] > m['MA20']) & (m['Close'] > m['MA60']), m['Close'] < m['MA60']),
+}
+
+
+def moving_averages(close: np.ndarray, windows=MA_WINDOWS) -> Dict[str, np.ndarray]:
+    """收盤價 (1-D 或 時間 × 標的) → {'Close', 'MA20', ...}；前 w-1 根為 NaN (比較結果為 False)"""
+    close = np.asarray(close, dtype=float)
+    frame = pd.DataFrame(close.reshape(close.shape[0], -1))
+    mas = {"Close": close}
+    for w in windows:
+        mas[f"MA{w}"] = frame.rolling(w).mean().to_numpy().reshape(close.shape)
+    return mas
+
+
+def ma_strategy_position(close: np.ndarray, strategy_name: str, mas: Optional[Dict[str, np.ndarray]] = None) -> np.ndarray:
+    """單一均線戰法的持倉陣列 (可傳入已算好的均線以重複使用)"""
+    if strategy_name not in MA_STRATEGY_RULES:
+        raise ValueError(f"未知的均線戰法: {strategy_name}")
+    entry, exit = MA_STRATEGY_RULES[strategy_name](mas or moving_averages(close))
+    return hysteresis_position(entry, exit)
+
+
+def ma_strategy_matrix(close: np.ndarray, names: Optional[List[str]] = None,
+                       mas: Optional[Dict[str, np.ndarray]] = None) -> Tuple[List[str], np.ndarray]:
+    """單一標的收盤價 → (策略名稱, 持倉矩陣 日期 × 策略)；均線只計算一次，所有策略的狀態機一次求解"""
+    names = list(names or MA_STRATEGY_RULES.keys())
+    mas = mas or moving_averages(close)
+    pairs = [MA_STRATEGY_RULES[n](mas) for n in names]
+    entry = np.column_stack([e for e, _ in pairs])
+    exit = np.column_stack([x for _, x in pairs])
+    return names, hysteresis_position(entry, exit)
+
+
+def backtest_positions(close: np.ndarray, positions: np.ndarray, initial_capital: float = 1000000) -> Dict[str, np.ndarray]:
+    """
+    收盤價 (日期,) 與持倉矩陣 (日期 × 策略) → 各策略的權益、回撤、CAGR、期末資金與最大回撤。
+    當日訊號於次日生效 (與 run_ma_strategy_backtest 相同: Signal.shift(1) × 日報酬)。
+    """
+    close = np.asarray(close, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    if positions.ndim == 1:
+        positions = positions[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.concatenate([[np.nan], close[1:] / close[:-1] - 1])
+    lagged = np.vstack([np.full((1, positions.shape[1]), np.nan), positions[:-1]])
+    strat_ret = np.nan_to_num(lagged * ret[:, None])
+    equity = metrics.equity_curve(strat_ret, initial_capital)
+    held = np.nan_to_num(lagged) != 0
+    return {
+        "equity": equity, "drawdown": metrics.drawdown(strat_ret), "returns": strat_ret,
+        "cagr": metrics.cagr(strat_ret), "final_equity": equity[-1], "max_drawdown": metrics.max_drawdown(strat_ret),
+        "sharpe": metrics.sharpe(strat_ret), "sortino": metrics.sortino(strat_ret), "calmar": metrics.calmar(strat_ret),
+        "win_rate": metrics.win_rate(strat_ret, held), "exposure": metrics.exposure(held),
+        "num_years": len(close) / metrics.TRADING_DAYS,
+    }
+
+
+# ==========================================
+# CB 真實價格 SOP 訊號
+# ==========================================
+CB_EXIT_REASONS = {1: "🎯 達 152 中位數出場", 2: "🛑 標的跌破87MA (Stop Loss)", 3: "📴 CB 停止交易 (轉換/到期/下市)"}
+
+
+def cb_sop_signals(cb: np.ndarray, stock: np.ndarray, stock_ma: np.ndarray,
+                   low: float = Config.SWEET_SPOT_LOW, high: float = Config.SWEET_SPOT_HIGH,
+                   max_price: float = Config.FILTER_MAX_PRICE,
+                   exit_target: float = Config.EXIT_TARGET_MEDIAN) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    CB 價格與標的收盤/87MA (皆為 日期 × CB) → (進場, 出場, 出場原因碼)。
+    進場: CB 價位於甜蜜點且不超過價格濾網，標的站上 87MA；
+    出場: CB 價 >= 152 (1)、標的跌破 87MA (2)、CB 最後一筆報價之後 (3)。
+    """
+    cb = np.asarray(cb, dtype=float)
+    valid = np.isfinite(cb)
+    rows = np.arange(cb.shape[0])[:, None]
+    last_valid = np.where(valid.any(axis=0), cb.shape[0] - 1 - valid[::-1].argmax(axis=0), -1)
+    ended = rows > last_valid
+
+    entry = (cb >= low) & (cb <= min(high, max_price)) & (stock > stock_ma)
+    target = cb >= exit_target
+    stop = stock < stock_ma
+    reason = np.select([target, stop, ended], [1, 2, 3], default=0).astype(np.int8)
+    return entry, reason > 0, reason
+
+
+def _held_returns(position: np.ndarray, closes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """持有日報酬 (前一日收盤持倉 → 當日報酬) 與持有日遮罩；輸入為 時間 × 標的"""
+    closes = np.asarray(closes, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.vstack([np.full((1, closes.shape[1]), np.nan), closes[1:] / closes[:-1] - 1])
+    held = np.vstack([np.zeros((1, closes.shape[1]), bool), np.asarray(position)[:-1] == 1]) & np.isfinite(ret)
+    return np.where(held, ret, 0.0), held
+
+
+def _kelly(days, n_wins, win_sum, n_losses, loss_sum) -> np.ndarray:
+    """由累計 持有日數 / 賺賠日數 / 賺賠總額 計算凱利比例 (勝率 - 敗率 / 賺賠比)，持有日少於 10 天者為 0"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        win_rate = n_wins / days
+        avg_win = np.where(n_wins > 0, win_sum / n_wins, 0.0)
+        avg_loss = np.where(n_losses > 0, -loss_sum / n_losses, 1.0)
+        payoff = avg_win / avg_loss
+        kelly = np.where(payoff > 0, win_rate - (1 - win_rate) / payoff, 0.0)
+    return np.where(days >= 10, np.clip(np.nan_to_num(kelly), 0, 1), 0.0)
+
+
+def kelly_fractions(position: np.ndarray, closes: np.ndarray) -> np.ndarray:
+    """
+    每個標的依全期持有日報酬估計凱利比例 (與 run_fast_backtest 相同定義)，
+    持有日少於 10 天者為 0；輸入為 時間 × 標的。
+    """
+    r, held = _held_returns(position, closes)
+    wins, losses = r > 0, r < 0
+    return _kelly(held.sum(axis=0), wins.sum(axis=0), (r * wins).sum(axis=0),
+                  losses.sum(axis=0), (r * losses).sum(axis=0))
+
+
+def expanding_kelly(position: np.ndarray, closes: np.ndarray) -> np.ndarray:
+    """
+    逐日擴張視窗的凱利比例 (時間 × 標的)：第 t 列只用第 t-1 日 (含) 以前的持有日報酬，
+    供第 t 日進場時配置部位，避免以全期績效回頭決定過去的部位 (look-ahead)。
+    """
+    r, held = _held_returns(position, closes)
+    wins, losses = r > 0, r < 0
+    counts = [np.cumsum(a, axis=0) for a in (held, wins, r * wins, losses, r * losses)]
+    lagged = [np.vstack([np.zeros((1, a.shape[1])), a[:-1]]) for a in counts]
+    return _kelly(*lagged)
+
 
 class TitanBacktestEngine:
-    def __init__(self):
-        self.initial_capital = 1000000 
-        self.positions = []
-        self.history = []
+    SIZING_MODES = ("equal", "half_kelly", "score")
+
+    def __init__(self, initial_capital: float = 1000000, panel: Optional[TitanPricePanel] = None):
+        self.initial_capital = initial_capital
+        self.positions = []     # 最近一次組合回測期末仍持有的部位
+        self.history = []       # 最近一次組合回測的逐日資產紀錄
+        self.panel = panel or TitanPricePanel()
         
     def fetch_history(self, ticker: str, period="2y") -> pd.DataFrame:
         df = yf.download(ticker, period=period, progress=False)
+        if isinstance(df.columns, pd.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
         if not df.empty:
             df['MA87'] = df['Close'].rolling(Config.MA_LIFE_LINE).mean()
         return df
@@ -27,61 +277,242 @@ class TitanBacktestEngine:
         print(f"🔄 正在回測 {cb_name} ({ticker})...")
         df = self.fetch_history(ticker, period="1y") # Fetch 1 year of data as requested
         
-        in_position = False
-        entry_price = 0
-        entry_date = None
-        
+        if df.empty:
+            return pd.DataFrame()
+
+        # 進場: 收盤站上 87MA；出場: 收盤跌破 87MA (87MA 尚未形成前兩者皆為 False，維持空手)
+        close = df['Close'].to_numpy(dtype=float)
+        ma87 = df['MA87'].to_numpy(dtype=float)
+        position = hysteresis_position(close > ma87, close < ma87)
+
+        trades = extract_trades(position, close, index=df.index)
+        if trades.empty:
+            return pd.DataFrame()
+        return trades[["entry_date", "exit_date", "entry_price", "exit_price", "roi"]].assign(reason="🛑 跌破87MA (Stop Loss)")
+
+    # ==========================================
+    # 組合回測 (Portfolio Backtest)
+    # ==========================================
+    def _target_weights(self, sizing: str, max_positions: int, kelly: np.ndarray,
+                        scores: np.ndarray) -> np.ndarray:
+        """每檔進場時的目標權重 (佔當下總資產)"""
+        n = len(kelly)
+        if sizing == "equal":
+            return np.full(n, 1.0 / max_positions)
+        if sizing == "half_kelly":
+            return np.clip(kelly * 0.5, 0.0, 1.0 / max_positions * 2)
+        if sizing == "score":
+            top = np.sort(np.nan_to_num(scores))[::-1][:max_positions]
+            total = top.sum()
+            return np.nan_to_num(scores) / total if total > 0 else np.full(n, 1.0 / max_positions)
+        raise ValueError(f"未知的部位配置方式: {sizing} (可用: {self.SIZING_MODES})")
+
+    def simulate_portfolio(self, closes: pd.DataFrame, position: np.ndarray, sizing: str = "equal",
+                           max_positions: int = 10, scores: Optional[Dict[str, float]] = None) -> Dict:
+        """
+        共用資金的多標的模擬 (共同日期軸 × 標的)。
+        - position: 與 closes 同形狀的 0/1 持倉訊號 (hysteresis_position 產出)，當日收盤依訊號進出。
+        - 出場: 訊號轉 0 即以收盤價全數賣出；進場: 有空位時依 評分 / 凱利 / 代號 順序以目標權重買進 (不超過現金)。
+        - 凱利 (半凱利權重與搶位順序) 皆取 expanding_kelly 當日列，只用進場前已實現的持有日報酬。
+        - 停牌缺價時以最近收盤估值，缺價當日不進場也不出場。
+        回傳 equity (Series)、blotter (交易明細)、weights (以全期資料估計、供下一次進場的目標權重) 與 stats。
+        """
+        codes = list(closes.columns)
+        raw = closes.to_numpy(dtype=float)
+        px = closes.ffill().to_numpy(dtype=float)
+        sig = np.asarray(position, dtype=bool) & np.isfinite(raw)
+        tradable = np.isfinite(raw)
+
+        score_arr = np.array([float((scores or {}).get(c, 0.0)) for c in codes])
+        kelly = expanding_kelly(position, raw)
+
+        T, N = raw.shape
+        shares = np.zeros(N)
+        held = np.zeros(N, bool)
+        entry_i = np.zeros(N, int)
+        entry_px = np.zeros(N)
+        cash = float(self.initial_capital)
+        equity = np.empty(T)
         trades = []
-        
-        for date, row in df.iterrows():
-            close = row['Close']
-            ma87 = row['MA87']
-            
-            if np.isnan(ma87): continue
-            
-            if not in_position:
-                # Entry condition: Price is above 87MA
-                if close > ma87:
-                    entry_price = close
-                    entry_date = date
-                    in_position = True
-            
-            elif in_position:
-                # Exit condition: Price drops below 87MA
-                if close < ma87:
-                    roi = (close - entry_price) / entry_price
-                    trades.append({
-                        "entry_date": entry_date,
-                        "exit_date": date,
-                        "entry_price": entry_price,
-                        "exit_price": close,
-                        "roi": roi,
-                        "reason": "🛑 跌破87MA (Stop Loss)"
-                    })
-                    in_position = False
-        
-        return pd.DataFrame(trades)
+
+        for t in range(T):
+            price = px[t]
+            # 1. 出場 (訊號轉 0 且當日有成交價)
+            leaving = held & ~sig[t] & tradable[t]
+            for k in np.flatnonzero(leaving):
+                cash += shares[k] * price[k]
+                trades.append((codes[k], entry_i[k], t, entry_px[k], price[k], shares[k]))
+            shares[leaving] = 0.0
+            held &= ~leaving
+
+            # 2. 進場 (空位 + 權重 > 0)；同日多檔搶位時的優先順序: 評分 → 凱利 → 代號
+            slots = max_positions - int(held.sum())
+            candidates = np.flatnonzero(sig[t] & ~held) if slots > 0 else np.empty(0, int)
+            if len(candidates):
+                weights = self._target_weights(sizing, max_positions, kelly[t], score_arr)
+                candidates = candidates[weights[candidates] > 0]
+                order = np.lexsort((candidates, -kelly[t, candidates], -score_arr[candidates]))
+                total = cash + float(np.nansum(shares * price))
+                for k in candidates[order][:slots]:
+                    budget = min(weights[k] * total, cash)
+                    if budget <= 0 or price[k] <= 0:
+                        continue
+                    shares[k] = budget / price[k]
+                    cash -= budget
+                    held[k], entry_i[k], entry_px[k] = True, t, price[k]
+
+            equity[t] = cash + float(np.nansum(shares * price))
+
+        index = closes.index
+        blotter = pd.DataFrame(trades, columns=["asset", "entry_i", "exit_i", "entry_price", "exit_price", "shares"])
+        open_pos = pd.DataFrame([(codes[k], entry_i[k], T - 1, entry_px[k], px[-1, k], shares[k]) for k in np.flatnonzero(held)],
+                                columns=blotter.columns)
+        blotter = pd.concat([blotter.assign(open=False), open_pos.assign(open=True)], ignore_index=True)
+        blotter.insert(1, "entry_date", index[blotter["entry_i"].to_numpy(dtype=int)])
+        blotter.insert(2, "exit_date", index[blotter["exit_i"].to_numpy(dtype=int)])
+        blotter["cost"] = blotter["shares"] * blotter["entry_price"]
+        blotter["pnl"] = blotter["shares"] * (blotter["exit_price"] - blotter["entry_price"])
+        blotter["roi"] = blotter["exit_price"] / blotter["entry_price"] - 1
+        blotter = blotter.drop(columns=["entry_i", "exit_i"]).sort_values("entry_date", kind="stable").reset_index(drop=True)
+
+        equity_s = pd.Series(equity, index=index, name="Equity")
+        self.history = [{"date": d, "equity": v} for d, v in zip(index, equity)]
+        self.positions = blotter[blotter["open"]].to_dict("records")
+
+        closed = blotter[~blotter["open"]]
+        # 以期初資金為基準的逐日報酬 (首日相對 initial_capital)
+        daily = metrics.to_returns(np.concatenate([[self.initial_capital], equity]))[1:]
+        drawdown = pd.Series(metrics.drawdown(daily), index=index)
+        stats = {
+            "final_equity": equity_s.iloc[-1] if len(equity_s) else self.initial_capital,
+            "cagr": metrics.cagr(daily) if len(daily) else 0.0,
+            "max_drawdown": metrics.max_drawdown(daily) if len(daily) else 0.0,
+            "sharpe": metrics.sharpe(daily) if len(daily) else 0.0,
+            "sortino": metrics.sortino(daily) if len(daily) else 0.0,
+            "trades": len(closed),
+            "win_rate": metrics.win_rate(closed["roi"].to_numpy(), np.ones(len(closed), bool)) if len(closed) else 0.0,
+            "profit_factor": metrics.profit_factor(closed["pnl"].to_numpy()) if len(closed) else 0.0,
+            "open_positions": len(self.positions),
+        }
+        return {
+            "equity": equity_s, "drawdown": drawdown, "blotter": blotter,
+            "weights": pd.Series(self._target_weights(sizing, max_positions, kelly_fractions(position, raw), score_arr),
+                                 index=codes), "stats": stats,
+        }
+
+    def run_portfolio(self, codes: Iterable[str], start_date: str = "2020-01-01",
+                      strategy_name: str = "價格 > 87MA", sizing: str = "equal", max_positions: int = 10,
+                      scores: Optional[Dict[str, float]] = None) -> Dict:
+        """以共用行情面板批次下載整個標的池，套用均線戰法訊號後進行組合回測"""
+        closes = self.panel.close_panel(codes, start=start_date)
+        if closes.empty:
+            return {}
+        position = ma_strategy_position(closes.to_numpy(dtype=float), strategy_name)
+        return self.simulate_portfolio(closes, position, sizing=sizing, max_positions=max_positions, scores=scores)
+
+    def run_cb_sop(self, history, codes: Optional[Iterable[str]] = None, start_date: Optional[str] = None,
+                   end_date: Optional[str] = None, sizing: str = "equal", max_positions: int = 10) -> Dict:
+        """
+        以 CB 日價格庫 (TitanCBHistory) 對所有 CB 一次執行 SOP 回測:
+        訊號於 CB 價格上判定，標的 87MA 停損以共用行情面板的標的收盤價 (不足時改用庫存的標的價) 計算後併入。
+        回傳 signals (每檔 CB 訊號層級的全部交易，含出場原因) 與組合模擬結果 (equity / blotter / stats)。
+        """
+        cb = history.panel('price', codes, start=start_date, end=end_date)
+        cb = cb.loc[:, cb.notna().any()]
+        if cb.empty:
+            return {}
+        stock_codes = history.stock_map().reindex(cb.columns).fillna('')
+
+        # 標的收盤與 87MA: 往前多抓一段暖機期，再對齊到 CB 的日期軸 (標的休市日沿用前值)
+        warm_start = cb.index[0] - pd.Timedelta(days=int(Config.MA_LIFE_LINE * 1.6))
+        wanted = [c for c in stock_codes.unique() if c]
+        under = self.panel.close_panel(wanted, start=warm_start.strftime('%Y-%m-%d')) if wanted else pd.DataFrame()
+        if not under.empty:
+            under_ma = under.rolling(Config.MA_LIFE_LINE).mean()
+            axis = under.index.union(cb.index)
+            stock = under.reindex(axis).ffill().reindex(cb.index).reindex(columns=stock_codes.to_numpy()).to_numpy(dtype=float)
+            stock_ma = under_ma.reindex(axis).ffill().reindex(cb.index).reindex(columns=stock_codes.to_numpy()).to_numpy(dtype=float)
+        else:
+            stored = history.panel('stock_price', cb.columns, start=start_date, end=end_date)
+            stock = stored.to_numpy(dtype=float)
+            stock_ma = stored.rolling(Config.MA_LIFE_LINE).mean().to_numpy(dtype=float)
+
+        raw = cb.to_numpy(dtype=float)
+        entry, exit, reason = cb_sop_signals(raw, stock, stock_ma)
+        position = hysteresis_position(entry, exit)
+
+        # 最後報價的次一日以最後價成交出場 (否則停止交易的 CB 永遠佔住部位)
+        valid = np.isfinite(raw)
+        last_valid = np.where(valid.any(axis=0), raw.shape[0] - 1 - valid[::-1].argmax(axis=0), -1)
+        fill_row = np.arange(raw.shape[0])[:, None] == (last_valid + 1)
+        last_price = raw[np.maximum(last_valid, 0), np.arange(raw.shape[1])]
+        sim_px = np.where(fill_row, last_price, raw)
+        ffilled = pd.DataFrame(sim_px).ffill().to_numpy()
+
+        # 實際成交持倉: 無報價日無法進出，沿用前一個有報價日的狀態 (與 simulate_portfolio 相同，進出場皆落在次一個有報價日)；
+        # 出場原因取訊號轉 0 當日的原因碼，延續到實際成交日
+        quoted = np.isfinite(sim_px)
+        traded = pd.DataFrame(np.where(quoted, position, np.nan)).ffill().fillna(0).to_numpy(dtype=np.int8)
+        flips = np.vstack([np.zeros((1, position.shape[1]), bool), (position[:-1] == 1) & (position[1:] == 0)])
+        exit_reason = pd.DataFrame(np.where(flips, reason, np.nan)).ffill().fillna(0).to_numpy(dtype=int)
+
+        signals = extract_trades(traded, ffilled, columns=cb.columns, include_open=True)
+        exit_i = signals['exit_date'].to_numpy(dtype=int)
+        asset_i = cb.columns.get_indexer(signals['asset'])
+        signals['reason'] = np.where(signals['open'], "持有中", [CB_EXIT_REASONS.get(int(r), "") for r in exit_reason[exit_i, asset_i]])
+        signals['entry_date'] = cb.index[signals['entry_date'].to_numpy(dtype=int)]
+        signals['exit_date'] = cb.index[exit_i]
+        names = pd.Series(history.names, index=history.codes)
+        signals.insert(1, 'name', names.reindex(signals['asset']).to_numpy())
+        signals.insert(2, 'stock_code', stock_codes.reindex(signals['asset']).to_numpy())
+
+        result = self.simulate_portfolio(pd.DataFrame(sim_px, index=cb.index, columns=cb.columns), position,
+                                         sizing=sizing, max_positions=max_positions)
+        blotter = result['blotter']
+        b_exit = cb.index.get_indexer(blotter['exit_date'])
+        b_asset = cb.columns.get_indexer(blotter['asset'])
+        blotter['reason'] = np.where(blotter['open'], "持有中", [CB_EXIT_REASONS.get(int(r), "") for r in exit_reason[b_exit, b_asset]])
+        result['signals'] = signals
+        return result
 
     def generate_report(self, trades_df: pd.DataFrame):
         if trades_df.empty:
             return "無交易紀錄 (未觸發 SOP 進場條件)", pd.DataFrame()
             
-        total_trades = len(trades_df)
-        wins = trades_df[trades_df['roi'] > 0]
-        win_rate = len(wins) / total_trades if total_trades > 0 else 0
-        
-        # Calculate Max Return and Max Drawdown (MDD)
-        max_return = trades_df['roi'].max() if not trades_df.empty else 0
-        
-        # Simple Max Drawdown from individual trade losses
-        max_drawdown = trades_df['roi'].min() if not trades_df.empty else 0
+        # 依進場時間排序後逐筆複利，最大回檔為權益曲線的回撤 (而非單筆最差報酬)
+        ordered = trades_df.sort_values('entry_date') if 'entry_date' in trades_df.columns else trades_df
+        stats = metrics.trade_summary(ordered['roi'].to_numpy())
 
         report = f"""
         ========= 🔙 Titan 回測報告 (SOP V63.0) =========
-        交易次數: {total_trades} 次
-        勝率 (Win Rate): {win_rate*100:.1f}%
-        最大報酬 (Max Return): {max_return*100:.1f}%
-        最大回檔 (Max Drawdown): {max_drawdown*100:.1f}%
+        交易次數: {stats['trades']} 次
+        勝率 (Win Rate): {stats['win_rate']*100:.1f}%
+        獲利因子 (Profit Factor): {stats['profit_factor']:.2f}
+        凱利值 (Kelly): {stats['kelly']*100:.1f}%
+        最大報酬 (Max Return): {stats['best']*100:.1f}%
+        最差單筆 (Worst Trade): {stats['worst']*100:.1f}%
+        最大回檔 (Max Drawdown): {stats['max_drawdown']*100:.1f}%
         =================================================
         """
-        return report, trades_df
\ No newline at end of file
+        report += self._bootstrap_section(trades_df)
+        return report, trades_df
+
+    def _bootstrap_section(self, trades_df: pd.DataFrame, horizon_years: float = 10) -> str:
+        """交易序列重抽樣的信賴區間 (至少 5 筆交易；每年交易次數由進出場日期跨度換算)"""
+        if len(trades_df) < 5 or 'entry_date' not in trades_df.columns:
+            return ""
+        span = (pd.to_datetime(trades_df['exit_date']).max() - pd.to_datetime(trades_df['entry_date']).min()).days / 365.25
+        if span <= 0:
+            return ""
+        mc = TitanMonteCarlo(n_paths=10000, seed=42).from_trades(trades_df['roi'], len(trades_df) / span, horizon_years)
+        if not mc:
+            return ""
+        b = mc['bands']
+        return f"""
+        ---- 🎲 蒙地卡羅 {horizon_years:.0f} 年交易重抽樣 ({mc['paths']:,} 條路徑) ----
+        年化報酬 5% / 50% / 95%: {b.loc['cagr', 'p5']*100:.1f}% / {b.loc['cagr', 'p50']*100:.1f}% / {b.loc['cagr', 'p95']*100:.1f}%
+        最大回撤 5% / 50% / 95%: {b.loc['mdd', 'p5']*100:.1f}% / {b.loc['mdd', 'p50']*100:.1f}% / {b.loc['mdd', 'p95']*100:.1f}%
+        凱利值   5% / 50% / 95%: {b.loc['kelly', 'p5']*100:.1f}% / {b.loc['kelly', 'p50']*100:.1f}% / {b.loc['kelly', 'p95']*100:.1f}%
+        虧損機率: {mc['prob_loss']*100:.1f}%
+        =================================================
+        """
\ No newline at end of file
@@ -0,0 +1,157 @@
+# batch_backtest.py
+# Titan SOP V82.1 - Batch Portfolio Backtest
+# 狀態: 4.2 全球回測批次執行器 (一次下載計畫 + 多行程模擬 + 逐檔回報)
+# 修正重點:
+# 1. [下載計畫] 全部代號交給共用行情面板整批下載 (.TW 一次、缺漏補 .TWO 一次)，不再逐檔各自往返。
+# 2. [現金部位] CASH / USD / TWD 直接沿用已下載標的的交易日曆，不再為了日期另外下載 ^TWII。
+# 3. [平行模擬] 結果庫未命中的標的送入行程池，as_completed 逐檔回傳，UI 可邊算邊顯示。
+
+import pandas as pd
+import metrics
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from config import Config
+from backtest import hysteresis_position
+from price_panel import TitanPricePanel
+from result_store import TitanResultStore, data_fingerprint
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+CASH_CODES = ('CASH', 'USD', 'TWD')
+STRATEGY_ID = "fast_ma20"
+
+
+def trend_backtest(bars: pd.DataFrame, initial_capital: float = 1000000) -> Optional[Dict]:
+    """
+    20MA 趨勢追蹤 (站上 20MA 進場、跌破出場) 的單檔回測。
+    回傳指標 (metrics.py 統一計算) 與 equity_curve / drawdown_series；資料不足 21 根回傳 None。
+    """
+    if bars is None or bars.empty or len(bars) < 21:
+        return None
+    df = bars[['Close']].copy()
+
+    # 策略信號 (向量化狀態機)
+    df['MA20'] = df['Close'].rolling(window=20).mean()
+    above_ma20 = (df['Close'] > df['MA20']).to_numpy()
+    df['Signal'] = hysteresis_position(above_ma20, ~above_ma20)
+
+    # 績效
+    df['Pct_Change'] = df['Close'].pct_change()
+    df['Strategy_Return'] = df['Signal'].shift(1) * df['Pct_Change']
+    df['Equity'] = (1 + df['Strategy_Return'].fillna(0)).cumprod() * initial_capital
+    df['Drawdown'] = metrics.drawdown(df['Strategy_Return'].to_numpy())
+    strat_ret = df['Strategy_Return'].to_numpy()
+
+    # 凱利參數 (勝率以持倉日為分母；持倉不足 10 日不計)
+    held = (df['Signal'].shift(1) == 1).to_numpy()
+    if held.sum() < 10:
+        win_rate, profit_factor, kelly = 0, 0, 0
+    else:
+        win_rate = metrics.win_rate(strat_ret, held)
+        profit_factor = metrics.profit_factor(strat_ret)
+        kelly = metrics.kelly(strat_ret, held)
+
+    daily_returns = df['Strategy_Return'].dropna().to_numpy()
+    return {
+        "cagr": metrics.cagr(strat_ret), "sharpe_ratio": metrics.sharpe(daily_returns, risk_free=0.02),
+        "sortino_ratio": metrics.sortino(daily_returns, risk_free=0.02),
+        "max_drawdown": metrics.max_drawdown(strat_ret), "calmar": metrics.calmar(strat_ret),
+        "max_drawdown_days": int(metrics.max_drawdown_duration(strat_ret)),
+        "win_rate": win_rate, "profit_factor": profit_factor, "kelly": max(0, kelly),
+        "equity_curve": df['Equity'], "drawdown_series": df['Drawdown'],
+        "latest_price": float(df['Close'].iloc[-1])
+    }
+
+
+def cash_backtest(dates: pd.DatetimeIndex, initial_capital: float = 1000000) -> Optional[Dict]:
+    """現金部位: 權益固定、所有指標為 0"""
+    if dates is None or len(dates) == 0:
+        return None
+    return {
+        "cagr": 0.0, "sharpe_ratio": 0.0, "sortino_ratio": 0.0, "max_drawdown": 0.0,
+        "calmar": 0.0, "max_drawdown_days": 0,
+        "win_rate": 0.0, "profit_factor": 0.0, "kelly": 0.0,
+        "equity_curve": pd.Series(float(initial_capital), index=dates, name='Equity'),
+        "drawdown_series": pd.Series(0.0, index=dates, name='Drawdown'),
+        "latest_price": 1.0
+    }
+
+
+def split_curves(result: Dict) -> Tuple[Dict, Dict[str, pd.Series]]:
+    """回測結果 → (可 JSON 化的指標, 權益/回撤曲線)，供結果庫存放"""
+    scalars = {k: v for k, v in result.items() if k not in ('equity_curve', 'drawdown_series')}
+    return scalars, {"Equity": result['equity_curve'], "Drawdown": result['drawdown_series']}
+
+
+def join_curves(stored: Dict) -> Dict:
+    """結果庫命中資料 → 與 trend_backtest 相同格式"""
+    return {**stored['metrics'], "equity_curve": stored['curves']['Equity'],
+            "drawdown_series": stored['curves']['Drawdown']}
+
+
+class TitanBatchBacktest:
+    """
+    投資組合批次回測
+    run() 為產生器: 依完成順序逐檔回傳 (代號, 結果或 None)；結果庫命中者最先回傳，不進行程池。
+    """
+
+    def __init__(self, panel: Optional[TitanPricePanel] = None, store: Optional[TitanResultStore] = None,
+                 workers: int = Config.BACKTEST_WORKERS):
+        self.panel = panel or TitanPricePanel()
+        self.store = store
+        self.workers = workers
+
+    def run(self, codes: Iterable[str], start_date: str = "2023-01-01",
+            initial_capital: float = 1000000) -> Iterator[Tuple[str, Optional[Dict]]]:
+        codes = [str(c).strip() for c in dict.fromkeys(codes) if str(c).strip()]
+        cash = [c for c in codes if c.upper() in CASH_CODES]
+        frames = self.panel.fetch([c for c in codes if c not in cash], start=start_date)
+
+        # 現金部位沿用本批行情的交易日曆；整批只有現金時以工作日曆代替
+        calendar = pd.DatetimeIndex([])
+        for frame in frames.values():
+            calendar = calendar.union(frame.index)
+        if calendar.empty and cash:
+            calendar = pd.bdate_range(start_date, datetime.now())
+        for code in cash:
+            yield code, cash_backtest(calendar, initial_capital)
+
+        pending = {}
+        for code in codes:
+            if code in cash:
+                continue
+            bars = frames.get(code)
+            if bars is None:
+                yield code, None
+                continue
+            bars = bars.dropna(subset=['Close'])
+            params = {"ticker": code, "start_date": str(start_date), "initial_capital": initial_capital}
+            data_fp = data_fingerprint(bars)
+            stored = self.store.get(STRATEGY_ID, params, data_fp) if self.store else None
+            if stored:
+                yield code, join_curves(stored)
+            else:
+                pending[code] = (bars, params, data_fp)
+
+        for code, result in self._simulate(pending, initial_capital):
+            if result and self.store:
+                params, data_fp = pending[code][1:]
+                self.store.put(STRATEGY_ID, params, data_fp, *split_curves(result))
+            yield code, result
+
+    def _simulate(self, pending: Dict, initial_capital: float) -> Iterator[Tuple[str, Optional[Dict]]]:
+        """workers <= 1 或只有一檔時於本行程循序執行；否則行程池平行並依完成順序回傳"""
+        if self.workers <= 1 or len(pending) <= 1:
+            for code, (bars, _, _) in pending.items():
+                try:
+                    yield code, trend_backtest(bars, initial_capital)
+                except Exception:
+                    yield code, None
+            return
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(pending))) as pool:
+            futures = {pool.submit(trend_backtest, bars[['Close']], initial_capital): code
+                       for code, (bars, _, _) in pending.items()}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception:
+                    yield futures[future], None
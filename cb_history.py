@@ -0,0 +1,242 @@
+# cb_history.py
+# Titan SOP V82.1 - CB Daily History Store
+# 狀態: 本地 CB 日價格庫 (每次上傳的 CB 清單 + CSV 批次匯入)
+# 修正重點:
+# 1. [欄式儲存] 日期 × CB 代號 的 float32 矩陣 (CB 價、標的價) 加上依代號排序的中繼資料，整庫一份 .npz。
+# 2. [合併] 新資料以 np.union1d 擴充日期/代號軸後整塊覆寫 (同日同代號以新值為準)，重複匯入不會重複累積。
+# 3. [來源] 上傳的 CB 清單 (當日快照)、長格式 CSV (日期, 代號, 價格...)、寬格式 CSV (日期 × 代號)、普查歷史快照。
+# 4. [快照日期] 無日期欄的清單以指定日期 (預設最近一個已收盤交易日) 入庫；該日已有不同內容的快照時拒絕寫入。
+
+import io
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+from config import DATA_DIR
+from typing import Dict, Iterable, Optional, Union
+
+MARKET_CLOSE = "13:30"     # 台股收盤時間；此前上傳的清單視為前一交易日的收盤資料
+
+# 匯入時可辨識的欄名 (小寫比對)
+_COLUMN_ALIASES = {
+    "date": ["date", "日期", "資料日期", "交易日期"],
+    "code": ["code", "代號", "債券代號", "cb_code"],
+    "price": ["price", "close", "收盤", "收盤價", "可轉債市價", "市價"],
+    "stock_price": ["stock_price", "underlying_price", "標的股票市價", "標的價"],
+    "stock_code": ["stock_code", "標的代號", "標的股票代號"],
+    "name": ["name", "名稱", "債券名稱"],
+}
+
+
+def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """將常見的中英文欄名對應到 date / code / price / stock_price / stock_code / name"""
+    rename = {}
+    lowered = {c: str(c).strip().replace(" ", "").lower() for c in df.columns}
+    for target, aliases in _COLUMN_ALIASES.items():
+        if target in df.columns:
+            continue
+        match = next((c for c, low in lowered.items() if low in aliases and c not in rename), None)
+        if match is not None:
+            rename[match] = target
+    return df.rename(columns=rename)
+
+
+def last_trading_day(now=None) -> pd.Timestamp:
+    """最近一個已收盤的交易日 (收盤前取前一個工作日，週末回推至週五；國定假日不處理)"""
+    now = pd.Timestamp(now if now is not None else datetime.now())
+    day = now.normalize()
+    if now < day + pd.Timedelta(MARKET_CLOSE + ":00"):
+        day -= pd.Timedelta(days=1)
+    return day if day.dayofweek < 5 else day - pd.offsets.BDay(1)
+
+
+class TitanCBHistory:
+    """
+    CB 日價格庫
+    dates (datetime64[D], 遞增) × codes (str, 排序) 的 price / stock_price 矩陣；
+    names / stock_codes 與 codes 對齊 (以最近一次匯入為準)。
+    """
+
+    FIELDS = ('price', 'stock_price')
+
+    def __init__(self, path: Path = DATA_DIR / "cb_history.npz"):
+        self.path = Path(path)
+        self.dates = np.array([], dtype='datetime64[D]')
+        self.codes = np.array([], dtype=str)
+        self.names = np.array([], dtype=str)
+        self.stock_codes = np.array([], dtype=str)
+        self.data: Dict[str, np.ndarray] = {f: np.empty((0, 0), dtype=np.float32) for f in self.FIELDS}
+        if self.path.exists():
+            self._load()
+
+    # ------------------------------------------------------------------
+    # 持久化
+    # ------------------------------------------------------------------
+    def _load(self):
+        with np.load(self.path, allow_pickle=False) as data:
+            self.dates = data['dates'].astype('datetime64[D]')
+            self.codes = data['codes'].astype(str)
+            self.names = data['names'].astype(str)
+            self.stock_codes = data['stock_codes'].astype(str)
+            self.data = {f: data[f] for f in self.FIELDS}
+
+    def save(self) -> Path:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(self.path, dates=self.dates, codes=self.codes, names=self.names,
+                            stock_codes=self.stock_codes, **self.data)
+        return self.path
+
+    # ------------------------------------------------------------------
+    # 匯入
+    # ------------------------------------------------------------------
+    def ingest(self, frame: pd.DataFrame, date=None, save: bool = True) -> int:
+        """
+        長格式資料併入: 需 code 與 price 欄；date 欄缺少時以 date 參數 (預設今天) 為資料日期。
+        回傳寫入的 (日期, 代號) 筆數。
+        """
+        if frame is None or frame.empty:
+            return 0
+        df = _normalize_columns(frame)
+        if 'code' not in df.columns or 'price' not in df.columns:
+            raise ValueError("CB 歷史匯入需要 code (代號) 與 price (價格) 欄位")
+
+        if 'date' in df.columns:
+            days = pd.to_datetime(df['date'], errors='coerce', format='mixed')
+        else:
+            days = pd.Series(pd.Timestamp(date or datetime.now()), index=df.index)
+        work = pd.DataFrame({
+            "date": days.dt.normalize().to_numpy().astype('datetime64[D]'),
+            "code": df['code'].astype(str).str.extract(r'(\d+)', expand=False).to_numpy(),
+            "price": pd.to_numeric(df['price'], errors='coerce').to_numpy(dtype=float),
+            "stock_price": pd.to_numeric(df['stock_price'], errors='coerce').to_numpy(dtype=float)
+            if 'stock_price' in df.columns else np.nan,
+        })
+        for col in ['stock_code', 'name']:
+            work[col] = df[col].astype(str).to_numpy() if col in df.columns else ''
+        if 'stock_code' in df.columns:
+            work['stock_code'] = work['stock_code'].str.extract(r'(\d+)', expand=False).fillna('')
+        work = work.dropna(subset=['code'])
+        work = work[~np.isnat(work['date'].to_numpy()) & (work['price'] > 0)]
+        work = work.drop_duplicates(subset=['date', 'code'], keep='last')
+        if work.empty:
+            return 0
+
+        self._expand(np.unique(work['date'].to_numpy()), np.unique(work['code'].to_numpy().astype(str)))
+        rows = np.searchsorted(self.dates, work['date'].to_numpy())
+        cols = np.searchsorted(self.codes, work['code'].to_numpy().astype(str))
+        self.data['price'][rows, cols] = work['price'].to_numpy(dtype=np.float32)
+        stock = work['stock_price'].to_numpy(dtype=float)
+        has_stock = np.isfinite(stock)
+        self.data['stock_price'][rows[has_stock], cols[has_stock]] = stock[has_stock]
+
+        # 中繼資料以每個代號最新一筆非空值為準
+        latest = work.sort_values('date').drop_duplicates(subset='code', keep='last')
+        idx = np.searchsorted(self.codes, latest['code'].to_numpy().astype(str))
+        for attr, col in [('names', 'name'), ('stock_codes', 'stock_code')]:
+            values = latest[col].fillna('').astype(str).to_numpy()
+            current = getattr(self, attr).astype(object)
+            current[idx] = np.where(values != '', values, current[idx])
+            setattr(self, attr, current.astype(str))
+
+        if save:
+            self.save()
+        return len(work)
+
+    def _expand(self, new_dates: np.ndarray, new_codes: np.ndarray):
+        """擴充日期/代號軸，既有矩陣整塊搬到新位置"""
+        dates = np.union1d(self.dates, new_dates.astype('datetime64[D]'))
+        codes = np.union1d(self.codes, new_codes)
+        if len(dates) == len(self.dates) and len(codes) == len(self.codes):
+            return
+        r = np.searchsorted(dates, self.dates)
+        c = np.searchsorted(codes, self.codes)
+        for field in self.FIELDS:
+            grown = np.full((len(dates), len(codes)), np.nan, dtype=np.float32)
+            if self.data[field].size:
+                grown[np.ix_(r, c)] = self.data[field]
+            self.data[field] = grown
+        meta = {}
+        for attr in ('names', 'stock_codes'):
+            grown = np.full(len(codes), '', dtype=object)
+            grown[c] = getattr(self, attr)
+            meta[attr] = grown.astype(str)
+        self.dates, self.codes = dates, codes
+        self.names, self.stock_codes = meta['names'], meta['stock_codes']
+
+    def ingest_cb_list(self, df: pd.DataFrame, date=None) -> int:
+        """
+        側邊欄上傳的 CB 清單 (code / name / stock_code / close / underlying_price) 當作 date 當日的快照；
+        date 省略為最近一個已收盤交易日。清單無日期欄且該日已存有不同價格時拋出 ValueError (不覆寫)。
+        """
+        frame = df.rename(columns={'close': 'price', 'underlying_price': 'stock_price'})
+        day = pd.Timestamp(date).normalize() if date is not None else last_trading_day()
+        normalized = _normalize_columns(frame)
+        if 'date' not in normalized.columns and 'code' in normalized.columns and 'price' in normalized.columns:
+            stored = self.panel('price', start=day, end=day)
+            if len(stored):
+                codes = normalized['code'].astype(str).str.extract(r'(\d+)', expand=False)
+                incoming = pd.Series(pd.to_numeric(normalized['price'], errors='coerce').to_numpy(dtype=np.float32),
+                                     index=codes.to_numpy()).dropna()
+                incoming = incoming[~incoming.index.duplicated(keep='last')]
+                existing = stored.iloc[0].reindex(incoming.index)
+                both = existing.notna().to_numpy()
+                if both.any() and not np.allclose(existing.to_numpy()[both], incoming.to_numpy()[both], rtol=1e-6):
+                    raise ValueError(f"{day:%Y-%m-%d} 已有不同內容的 CB 快照，未寫入 (請確認清單的資料日期)")
+        return self.ingest(frame, date=day)
+
+    def import_csv(self, source: Union[str, Path, io.IOBase]) -> int:
+        """
+        CSV 批次匯入:
+        - 長格式: 每列一筆 (日期, 代號, 價格[, 標的價, 標的代號, 名稱])
+        - 寬格式: 第一欄為日期，其餘欄名為 CB 代號、值為收盤價
+        """
+        raw = pd.read_csv(source)
+        df = _normalize_columns(raw)
+        if 'code' not in df.columns:
+            df = df.rename(columns={df.columns[0]: 'date'})
+            df = df.melt(id_vars='date', var_name='code', value_name='price')
+        return self.ingest(df)
+
+    def backfill_from_scans(self, history) -> int:
+        """以普查歷史快照 (TitanScanHistory) 回補: 每份快照皆有 code / stock_code / price / stock_price"""
+        total = 0
+        for date in history.dates():
+            total += self.ingest(history.load_frame(date), date=date, save=False)
+        if total:
+            self.save()
+        return total
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def panel(self, field: str = 'price', codes: Optional[Iterable[str]] = None,
+              start=None, end=None) -> pd.DataFrame:
+        """日期 × CB 代號 的價格面板 (float64)；codes 省略為全部"""
+        if field not in self.FIELDS:
+            raise ValueError(f"未知欄位: {field} (可用: {self.FIELDS})")
+        cols = np.arange(len(self.codes))
+        if codes is not None:
+            cols = np.flatnonzero(np.isin(self.codes, [str(c) for c in codes]))
+        lo = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start).date(), 'D')) if start is not None else 0
+        hi = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end).date(), 'D'), side='right') if end is not None else len(self.dates)
+        values = self.data[field][lo:hi][:, cols].astype(float) if len(self.dates) else np.empty((0, len(cols)))
+        return pd.DataFrame(values, index=pd.DatetimeIndex(self.dates[lo:hi]), columns=self.codes[cols])
+
+    def stock_map(self) -> pd.Series:
+        """CB 代號 → 標的代號"""
+        return pd.Series(self.stock_codes, index=self.codes)
+
+    def summary(self) -> pd.DataFrame:
+        """各 CB 的資料起訖日、筆數與最新價"""
+        if not len(self.codes):
+            return pd.DataFrame(columns=['code', 'name', 'stock_code', 'first', 'last', 'days', 'last_price'])
+        price = self.data['price']
+        valid = np.isfinite(price)
+        days = valid.sum(axis=0)
+        first = np.where(days > 0, valid.argmax(axis=0), 0)
+        last = np.where(days > 0, len(self.dates) - 1 - valid[::-1].argmax(axis=0), 0)
+        return pd.DataFrame({
+            "code": self.codes, "name": self.names, "stock_code": self.stock_codes,
+            "first": self.dates[first], "last": self.dates[last], "days": days,
+            "last_price": price[last, np.arange(len(self.codes))].astype(float),
+        })
@@ -0,0 +1,168 @@
+# cb_pricing.py
+# Titan SOP V82.1 - Convertible Bond Fair Value Engine
+# 狀態: 全市場 CB 理論價值批次定價 (CRR 二元樹，一次向量化計算整份清單)
+# 修正重點:
+# 1. [批次二元樹] 所有 CB 共用同一步數，樹節點以 (CB 數 × 節點) 矩陣逆推，每檔各自的年期、波動率與轉換比例並列計算。
+# 2. [條款] 到期還本、任一節點可轉換、賣回日當步可依賣回價賣回；另算債底 (Bond Floor) 與 Delta。
+# 3. [評價落差] valuation_gap = (理論價 - 市價) / 市價，取代「只看絕對價格」的便宜判斷。
+
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from config import Config
+from typing import Dict, Optional
+
+
+def historical_volatility(closes: pd.DataFrame, window: int = 252) -> pd.Series:
+    """收盤價面板 (日期 × 標的) → 各標的近 window 筆的年化對數報酬波動率"""
+    if closes is None or closes.empty:
+        return pd.Series(dtype=float)
+    log_ret = np.log(closes.where(closes > 0)).diff()
+    return log_ret.tail(window).std() * np.sqrt(252)
+
+
+def _parse_days(values, n: int) -> np.ndarray:
+    if values is None:
+        return np.full(n, np.datetime64('NaT'), dtype='datetime64[D]')
+    parsed = pd.to_datetime(pd.Series(values).astype(str), errors='coerce', format='mixed')
+    return parsed.to_numpy(dtype='datetime64[D]')
+
+
+def crr_convertible(stock_price: np.ndarray, conversion_ratio: np.ndarray, maturity: np.ndarray,
+                    volatility: np.ndarray, put_time: np.ndarray, put_price: np.ndarray,
+                    redemption: np.ndarray, rate: float = Config.CB_RISK_FREE_RATE,
+                    spread: float = Config.CB_CREDIT_SPREAD, steps: int = Config.CB_LATTICE_STEPS) -> Dict[str, np.ndarray]:
+    """
+    批次 CRR 二元樹 (所有輸入皆為長度 N 的陣列，年期以年計)。
+    股價以無風險利率成長、節點價值以 (無風險利率 + 信用利差) 折現 (簡化的信用風險處理)。
+    put_time 為 NaN 或不在 (0, 年期) 內者視為無賣回條款。
+    回傳 fair_value / delta (CB 價格對標的價格) / bond_floor。
+    """
+    S = np.asarray(stock_price, dtype=float)
+    ratio = np.asarray(conversion_ratio, dtype=float)
+    T = np.asarray(maturity, dtype=float)
+    sigma = np.asarray(volatility, dtype=float)
+    put_time = np.asarray(put_time, dtype=float)
+    put_price = np.asarray(put_price, dtype=float)
+    redemption = np.asarray(redemption, dtype=float)
+
+    valid = (S > 0) & (ratio > 0) & (T > 0) & (sigma > 0)
+    # 無效列以安全值代入，計算後再遮罩為 NaN
+    S_ = np.where(valid, S, 1.0)
+    ratio_ = np.where(valid, ratio, 0.0)
+    T_ = np.where(valid, T, 1.0)
+    sigma_ = np.where(valid, sigma, 0.3)
+
+    dt = T_ / steps
+    u = np.exp(sigma_ * np.sqrt(dt))
+    d = 1.0 / u
+    p = np.clip((np.exp(rate * dt) - d) / (u - d), 0.0, 1.0)[:, None]
+    disc = np.exp(-(rate + spread) * dt)[:, None]
+
+    has_put = valid & np.isfinite(put_time) & (put_time > 0) & (put_time < T_)
+    put_step = np.where(has_put, np.rint(np.where(has_put, put_time, 0) / dt), -1).astype(int)
+
+    def node_prices(i: int) -> np.ndarray:
+        j = np.arange(i + 1)
+        return S_[:, None] * u[:, None] ** (2 * j - i)
+
+    value = np.maximum(ratio_[:, None] * node_prices(steps), redemption[:, None])
+    step1 = None
+    for i in range(steps - 1, -1, -1):
+        value = disc * (p * value[:, 1:i + 2] + (1 - p) * value[:, :i + 1])
+        value = np.maximum(value, ratio_[:, None] * node_prices(i))
+        on_put = put_step == i
+        if on_put.any():
+            value[on_put] = np.maximum(value[on_put], put_price[on_put, None])
+        if i == 1:
+            step1 = value.copy()
+
+    fair_value = value[:, 0]
+    if step1 is not None:
+        delta = (step1[:, 1] - step1[:, 0]) / (S_ * u - S_ * d)
+    else:
+        delta = np.full(len(S_), np.nan)
+
+    bond_floor = redemption * np.exp(-(rate + spread) * T_)
+    put_floor = np.where(has_put, put_price * np.exp(-(rate + spread) * np.where(has_put, put_time, 0)), 0.0)
+    bond_floor = np.maximum(bond_floor, put_floor)
+
+    nan = np.full(len(S_), np.nan)
+    return {
+        "fair_value": np.where(valid, fair_value, nan),
+        "delta": np.where(valid, delta, nan),
+        "bond_floor": np.where(valid, bond_floor, nan),
+    }
+
+
+class TitanCBPricer:
+    """CB 理論價值定價器: 由 CB 清單欄位推導條款，整份清單一次定價"""
+
+    OUTPUT_COLUMNS = ['fair_value', 'bond_floor', 'cb_delta', 'hedge_ratio', 'valuation_gap', 'volatility']
+
+    def __init__(self, steps: int = Config.CB_LATTICE_STEPS, rate: float = Config.CB_RISK_FREE_RATE,
+                 spread: float = Config.CB_CREDIT_SPREAD, default_volatility: float = Config.CB_DEFAULT_VOLATILITY):
+        self.steps = steps
+        self.rate = rate
+        self.spread = spread
+        self.default_volatility = default_volatility
+
+    def _terms(self, df: pd.DataFrame, today: np.datetime64) -> Dict[str, np.ndarray]:
+        """到期年限、賣回年限與賣回價 (缺欄位時以發行日 + 發行年期推算到期日)"""
+        n = len(df)
+        maturity = _parse_days(df['maturity_date'] if 'maturity_date' in df.columns else None, n)
+        for col in ['issue_date', 'list_date']:
+            if col in df.columns:
+                issued = _parse_days(df[col], n)
+                inferred = issued + np.timedelta64(int(round(365.25 * Config.CB_TENOR_YEARS)), 'D')
+                maturity = np.where(np.isnat(maturity), inferred, maturity)
+        years = (maturity - today).astype(float) / 365.0
+        # 完全缺少日期者假設剩一個完整年期
+        years = np.where(np.isnat(maturity), float(Config.CB_TENOR_YEARS), years)
+
+        put = _parse_days(df['put_date'] if 'put_date' in df.columns else None, n)
+        put_years = np.where(np.isnat(put), np.nan, (put - today).astype(float) / 365.0)
+        put_price = pd.to_numeric(df['put_price'], errors='coerce').fillna(Config.CB_PUT_PRICE).to_numpy(dtype=float) \
+            if 'put_price' in df.columns else np.full(n, Config.CB_PUT_PRICE)
+        return {"maturity": years, "put_time": put_years, "put_price": put_price}
+
+    def price_frame(self, df: pd.DataFrame, today=None) -> pd.DataFrame:
+        """
+        為整份 CB 清單加上 fair_value / bond_floor / cb_delta / hedge_ratio / valuation_gap / volatility。
+        需要欄位 price、stock_price、conversion_price；volatility 欄位 (年化) 缺值時使用預設波動率。
+        """
+        work_df = df.copy()
+        if work_df.empty:
+            for col in self.OUTPUT_COLUMNS:
+                work_df[col] = pd.Series(dtype=float)
+            return work_df
+
+        today = np.datetime64(pd.Timestamp(today or datetime.now()).date(), 'D')
+        price = pd.to_numeric(work_df.get('price', np.nan), errors='coerce').to_numpy(dtype=float)
+        stock_price = pd.to_numeric(work_df.get('stock_price', np.nan), errors='coerce').to_numpy(dtype=float)
+        conversion_price = pd.to_numeric(work_df.get('conversion_price', np.nan), errors='coerce').to_numpy(dtype=float)
+        volatility = pd.to_numeric(work_df.get('volatility', np.nan), errors='coerce').to_numpy(dtype=float)
+        volatility = np.clip(np.where(np.isfinite(volatility) & (volatility > 0), volatility, self.default_volatility), 0.05, 2.0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(conversion_price > 0, Config.CB_PAR_VALUE / conversion_price, np.nan)
+        terms = self._terms(work_df, today)
+        out = crr_convertible(
+            stock_price, ratio, terms["maturity"], volatility, terms["put_time"], terms["put_price"],
+            np.full(len(work_df), float(Config.CB_PAR_VALUE)), rate=self.rate, spread=self.spread, steps=self.steps
+        )
+
+        work_df['fair_value'] = out["fair_value"]
+        work_df['bond_floor'] = out["bond_floor"]
+        work_df['cb_delta'] = out["delta"]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            work_df['hedge_ratio'] = out["delta"] / ratio
+            work_df['valuation_gap'] = np.where(price > 0, (out["fair_value"] - price) / price * 100, np.nan)
+        work_df['volatility'] = volatility
+        return work_df
+
+    @staticmethod
+    def rank(priced: pd.DataFrame, top: Optional[int] = None) -> pd.DataFrame:
+        """依評價落差排序 (理論價高於市價越多越前面)，無法定價者排最後"""
+        ranked = priced.sort_values('valuation_gap', ascending=False, na_position='last', kind='stable')
+        return ranked.head(top) if top else ranked
@@ -49,6 +49,18 @@ class Config:
 
     EXIT_TARGET_MEDIAN = 152
 
+    # --- 3.1 CB 理論定價 (cb_pricing.py 二元樹) ---
+    CB_TENOR_YEARS = 3              # 台灣 CB 常見發行年期 (無到期日欄位時以發行日推算)
+    CB_PUT_PRICE = 100.0            # 賣回價 (無 put_price 欄位時的預設)
+    CB_RISK_FREE_RATE = 0.015
+    CB_CREDIT_SPREAD = 0.02         # 債券部位折現加計的信用利差
+    CB_DEFAULT_VOLATILITY = 0.35    # 標的歷史波動率不足時的預設值
+    CB_LATTICE_STEPS = 100
+
+    # --- 3.2 回測運算資源 ---
+    BACKTEST_WORKERS = max(1, (os.cpu_count() or 1) - 1)   # 參數網格等平行回測的行程數 (1 = 單行程循序執行)
+    MA_CACHE_MB = 256       # 參數網格每個行程的均線快取上限 (MB)，超過時淘汰最久未用的週期
+
     # --- 4. 宏觀監控 ---
     TICKER_TSE = "^TWII"     # 台灣加權指數
     TICKER_VIX = "^VIX"
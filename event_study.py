@@ -0,0 +1,171 @@
+# event_study.py
+# Titan SOP V82.1 - Time-Arbitrage Event Study
+# 狀態: 四大時間套利法則實證 (事件研究: 異常報酬與勝率)
+# 修正重點:
+# 1. [事件表] 蜜月期滿 / 沈睡甦醒 / 避稅行情由 CalendarAgent 批次推算 (與行事曆同一套定義)；
+#    融券回補 (3-4月) 與除權息 (6-8月) 季節事件為每年季初 × 全部標的。
+# 2. [三維陣列] 以 (事件 × 位移日) 索引矩陣一次從收盤價面板取出視窗，組成 事件 × 位移 × 指標 陣列，
+#    平均 / 中位數異常報酬與勝率皆為沿事件軸的向量化統計，不逐事件迴圈。
+# 3. [快取] 結果寫入結果庫 (鍵含價格面板與事件表指紋)，CB 清單與行情不變時直接取回。
+
+import numpy as np
+import pandas as pd
+from config import Config
+from execution import CalendarAgent
+from fingerprint import frame_fingerprint
+from price_panel import TitanPricePanel
+from result_store import TitanResultStore
+from typing import Dict, Optional, Sequence, Tuple
+
+EVENT_LABELS = {
+    "honeymoon_end": "蜜月期滿 (Listing+90)",
+    "awakening": "沈睡甦醒 (Listing+365)",
+    "tax_rally_start": "避稅行情 (Put-180)",
+    "short_cover": "融券回補旺季 (3-4月)",
+    "dividend": "除權息旺季 (6-8月)",
+}
+CUBE_METRICS = ('return', 'benchmark', 'abnormal')
+
+
+def build_events(cb_df: pd.DataFrame, calendar: Optional[CalendarAgent] = None,
+                 years: Sequence[int] = ()) -> pd.DataFrame:
+    """
+    CB 清單 → 事件表 (event, code, stock_code, date)。
+    個券事件需 list_date / put_date；季節事件對每個標的、每個年度各產生一筆 (季初第一天)。
+    """
+    columns = ['event', 'code', 'stock_code', 'date']
+    if cb_df is None or cb_df.empty or 'stock_code' not in cb_df.columns:
+        return pd.DataFrame(columns=columns)
+    calendar = calendar or CalendarAgent()
+    n = len(cb_df)
+    codes = cb_df['code'].astype(str).str.strip().to_numpy() if 'code' in cb_df.columns else np.full(n, '')
+    stocks = cb_df['stock_code'].astype(str).str.extract(r'(\d+)', expand=False).fillna('').to_numpy()
+    traps = calendar.calculate_time_traps_batch(
+        cb_df['list_date'] if 'list_date' in cb_df.columns else [None] * n,
+        cb_df['put_date'] if 'put_date' in cb_df.columns else [None] * n,
+    )
+
+    frames = []
+    for key in ('honeymoon_end', 'awakening', 'tax_rally_start'):
+        dates = traps[key]
+        keep = ~np.isnat(dates) & (stocks != '')
+        frames.append(pd.DataFrame({"event": key, "code": codes[keep], "stock_code": stocks[keep], "date": dates[keep]}))
+
+    underlyings = np.unique(stocks[stocks != ''])
+    for key, month in (("short_cover", Config.EVENT_SHORT_COVER_MONTHS[0]), ("dividend", Config.EVENT_DIVIDEND_MONTHS[0])):
+        starts = np.array([f"{y}-{month:02d}-01" for y in years], dtype='datetime64[D]')
+        if len(starts) and len(underlyings):
+            frames.append(pd.DataFrame({
+                "event": key, "code": "",
+                "stock_code": np.repeat(underlyings, len(starts)),
+                "date": np.tile(starts, len(underlyings)),
+            }))
+    events = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    return events.drop_duplicates(subset=['event', 'stock_code', 'date']).reset_index(drop=True)
+
+
+def event_cube(closes: pd.DataFrame, benchmark: pd.Series, events: pd.DataFrame,
+               offsets: Sequence[int]) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    事件 × 位移 × 指標 (return / benchmark / abnormal) 的三維陣列。
+    位移 0 為事件日當天或之後第一個交易日；各位移的累積報酬以事件前一交易日收盤為基準，
+    視窗超出資料範圍的事件捨棄。回傳 (cube, 對應的事件表)。
+    """
+    offsets = np.asarray(offsets, dtype=int)
+    dates = closes.index.to_numpy(dtype='datetime64[D]')
+    col_of = {str(c): j for j, c in enumerate(closes.columns)}
+    cols = events['stock_code'].map(col_of)
+    pos = np.searchsorted(dates, events['date'].to_numpy(dtype='datetime64[D]'), side='left')
+    keep = (cols.notna().to_numpy() & (pos + min(offsets.min(), -1) >= 0)
+            & (pos + max(offsets.max(), 0) < len(dates)))
+    events = events[keep].reset_index(drop=True)
+    if events.empty:
+        return np.empty((0, len(offsets), len(CUBE_METRICS))), events
+
+    pos, cols = pos[keep], cols[keep].to_numpy(dtype=int)
+    prices = closes.to_numpy(dtype=float)
+    bench = benchmark.reindex(closes.index).ffill().to_numpy(dtype=float)
+    idx = pos[:, None] + offsets[None, :]
+    base = prices[pos - 1, cols]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ret = prices[idx, cols[:, None]] / base[:, None] - 1
+        mkt = bench[idx] / bench[pos - 1][:, None] - 1
+    return np.stack([ret, mkt, ret - mkt], axis=2), events
+
+
+def summarize_cube(cube: np.ndarray, events: pd.DataFrame, offsets: Sequence[int],
+                   horizons: Sequence[int]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    依事件類型彙整: (各持有天數的 平均/中位數異常報酬、勝率、樣本數) 與 (平均累積異常報酬路徑)。
+    勝率 = 異常報酬 > 0 的事件比例 (以有效樣本為分母)。
+    """
+    offsets = list(offsets)
+    abnormal = cube[:, :, CUBE_METRICS.index('abnormal')]
+    rows, paths = [], {}
+    for key, members in events.groupby('event').groups.items():
+        block = abnormal[np.asarray(members)]
+        paths[key] = np.nanmean(block, axis=0) if len(block) else np.full(len(offsets), np.nan)
+        for h in horizons:
+            if h not in offsets:
+                continue
+            values = block[:, offsets.index(h)]
+            valid = np.isfinite(values)
+            rows.append({
+                "event": key, "label": EVENT_LABELS.get(key, key), "horizon": h, "events": int(valid.sum()),
+                "mean_abnormal": float(np.nanmean(values)) if valid.any() else np.nan,
+                "median_abnormal": float(np.nanmedian(values)) if valid.any() else np.nan,
+                "hit_rate": float((values[valid] > 0).mean()) if valid.any() else np.nan,
+            })
+    summary = pd.DataFrame(rows, columns=['event', 'label', 'horizon', 'events', 'mean_abnormal',
+                                          'median_abnormal', 'hit_rate'])
+    return summary, pd.DataFrame(paths, index=pd.Index(offsets, name='offset'))
+
+
+class TitanEventStudy:
+    """
+    時間套利事件研究
+    run(cb_df) → summary (事件 × 持有天數)、car (位移 × 事件 的平均累積異常報酬)、n_events。
+    行情取自共用價格面板 (標的股 + 大盤基準一次批次下載)。
+    """
+
+    def __init__(self, panel: Optional[TitanPricePanel] = None, calendar: Optional[CalendarAgent] = None,
+                 store: Optional[TitanResultStore] = None, start_date: str = "2015-01-01",
+                 benchmark: str = "^TWII", offsets: Sequence[int] = range(-20, 61),
+                 horizons: Sequence[int] = (5, 20, 60)):
+        self.panel = panel or TitanPricePanel()
+        self.calendar = calendar or CalendarAgent()
+        self.store = store
+        self.start_date = start_date
+        self.benchmark = benchmark
+        self.offsets = list(offsets)
+        self.horizons = list(horizons)
+
+    def run(self, cb_df: pd.DataFrame) -> Dict:
+        stocks = (cb_df['stock_code'].astype(str).str.extract(r'(\d+)', expand=False).dropna().unique().tolist()
+                  if cb_df is not None and 'stock_code' in cb_df.columns else [])
+        closes = self.panel.close_panel(stocks + [self.benchmark], start=self.start_date)
+        if closes.empty or self.benchmark not in closes.columns:
+            return {}
+        benchmark = closes.pop(self.benchmark)
+        years = range(closes.index[0].year, closes.index[-1].year + 1)
+        events = build_events(cb_df, self.calendar, years)
+
+        params = {"start_date": self.start_date, "benchmark": self.benchmark,
+                  "offsets": self.offsets, "horizons": self.horizons}
+        data_fp = f"{frame_fingerprint(closes.reset_index())}|{frame_fingerprint(events)}"
+        stored = self.store.get("event_study", params, data_fp) if self.store else None
+        if stored:
+            result = stored['metrics']
+            return {"summary": pd.DataFrame(result['summary']),
+                    "car": pd.DataFrame(result['car'], index=pd.Index(self.offsets, name='offset')),
+                    "n_events": result['n_events']}
+
+        cube, used = event_cube(closes, benchmark, events, self.offsets)
+        summary, car = summarize_cube(cube, used, self.offsets, self.horizons)
+        if self.store:
+            self.store.put("event_study", params, data_fp, {
+                "summary": summary.to_dict(orient='records'),
+                "car": {k: car[k].tolist() for k in car.columns},
+                "n_events": len(used),
+            })
+        return {"summary": summary, "car": car, "n_events": len(used)}
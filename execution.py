@@ -5,13 +5,28 @@
 # 1. [完整收錄] 實作四大時間套利邏輯 (IPO, 甦醒, 避稅, 行事曆)。
 # 2. [沈睡甦醒] 新增上市滿一年的「第二波攻擊日」計算。
 # 3. [行事曆事件] 自動計算當年度的融券回補與除權息旺季。
+# 4. [批次欄式] 新增 calculate_time_traps_batch，整欄日期一次計算為 datetime64 陣列。
+# 5. [事件索引] 新增 TimeArbitrageIndex，依事件類型排序索引，二分搜尋區間查詢並支援增量更新。
 
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 from config import Config
-from typing import List, Dict
+from typing import List, Dict, Iterable, Optional
 
 class CalendarAgent:
+
+    # 時間陷阱定義 (欄位鍵, 事件名稱, 說明, 類型)；單筆與批次計算共用
+    TRAP_DEFINITIONS = [
+        ("honeymoon_end", "🔔 蜜月期滿 (Listing+90)",
+         "上市滿3個月(敲鑼打鼓期)，留意解禁後的賣壓或主力拉抬方向。", "IPO"),
+        ("awakening", "⏰ 沈睡甦醒 (Listing+365)",
+         "鄭思翰法則：新債若首季未動，滿一週年常有「甦醒行情」。", "Awakening"),
+        ("tax_rally_start", "🚀 避稅行情啟動 (Put-180)",
+         "進入賣回日前半年。若股價低於轉換價，公司派易拉抬以避免債券持有人執行賣回。", "PutBack"),
+        ("put_date", "⚠️ 賣回基準日 (Put Date)",
+         "投資人可選擇以保本價賣回給公司的日子。此日前股價若未拉過轉換價，需提防違約風險。", "Risk"),
+    ]
     
     def _get_current_year_events(self) -> List[Dict]:
         """計算當年度的固定行事曆事件 (融券/除權息)"""
@@ -36,55 +51,206 @@ class CalendarAgent:
         
         return events
 
+    @staticmethod
+    def _to_day_array(values) -> np.ndarray:
+        """將任意日期欄位 (字串/Timestamp/空值) 轉為 datetime64[D] 陣列，無法解析者為 NaT"""
+        s = pd.Series(values)
+        if not pd.api.types.is_datetime64_any_dtype(s):
+            s = pd.to_datetime(s.astype(str), errors='coerce', format='mixed')
+        elif getattr(s.dt, 'tz', None) is not None:
+            s = s.dt.tz_localize(None)
+        return s.to_numpy(dtype='datetime64[D]')
+
+    def calculate_time_traps_batch(self, listing_dates, put_dates) -> Dict:
+        """
+        [批次版] 整欄計算所有 CB 的時間套利陷阱
+        回傳欄式 datetime64[D] 陣列 (honeymoon_end / awakening / tax_rally_start / put_date)，
+        上市日或賣回日任一缺漏的列全部為 NaT；當年度行事曆事件只計算一次。
+        """
+        l_dates = self._to_day_array(listing_dates)
+        p_dates = self._to_day_array(put_dates)
+        valid = ~np.isnat(l_dates) & ~np.isnat(p_dates)
+        nat = np.datetime64('NaT', 'D')
+
+        def _offset(base, days):
+            return np.where(valid, base + np.timedelta64(days, 'D'), nat)
+
+        return {
+            "honeymoon_end": _offset(l_dates, Config.LISTING_HONEYMOON_DAYS),
+            "awakening": _offset(l_dates, Config.LISTING_DORMANT_DAYS),
+            "tax_rally_start": _offset(p_dates, -Config.PUT_AVOID_TAX_DAYS),
+            "put_date": _offset(p_dates, 0),
+            "valid": valid,
+            "calendar_events": self._get_current_year_events(),
+        }
+
+    def expand_time_traps(self, traps: Dict) -> List[List[Dict]]:
+        """將批次結果展開為逐列事件清單 (與 calculate_time_traps 格式一致，供報告使用)"""
+        date_strs = {key: np.datetime_as_string(traps[key], unit='D') for key, _, _, _ in self.TRAP_DEFINITIONS}
+        calendar_evts = traps["calendar_events"]
+
+        all_events = []
+        for i, is_valid in enumerate(traps["valid"]):
+            if not is_valid:
+                all_events.append([])
+                continue
+            events = [
+                {"date": date_strs[key][i], "event": event, "desc": desc, "type": evt_type}
+                for key, event, desc, evt_type in self.TRAP_DEFINITIONS
+            ]
+            events.extend(dict(e) for e in calendar_evts)
+            events.sort(key=lambda x: x['date'])
+            all_events.append(events)
+        return all_events
+
     def calculate_time_traps(self, stock_code: str, listing_date_str: str, put_date_str: str) -> List[Dict]:
         """
         計算該檔 CB 的所有時間套利陷阱
         """
-        events = []
-        fmt = '%Y-%m-%d'
-        
-        try:
-            l_date = pd.to_datetime(listing_date_str, errors='coerce')
-            p_date = pd.to_datetime(put_date_str, errors='coerce')
-            if pd.isna(l_date) or pd.isna(p_date):
-                return []
-        except:
-            return [] 
-            
-        honeymoon_end = l_date + timedelta(days=Config.LISTING_HONEYMOON_DAYS)
-        events.append({
-            "date": honeymoon_end.strftime(fmt),
-            "event": "🔔 蜜月期滿 (Listing+90)",
-            "desc": "上市滿3個月(敲鑼打鼓期)，留意解禁後的賣壓或主力拉抬方向。",
-            "type": "IPO"
-        })
-        
-        awakening_date = l_date + timedelta(days=Config.LISTING_DORMANT_DAYS)
-        events.append({
-            "date": awakening_date.strftime(fmt),
-            "event": "⏰ 沈睡甦醒 (Listing+365)",
-            "desc": "鄭思翰法則：新債若首季未動，滿一週年常有「甦醒行情」。",
-            "type": "Awakening"
-        })
-        
-        tax_rally_start = p_date - timedelta(days=Config.PUT_AVOID_TAX_DAYS)
-        events.append({
-            "date": tax_rally_start.strftime(fmt),
-            "event": "🚀 避稅行情啟動 (Put-180)",
-            "desc": "進入賣回日前半年。若股價低於轉換價，公司派易拉抬以避免債券持有人執行賣回。",
-            "type": "PutBack"
-        })
-        
-        events.append({
-            "date": p_date.strftime(fmt),
-            "event": "⚠️ 賣回基準日 (Put Date)",
-            "desc": "投資人可選擇以保本價賣回給公司的日子。此日前股價若未拉過轉換價，需提防違約風險。",
-            "type": "Risk"
-        })
-        
-        calendar_evts = self._get_current_year_events()
-        events.extend(calendar_evts)
-        
-        events.sort(key=lambda x: x['date'])
-        
-        return events
\ No newline at end of file
+        traps = self.calculate_time_traps_batch([listing_date_str], [put_date_str])
+        return self.expand_time_traps(traps)[0]
+
+
+class TimeArbitrageIndex:
+    """
+    全市場時間套利事件索引 (事件日 → CB 代號，依事件類型分桶)
+    每種事件類型各自維護一組排序後的 datetime64[D] 陣列，區間查詢以二分搜尋完成；
+    CB 清單更新時只對新增/異動/移除的代號做局部插入與刪除。
+    """
+
+    EVENT_TYPES = [key for key, _, _, _ in CalendarAgent.TRAP_DEFINITIONS]
+
+    def __init__(self, calendar: Optional[CalendarAgent] = None):
+        self.calendar = calendar or CalendarAgent()
+        self._meta = {key: (event, desc, evt_type) for key, event, desc, evt_type in CalendarAgent.TRAP_DEFINITIONS}
+        self._dates = {key: np.array([], dtype='datetime64[D]') for key in self.EVENT_TYPES}
+        self._codes = {key: np.array([], dtype=object) for key in self.EVENT_TYPES}
+        # 每檔 CB 目前登記的事件日 (增量比對用)
+        self._rows = pd.DataFrame(columns=['name'] + self.EVENT_TYPES).rename_axis('code')
+        self._calendar_events: List[Dict] = []
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _compute_rows(self, df: pd.DataFrame) -> pd.DataFrame:
+        """由 CB 清單計算每檔的事件日 (以 code 為索引)"""
+        if df is None or df.empty or 'code' not in df.columns:
+            return pd.DataFrame(columns=['name'] + self.EVENT_TYPES).rename_axis('code')
+        n = len(df)
+        traps = self.calendar.calculate_time_traps_batch(
+            df['list_date'] if 'list_date' in df.columns else [None] * n,
+            df['put_date'] if 'put_date' in df.columns else [None] * n
+        )
+        self._calendar_events = traps['calendar_events']
+        rows = pd.DataFrame({key: traps[key] for key in self.EVENT_TYPES})
+        rows.insert(0, 'name', df['name'].astype(str).to_numpy() if 'name' in df.columns else '')
+        rows.index = pd.Index(df['code'].astype(str).str.strip().to_numpy(), name='code')
+        return rows[~rows.index.duplicated(keep='last')]
+
+    def _remove(self, codes: np.ndarray):
+        for key in self.EVENT_TYPES:
+            keep = ~np.isin(self._codes[key], codes)
+            self._dates[key] = self._dates[key][keep]
+            self._codes[key] = self._codes[key][keep]
+
+    def _slice(self, key: str, lo: np.datetime64, hi: np.datetime64) -> slice:
+        dates = self._dates[key]
+        return slice(np.searchsorted(dates, lo, side='left'), np.searchsorted(dates, hi, side='right'))
+
+    def _insert(self, rows: pd.DataFrame):
+        codes = rows.index.to_numpy(dtype=object)
+        for key in self.EVENT_TYPES:
+            new_dates = rows[key].to_numpy(dtype='datetime64[D]')
+            valid = ~np.isnat(new_dates)
+            if not valid.any():
+                continue
+            order = np.argsort(new_dates[valid], kind='stable')
+            new_dates, new_codes = new_dates[valid][order], codes[valid][order]
+            pos = np.searchsorted(self._dates[key], new_dates, side='right')
+            self._dates[key] = np.insert(self._dates[key], pos, new_dates)
+            self._codes[key] = np.insert(self._codes[key], pos, new_codes)
+
+    def build(self, df: pd.DataFrame) -> 'TimeArbitrageIndex':
+        """以整份 CB 清單重建索引"""
+        rows = self._compute_rows(df)
+        for key in self.EVENT_TYPES:
+            self._dates[key] = np.array([], dtype='datetime64[D]')
+            self._codes[key] = np.array([], dtype=object)
+        self._insert(rows)
+        self._rows = rows
+        return self
+
+    def update(self, df: pd.DataFrame) -> Dict[str, int]:
+        """
+        以最新 CB 清單增量更新索引：只有新增、移除或事件日異動的代號會被重新插入。
+        回傳 {'added', 'removed', 'changed'} 筆數。
+        """
+        new_rows = self._compute_rows(df)
+        old_rows = self._rows
+
+        removed = old_rows.index.difference(new_rows.index)
+        added = new_rows.index.difference(old_rows.index)
+        common = new_rows.index.intersection(old_rows.index)
+
+        old_dates = old_rows.loc[common, self.EVENT_TYPES].to_numpy(dtype='datetime64[D]')
+        new_dates = new_rows.loc[common, self.EVENT_TYPES].to_numpy(dtype='datetime64[D]')
+        same = (old_dates == new_dates) | (np.isnat(old_dates) & np.isnat(new_dates))
+        changed = common[~same.all(axis=1)] if len(common) else common
+
+        stale = removed.append(changed)
+        if len(stale):
+            self._remove(stale.to_numpy(dtype=object))
+        fresh = added.append(changed)
+        if len(fresh):
+            self._insert(new_rows.loc[fresh])
+
+        self._rows = new_rows
+        return {"added": len(added), "removed": len(removed), "changed": len(changed)}
+
+    def query(self, start, end, event_types: Optional[Iterable[str]] = None, include_calendar: bool = False) -> pd.DataFrame:
+        """
+        查詢 [start, end] 區間內的事件 (含頭尾)，依日期排序。
+        event_types 為 TRAP_DEFINITIONS 的鍵 (例: 'tax_rally_start', 'honeymoon_end')；None 表示全部。
+        include_calendar=True 時併入當年度行事曆事件 (全市場共用，code 為空)。
+        """
+        lo = np.datetime64(pd.Timestamp(start).date(), 'D')
+        hi = np.datetime64(pd.Timestamp(end).date(), 'D')
+        frames = []
+        for key in (event_types or self.EVENT_TYPES):
+            window = self._slice(key, lo, hi)
+            codes = self._codes[key][window]
+            if not len(codes):
+                continue
+            event, desc, evt_type = self._meta[key]
+            frames.append(pd.DataFrame({
+                "date": self._dates[key][window], "code": codes, "name": self._rows['name'].reindex(codes).to_numpy(),
+                "event_type": key, "event": event, "desc": desc, "type": evt_type
+            }))
+
+        if include_calendar:
+            cal = [e for e in self._calendar_events if lo <= np.datetime64(e['date'], 'D') <= hi]
+            if cal:
+                frames.append(pd.DataFrame({
+                    "date": np.array([e['date'] for e in cal], dtype='datetime64[D]'), "code": "", "name": "全市場",
+                    "event_type": "calendar", "event": [e['event'] for e in cal],
+                    "desc": [e['desc'] for e in cal], "type": [e['type'] for e in cal]
+                }))
+
+        if not frames:
+            return pd.DataFrame(columns=["date", "code", "name", "event_type", "event", "desc", "type"])
+        return pd.concat(frames, ignore_index=True).sort_values('date', kind='stable').reset_index(drop=True)
+
+    def upcoming(self, days: int = 14, event_types: Optional[Iterable[str]] = None,
+                 include_calendar: bool = False, today=None) -> pd.DataFrame:
+        """未來 N 天內 (含今日) 即將觸發的事件"""
+        start = pd.Timestamp(today or datetime.now().date())
+        return self.query(start, start + pd.Timedelta(days=days), event_types, include_calendar)
+
+    def codes_in_window(self, start, end, event_types: Optional[Iterable[str]] = None) -> set:
+        """區間內觸發事件的 CB 代號集合 (供事件驅動警示使用)"""
+        result = set()
+        lo = np.datetime64(pd.Timestamp(start).date(), 'D')
+        hi = np.datetime64(pd.Timestamp(end).date(), 'D')
+        for key in (event_types or self.EVENT_TYPES):
+            result.update(self._codes[key][self._slice(key, lo, hi)])
+        return result
@@ -0,0 +1,57 @@
+# fingerprint.py
+# Titan SOP V82.1 - Data Fingerprint Utilities
+# 狀態: 資料指紋 (增量掃描與快取鍵共用)
+# 修正重點:
+# 1. [逐列指紋] row_fingerprints 以 pandas 內建雜湊一次算出每列 uint64 指紋，判斷哪些 CB 列異動。
+# 2. [K 棒指紋] bar_fingerprint 以最後一根 K 棒 (日期/收/高/量) 判斷標的是否有新行情。
+# 3. [快取鍵] frame_fingerprint / config_fingerprint 提供內容雜湊，讓 st.cache_data 依資料與設定命中。
+
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from config import Config
+from typing import List, Optional
+
+
+def row_fingerprints(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.Series:
+    """
+    逐列內容指紋 (uint64)，與索引無關；欄位順序固定為排序後的欄名。
+    任何一個欄位值改變，該列指紋即改變。
+    """
+    if df.empty:
+        return pd.Series(dtype='uint64', index=df.index)
+    cols = sorted(columns or df.columns, key=str)
+    # object 欄位可能混雜數字與字串，統一轉字串以確保同值同指紋
+    frame = df[cols].apply(lambda s: s.astype(str) if s.dtype == object else s)
+    return pd.Series(pd.util.hash_pandas_object(frame, index=False).to_numpy(), index=df.index)
+
+
+def bar_fingerprint(bars: pd.DataFrame) -> str:
+    """最後一根 K 棒的指紋；無資料時回傳空字串"""
+    if bars is None or bars.empty or 'Close' not in bars.columns:
+        return ""
+    last = bars.dropna(subset=['Close'])
+    if last.empty:
+        return ""
+    last = last.iloc[-1]
+    high = last.get('High', np.nan)
+    volume = last.get('Volume', np.nan)
+    return f"{pd.Timestamp(last.name).date()}|{float(last['Close']):.4f}|{float(high):.4f}|{float(volume):.0f}"
+
+
+def frame_fingerprint(df: Optional[pd.DataFrame]) -> str:
+    """整份 DataFrame 的內容指紋 (欄名 + dtype + 逐列雜湊)；同一份檔案重新上傳得到相同結果"""
+    if df is None:
+        return "none"
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([[str(c), str(t)] for c, t in df.dtypes.items()], ensure_ascii=False).encode())
+    h.update(row_fingerprints(df).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def config_fingerprint(*extra) -> str:
+    """策略設定指紋: Config 全部公開常數 + 呼叫端額外傳入的設定 (例: 評分設定檔)"""
+    settings = {k: v for k, v in vars(Config).items() if k.isupper()}
+    payload = json.dumps([settings, extra], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
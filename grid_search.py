@@ -0,0 +1,287 @@
+# grid_search.py
+# Titan SOP V82.1 - Parameter Grid Search
+# 狀態: 均線週期 / SOP 門檻敏感度掃描 (多核心 + 共享記憶體)
+# 修正重點:
+# 1. [一次累加] 每檔標的只做一次 cumsum，任意週期均線皆為 O(1) 差分 (數千組參數不再重算 rolling)。
+# 2. [共享記憶體] 收盤價面板與累加陣列放入 multiprocessing.shared_memory，各工作行程直接映射，不複製資料。
+# 3. [SOP 門檻] 提供 CB 價格面板時，甜蜜點 / 價格濾網 / 152 出場門檻一併掃描；否則只掃均線週期。
+
+import itertools
+import numpy as np
+import pandas as pd
+import metrics
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from config import Config
+from backtest import hysteresis_position, extract_trades
+from price_panel import TitanPricePanel
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+PARAM_COLUMNS = ['life', 'long', 'sweet_low', 'sweet_high', 'max_price', 'exit_target']
+METRIC_COLUMNS = ['cagr', 'mdd', 'win_rate', 'trades', 'exposure']
+
+
+# ==========================================
+# 累加均線 (Cumulative-sum Rolling Means)
+# ==========================================
+def cumulative_sums(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """面板 (日期 × 標的) → (數值累加, 有效筆數累加)，首列補 0 以便差分"""
+    valid = np.isfinite(values)
+    zeros = np.zeros((1, values.shape[1]))
+    cs = np.vstack([zeros, np.cumsum(np.where(valid, values, 0.0), axis=0)])
+    cnt = np.vstack([zeros, np.cumsum(valid, axis=0)])
+    return cs, cnt
+
+
+def rolling_mean_from_cumsum(cs: np.ndarray, cnt: np.ndarray, window: int) -> np.ndarray:
+    """由累加陣列取任意週期均線；窗口內有缺值或資料不足者為 NaN (等同 rolling(window).mean())"""
+    T = cs.shape[0] - 1
+    out = np.full((T, cs.shape[1]), np.nan)
+    if window <= T:
+        total = cs[window:] - cs[:-window]
+        count = cnt[window:] - cnt[:-window]
+        out[window - 1:] = np.where(count == window, total / window, np.nan)
+    return out
+
+
+class MovingAverageCache(OrderedDict):
+    """
+    週期 → 均線陣列 (日期 × 標的) 的 LRU 快取。
+    總量超過 max_mb 時淘汰最久未用的週期 (至少保留生命線 + 長期線兩條)，寬標的池 × 多週期網格不會無限累積。
+    """
+
+    def __init__(self, max_mb: float = Config.MA_CACHE_MB):
+        super().__init__()
+        self.max_bytes = max_mb * 1024 ** 2
+
+    def __getitem__(self, window: int) -> np.ndarray:
+        value = super().__getitem__(window)
+        self.move_to_end(window)
+        return value
+
+    def __setitem__(self, window: int, value: np.ndarray):
+        super().__setitem__(window, value)
+        self.move_to_end(window)
+        while len(self) > 2 and sum(v.nbytes for v in self.values()) > self.max_bytes:
+            self.popitem(last=False)
+
+
+# ==========================================
+# 參數網格
+# ==========================================
+def build_grid(life: Sequence[int] = (Config.MA_LIFE_LINE,), long: Sequence[int] = (Config.MA_LONG_TERM,),
+               sweet_low: Sequence[float] = (Config.SWEET_SPOT_LOW,), sweet_high: Sequence[float] = (Config.SWEET_SPOT_HIGH,),
+               max_price: Sequence[float] = (Config.FILTER_MAX_PRICE,),
+               exit_target: Sequence[float] = (Config.EXIT_TARGET_MEDIAN,)) -> List[Dict]:
+    """笛卡兒積參數組合 (排除 生命線 >= 長期線、甜蜜點下緣 >= 上緣)"""
+    grid = []
+    for combo in itertools.product(life, long, sweet_low, sweet_high, max_price, exit_target):
+        params = dict(zip(PARAM_COLUMNS, combo))
+        if params['life'] < params['long'] and params['sweet_low'] < params['sweet_high']:
+            grid.append(params)
+    return grid
+
+
+def param_label(params: Dict) -> str:
+    """參數組的可讀標籤 (例: MA87/284 或 MA87/284 | 106-110 ≤115 →152)"""
+    label = f"MA{int(params['life'])}/{int(params['long'])}"
+    if pd.notna(params.get('sweet_low')):
+        label += (f" | {params['sweet_low']:g}-{params['sweet_high']:g} ≤{params['max_price']:g}"
+                  f" →{params['exit_target']:g}")
+    return label
+
+
+def _signal_frame(closes: np.ndarray, cs: np.ndarray, cnt: np.ndarray, params: Dict,
+                  cb: Optional[np.ndarray] = None,
+                  ma_cache: Optional[Dict[int, np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """單組參數 → (持倉矩陣, 計價價格)；均線經 ma_cache 於各組參數間共用"""
+    def ma(w):
+        if ma_cache is not None:
+            if w not in ma_cache:
+                ma_cache[w] = rolling_mean_from_cumsum(cs, cnt, w)
+            return ma_cache[w]
+        return rolling_mean_from_cumsum(cs, cnt, w)
+
+    life, long = ma(int(params['life'])), ma(int(params['long']))
+    entry = (closes > life) & (life > long)
+    exit = closes < life
+    prices = closes
+    if cb is not None:
+        zone_high = min(params['sweet_high'], params['max_price'])
+        entry &= (cb >= params['sweet_low']) & (cb <= zone_high)
+        exit |= cb >= params['exit_target']
+        prices = cb
+    return hysteresis_position(entry, exit), prices
+
+
+def equal_weight_returns(position: np.ndarray, prices: np.ndarray) -> np.ndarray:
+    """持倉 × 價格 (日期 × 標的) → 每日等權重組合報酬 (每檔分配等額資金，未持有部位為現金)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.vstack([np.full((1, prices.shape[1]), np.nan), prices[1:] / prices[:-1] - 1])
+    lagged = np.vstack([np.zeros((1, position.shape[1])), position[:-1]])
+    live = np.isfinite(ret)
+    n_live = live.sum(axis=1)
+    total = np.where(live, lagged * np.nan_to_num(ret), 0.0).sum(axis=1)
+    return np.where(n_live > 0, total / np.maximum(n_live, 1), 0.0)
+
+
+def evaluate_params(closes: np.ndarray, cs: np.ndarray, cnt: np.ndarray, params: Dict,
+                    cb: Optional[np.ndarray] = None, window: Optional[Tuple[int, int]] = None,
+                    ma_cache: Optional[Dict[int, np.ndarray]] = None) -> Dict:
+    """
+    單組參數的全標的績效 (向量化於 日期 × 標的)。
+    - 標的訊號: 收盤 > 生命線 且 生命線 > 長期線 進場；跌破生命線出場。
+    - 提供 cb (同形狀 CB 價格) 時: 另須 CB 價位於 [甜蜜點下緣, min(上緣, 價格濾網)] 才進場，
+      CB 價 >= 出場目標亦出場，損益以 CB 價格計算。
+    - window=(起, 迄) 只統計該區間的績效 (均線與持倉仍以完整歷史計算，無前視)。
+    回傳 cagr / mdd (各標的平均)、win_rate (全部已平倉交易)、trades、exposure。
+    """
+    position, prices = _signal_frame(closes, cs, cnt, params, cb, ma_cache)
+
+    a, b = window or (0, closes.shape[0])
+    pos, px = position[a:b], prices[a:b]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.vstack([np.zeros((1, px.shape[1])), px[1:] / px[:-1] - 1])
+    lagged = np.vstack([np.zeros((1, pos.shape[1])), pos[:-1]])
+    strat_ret = np.nan_to_num(lagged * ret)
+    has_data = np.isfinite(px).sum(axis=0) > 1
+
+    cagr = metrics.cagr(strat_ret)
+    mdd = metrics.max_drawdown(strat_ret)
+    trades = extract_trades(pos, np.where(np.isfinite(px), px, np.nan))
+    trades = trades[np.isfinite(trades['roi'].to_numpy())]
+
+    return {
+        **params,
+        "cagr": float(np.mean(cagr[has_data])) if has_data.any() else np.nan,
+        "mdd": float(np.mean(mdd[has_data])) if has_data.any() else np.nan,
+        "win_rate": float((trades['roi'] > 0).mean()) if len(trades) else np.nan,
+        "trades": int(len(trades)),
+        "exposure": float(pos[:, has_data].mean()) if has_data.any() else np.nan,
+    }
+
+
+# ==========================================
+# 共享記憶體工作行程
+# ==========================================
+_SHARED: Dict[str, object] = {}
+
+
+def _share(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, Dict]:
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm, {"name": shm.name, "shape": array.shape, "dtype": str(array.dtype)}
+
+
+def _init_worker(specs: Dict[str, Optional[Dict]]):
+    """工作行程啟動時映射共享陣列 (唯讀使用)"""
+    _SHARED.clear()
+    for key, spec in specs.items():
+        if spec is None:
+            _SHARED[key] = None
+            continue
+        shm = shared_memory.SharedMemory(name=spec["name"])
+        _SHARED[f"_shm_{key}"] = shm
+        _SHARED[key] = np.ndarray(spec["shape"], dtype=spec["dtype"], buffer=shm.buf)
+    _SHARED["ma_cache"] = MovingAverageCache()
+
+
+def _evaluate_chunk(args: Tuple[List[Dict], Optional[Tuple[int, int]]]) -> List[Dict]:
+    chunk, window = args
+    return [evaluate_params(_SHARED["closes"], _SHARED["cs"], _SHARED["cnt"], params,
+                            cb=_SHARED["cb"], window=window, ma_cache=_SHARED["ma_cache"]) for params in chunk]
+
+
+def _returns_chunk(args: Tuple[List[Dict], None]) -> List[np.ndarray]:
+    chunk, _ = args
+    return [equal_weight_returns(*_signal_frame(_SHARED["closes"], _SHARED["cs"], _SHARED["cnt"], params,
+                                                cb=_SHARED["cb"], ma_cache=_SHARED["ma_cache"])) for params in chunk]
+
+
+class TitanGridSearch:
+    """
+    參數網格搜尋
+    收盤價面板與累加陣列只建立一次，之後任意網格 / 區間評估皆共用 (run 可重複呼叫)。
+    """
+
+    def __init__(self, closes: pd.DataFrame, cb_closes: Optional[pd.DataFrame] = None,
+                 workers: int = Config.BACKTEST_WORKERS):
+        self.closes = closes.sort_index()
+        self.codes = list(self.closes.columns)
+        self.values = self.closes.to_numpy(dtype=float)
+        self.cb = None
+        if cb_closes is not None and not cb_closes.empty:
+            self.cb = cb_closes.reindex(index=self.closes.index, columns=self.codes).to_numpy(dtype=float)
+        self.cs, self.cnt = cumulative_sums(self.values)
+        self.workers = workers
+        self._ma_cache = MovingAverageCache()
+
+    @classmethod
+    def from_codes(cls, codes: Iterable[str], start_date: str = "2015-01-01", panel: Optional[TitanPricePanel] = None,
+                   cb_closes: Optional[pd.DataFrame] = None, workers: int = Config.BACKTEST_WORKERS) -> 'TitanGridSearch':
+        """以共用行情面板一次批次下載整個標的池"""
+        closes = (panel or TitanPricePanel()).close_panel(codes, start=start_date)
+        return cls(closes, cb_closes=cb_closes, workers=workers)
+
+    def run(self, grid: List[Dict], window: Optional[Tuple[int, int]] = None, chunk_size: int = 16) -> pd.DataFrame:
+        """
+        評估整個網格；workers > 1 時以行程池平行計算 (資料經共享記憶體傳遞，只傳參數)。
+        若未提供 CB 面板，甜蜜點 / 價格濾網 / 出場目標不影響結果，網格自動收斂為均線週期組合。
+        """
+        if self.values.size == 0 or not grid:
+            return pd.DataFrame(columns=PARAM_COLUMNS + METRIC_COLUMNS)
+        grid = self._collapse(grid)
+        chunks = [(grid[i:i + chunk_size], window) for i in range(0, len(grid), chunk_size)]
+        rows = self._map(_evaluate_chunk, chunks)
+        return pd.DataFrame(rows, columns=PARAM_COLUMNS + METRIC_COLUMNS)
+
+    def return_streams(self, grid: List[Dict], chunk_size: int = 16) -> pd.DataFrame:
+        """各組參數的每日等權重組合報酬 (日期 × 參數組)，供 walk-forward 等以區間切片重複使用"""
+        grid = self._collapse(grid)
+        chunks = [(grid[i:i + chunk_size], None) for i in range(0, len(grid), chunk_size)]
+        streams = self._map(_returns_chunk, chunks)
+        return pd.DataFrame(np.column_stack(streams) if streams else np.empty((len(self.closes), 0)),
+                            index=self.closes.index, columns=[param_label(p) for p in grid])
+
+    def _collapse(self, grid: List[Dict]) -> List[Dict]:
+        """未提供 CB 面板時 SOP 門檻不影響結果，只保留不重複的均線週期組合"""
+        if self.cb is not None:
+            return grid
+        return list({(p['life'], p['long']): {**p, 'sweet_low': np.nan, 'sweet_high': np.nan,
+                                              'max_price': np.nan, 'exit_target': np.nan}
+                     for p in grid}.values())
+
+    def _map(self, func, chunks: List[Tuple]) -> List:
+        """workers <= 1 於本行程循序執行；否則以共享記憶體啟動行程池"""
+        arrays = {"closes": self.values, "cs": self.cs, "cnt": self.cnt, "cb": self.cb}
+        if self.workers <= 1:
+            _SHARED.update(arrays, ma_cache=self._ma_cache)
+            try:
+                return [item for chunk in chunks for item in func(chunk)]
+            finally:
+                _SHARED.clear()
+
+        blocks, specs = [], {}
+        try:
+            for key, arr in arrays.items():
+                if arr is None:
+                    specs[key] = None
+                    continue
+                shm, specs[key] = _share(arr)
+                blocks.append(shm)
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(specs,)) as pool:
+                return [item for part in pool.map(func, chunks) for item in part]
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    @staticmethod
+    def heatmap(results: pd.DataFrame, value: str = 'cagr', x: str = 'long', y: str = 'life',
+                **fixed) -> pd.DataFrame:
+        """兩個參數為軸的績效熱圖表 (其餘參數以 fixed 指定，未指定者取平均)"""
+        frame = results
+        for key, val in fixed.items():
+            frame = frame[frame[key] == val]
+        return frame.pivot_table(index=y, columns=x, values=value, aggfunc='mean')
@@ -2,11 +2,14 @@
 # Titan SOP V71.0 - Knowledge Base (Audited)
 # 狀態: 核心大腦 (存放所有策略定義與邏輯)
 # [V71.0 Audit]: Added get_advanced_theory_text() to extract specific theoretical texts for the new Window 14. No other changes needed.
+# [V82.1]: 新增 assign_sector_roles()，以族群分組向量化判定全市場領頭羊 / 風口豬 / 跟隨者。
 
 import json
 import os
 import re
-from typing import Dict, List, Set, Tuple
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Set, Tuple
 
 class TitanKnowledgeBase:
     def __init__(self, db_path='full_sop_database.json'):
@@ -178,6 +181,82 @@ class TitanKnowledgeBase:
             "msg": "非領頭羊且價格優勢不明顯。"
         }
 
+    ROLE_TEMPLATES = {
+        "leader": {"role": "👑 領頭羊 (Leader)", "strategy": "強勢主攻 (Momentum)",
+                   "msg": "族群指標股。動力最強，若回測 87MA 或位於甜蜜點，為首選標的。"},
+        "laggard": {"role": "🔥 風口豬 (Laggard)", "strategy": "落後補漲 (Value)"},
+        "follower": {"role": "😐 跟隨者", "strategy": "中性", "msg": "非領頭羊且價格優勢不明顯。"},
+        "unknown": {"role": "❓ 未知", "strategy": "觀察", "msg": "無同族群參考數據"},
+    }
+
+    def _bellwether_pattern(self) -> Optional[re.Pattern]:
+        """所有領頭羊關鍵字合併為單一正規式 (與 is_bellwether 的子字串比對等價)"""
+        if not self.bellwethers:
+            return None
+        return re.compile('|'.join(re.escape(b) for b in sorted(self.bellwethers, key=len, reverse=True)))
+
+    def sector_of(self, stock_code: str, name: str = "", industry: str = "") -> Optional[str]:
+        """
+        CB 所屬族群: 1) 產業別含有知識庫族群名稱者 (取最長)；2) 產業別本身；
+        3) 無產業資料時，名稱/代號含知識庫領頭羊者 (取成員最少、最具體的族群)；皆無則為 None。
+        """
+        if industry:
+            hits = [s for s in self.sector_bellwether_map if s and s in industry]
+            return max(hits, key=len) if hits else industry
+        target = f"{name}{stock_code}"
+        hits = [s for s, keys in self.sector_bellwether_map.items() if any(k and k in target for k in keys)]
+        if hits:
+            return min(hits, key=lambda s: (len(self.sector_bellwether_map[s]), s))
+        return None
+
+    def assign_sector_roles(self, df: pd.DataFrame, industry_map: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """
+        [V82.1] 全市場族群身份判定 (取代逐列 analyze_sector_role(..., []))
+        需要欄位 name / code / stock_code / price；industry_map 為 標的代號 → 產業別。
+        族群領頭羊價格 = 族群內領頭羊 CB 的最高價 (族群內無領頭羊則取族群最高價)；
+        非領頭羊且價格 < 領頭羊價格 × 0.8 為風口豬，其餘為跟隨者；無同族群對照者為未知。
+        回傳欄位 sector / sector_leader_price / role (與 analyze_sector_role 相同格式的 dict)。
+        """
+        industry_map = industry_map or {}
+        names = df['name'].astype(str)
+        stock_codes = df['stock_code'].astype(str).str.strip()
+        price = pd.to_numeric(df['price'], errors='coerce').fillna(0)
+
+        pattern = self._bellwether_pattern()
+        if pattern is None:
+            is_leader = pd.Series(False, index=df.index)
+        else:
+            is_leader = names.str.contains(pattern, na=False) | df['code'].astype(str).str.contains(pattern, na=False)
+
+        # 族群對照以「標的 + 名稱」的唯一組合查表，再映射回每一列
+        keys = pd.MultiIndex.from_arrays([stock_codes, names])
+        lookup = {k: self.sector_of(k[0], k[1], industry_map.get(k[0], "")) for k in keys.unique()}
+        sector = pd.Series([lookup[k] for k in keys], index=df.index, dtype=object)
+
+        grouped = sector.fillna("__none__")
+        leader_max = price.where(is_leader).groupby(grouped).transform('max')
+        sector_max = price.groupby(grouped).transform('max')
+        peer_count = price.groupby(grouped).transform('size')
+        leader_price = leader_max.fillna(sector_max)
+        has_peers = sector.notna() & (peer_count > 1)
+
+        labels = np.select(
+            [is_leader.to_numpy(), ~has_peers.to_numpy(), (price < leader_price * 0.8).to_numpy()],
+            ["leader", "unknown", "laggard"], default="follower"
+        )
+        roles = []
+        for label, my_price, top in zip(labels, price.to_numpy(), leader_price.to_numpy()):
+            role = dict(self.ROLE_TEMPLATES[label])
+            if label == "laggard":
+                role["msg"] = f"具比價效應 (現價 {my_price} < 領頭羊 {top})，適合低接。"
+            roles.append(role)
+
+        return pd.DataFrame({
+            "sector": sector,
+            "sector_leader_price": leader_price.where(has_peers | is_leader),
+            "role": roles,
+        }, index=df.index)
+
     def get_otc_magic_rules(self) -> Dict[str, str]:
         return {
             "bull_cycle": "🔥 中期多頭：OTC指數站上 87MA 生命線，且 87MA 黃金交叉 284MA (平均漲2年)。",
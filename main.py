@@ -2,12 +2,28 @@
 # Titan SOP V40.5 - Commander Interface
 # 狀態: 系統入口 (Entry Point)
 # 功能: 提供 CLI 選單，一鍵啟動戰情室或執行回測
+# [V82.1]: 新增無互動批次回測指令 `python main.py backtest`:
+#          標的池可來自 CB 清單檔 / 戰區名稱 / 代號清單檔，行程池分批下載與回測，
+#          逐批寫出 Parquet (無 pyarrow 時改 CSV) 並可斷點續跑，供夜間研究排程使用。
 
 import os
 import sys
 import time
-from backtest import TitanBacktestEngine
-from config import Config
+import json
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from backtest import TitanBacktestEngine, ma_strategy_matrix, backtest_positions
+from batch_backtest import trend_backtest
+from config import Config, WAR_THEATERS, DATA_DIR
+from price_panel import TitanPricePanel
+
+try:
+    from tqdm import tqdm
+except ImportError:  # 無 tqdm 時改以文字進度列
+    tqdm = None
 
 def print_banner():
     print(r"""
@@ -82,5 +98,195 @@ def main():
             print("無效指令")
             time.sleep(0.5)
 
+# ==========================================
+# 無互動批次回測 (Headless Batch Backtest)
+# ==========================================
+BATCH_STRATEGIES = ("trend", "ma_lab")
+
+
+def load_universe(cb_file=None, theaters=None, ticker_file=None):
+    """標的池: CB 清單檔的標的代號 + 戰區成分股 + 代號清單檔 (每行或以逗號/空白分隔，# 為註解)，去重保序"""
+    codes = []
+    if cb_file:
+        df = pd.read_excel(cb_file) if str(cb_file).endswith(('.xlsx', '.xls')) else pd.read_csv(cb_file)
+        col = next((c for c in df.columns if str(c).strip().lower() == 'stock_code'), None)
+        if col is None:
+            col = next((c for c in df.columns if "標的" in str(c) and "價" not in str(c)), None)
+        if col is None:
+            raise ValueError(f"CB 清單缺少標的代號欄位 (stock_code / 標的代號): {cb_file}")
+        codes += df[col].astype(str).str.extract(r'(\d+)', expand=False).dropna().tolist()
+    for name in theaters or []:
+        if name not in WAR_THEATERS:
+            raise ValueError(f"未知戰區: {name} (可用: {', '.join(WAR_THEATERS)})")
+        codes += list(WAR_THEATERS[name])
+    if ticker_file:
+        for line in Path(ticker_file).read_text(encoding='utf-8').splitlines():
+            codes += line.split('#')[0].replace(',', ' ').split()
+    return [c.strip().upper() for c in dict.fromkeys(codes) if c.strip()]
+
+
+def _backtest_chunk(codes, strategy, start_date, initial_capital):
+    """工作行程: 整批下載一組代號後逐檔回測，回傳結果列 (查無資料 / 失敗者亦留紀錄供續跑判斷)"""
+    frames = TitanPricePanel().fetch(codes, start=start_date)
+    rows = []
+    for code in codes:
+        bars = frames.get(code)
+        if bars is None or bars.empty:
+            rows.append({"ticker": code, "strategy": strategy, "status": "no_data"})
+            continue
+        bars = bars.dropna(subset=['Close'])
+        base = {"ticker": code, "status": "ok", "bars": len(bars),
+                "start": bars.index[0].strftime('%Y-%m-%d'), "end": bars.index[-1].strftime('%Y-%m-%d')}
+        try:
+            if strategy == "trend":
+                res = trend_backtest(bars, initial_capital)
+                if res is None:
+                    rows.append({"ticker": code, "strategy": strategy, "status": "no_data"})
+                    continue
+                metrics_row = {k: v for k, v in res.items() if k not in ('equity_curve', 'drawdown_series')}
+                metrics_row["sharpe"] = metrics_row.pop("sharpe_ratio")
+                metrics_row["sortino"] = metrics_row.pop("sortino_ratio")
+                rows.append({**base, "strategy": strategy, **metrics_row})
+            else:
+                close = bars['Close'].to_numpy(dtype=float)
+                names, positions = ma_strategy_matrix(close)
+                perf = backtest_positions(close, positions, initial_capital)
+                for j, name in enumerate(names):
+                    rows.append({**base, "strategy": name, **{
+                        k: float(perf[k][j]) for k in ('cagr', 'final_equity', 'max_drawdown', 'sharpe',
+                                                       'sortino', 'calmar', 'win_rate', 'exposure')}})
+        except Exception as e:
+            rows.append({"ticker": code, "strategy": strategy, "status": f"error: {e}"})
+    return rows
+
+
+def _write_frame(df, stem, fmt):
+    """寫出 Parquet (無 pyarrow / fastparquet 時自動改 CSV)，回傳實際路徑"""
+    if fmt == "parquet":
+        try:
+            df.to_parquet(stem.with_suffix('.parquet'), index=False)
+            return stem.with_suffix('.parquet')
+        except (ImportError, ValueError):
+            pass
+    df.to_csv(stem.with_suffix('.csv'), index=False, encoding='utf-8-sig')
+    return stem.with_suffix('.csv')
+
+
+def _read_parts(part_dir):
+    frames = [pd.read_parquet(p) for p in sorted(part_dir.glob('part-*.parquet'))]
+    frames += [pd.read_csv(p, dtype={'ticker': str}) for p in sorted(part_dir.glob('part-*.csv'))]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['ticker', 'strategy', 'status'])
+
+
+def summarize_results(results):
+    """各策略彙總: 成功檔數、CAGR 平均 / 中位數、Sharpe 與 MDD 中位數、CAGR > 0 比例"""
+    ok = results[results['status'] == 'ok']
+    if ok.empty:
+        return pd.DataFrame()
+    grouped = ok.groupby('strategy')
+    return pd.DataFrame({
+        "tickers": grouped['ticker'].nunique(),
+        "cagr_mean": grouped['cagr'].mean(),
+        "cagr_median": grouped['cagr'].median(),
+        "sharpe_median": grouped['sharpe'].median(),
+        "mdd_median": grouped['max_drawdown'].median(),
+        "positive_share": grouped['cagr'].apply(lambda s: (s > 0).mean()),
+    }).reset_index()
+
+
+def run_batch_backtest(args):
+    universe = load_universe(args.cb_file, args.theater, args.tickers)
+    if not universe:
+        print("❌ 標的池為空，請指定 --cb-file / --theater / --tickers")
+        return 2
+
+    out = Path(args.out)
+    part_dir = out / "parts"
+    part_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {"strategy": args.strategy, "start": args.start, "capital": args.capital}
+    manifest_path = out / "run.json"
+    done = set()
+    if manifest_path.exists() and not args.fresh:
+        previous = json.loads(manifest_path.read_text(encoding='utf-8'))
+        if {k: previous.get(k) for k in manifest} != manifest:
+            print(f"❌ {out} 已有不同參數的結果 {previous}，請改用其他 --out 或加上 --fresh")
+            return 2
+        existing = _read_parts(part_dir)
+        # 只有成功的標的視為完成；查無資料 (可能是暫時性下載失敗) 與錯誤一律重跑
+        done = set(existing.loc[existing['status'] == 'ok', 'ticker'].astype(str))
+    elif args.fresh:
+        for p in part_dir.glob('part-*'):
+            p.unlink()
+    manifest_path.write_text(json.dumps({**manifest, "updated": datetime.now().isoformat(timespec='seconds')},
+                                        ensure_ascii=False), encoding='utf-8')
+
+    todo = [c for c in universe if c not in done]
+    print(f"[批次回測] 策略: {args.strategy} | 標的: {len(universe)} 檔 (已完成 {len(universe) - len(todo)}，待跑 {len(todo)}) | "
+          f"行程: {args.workers} | 輸出: {out}")
+    chunks = [todo[i:i + args.chunk] for i in range(0, len(todo), args.chunk)]
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    bar = tqdm(total=len(todo), unit="檔", desc="回測") if tqdm else None
+    finished = 0
+
+    def _collect(i, rows):
+        nonlocal finished
+        _write_frame(pd.DataFrame(rows), part_dir / f"part-{run_id}-{i:05d}", args.format)
+        finished += len(chunks[i])
+        if bar:
+            bar.update(len(chunks[i]))
+        else:
+            print(f"  進度 {finished}/{len(todo)}")
+
+    if args.workers <= 1 or len(chunks) <= 1:
+        for i, chunk in enumerate(chunks):
+            _collect(i, _backtest_chunk(chunk, args.strategy, args.start, args.capital))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = {pool.submit(_backtest_chunk, chunk, args.strategy, args.start, args.capital): i
+                       for i, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                _collect(futures[future], future.result())
+    if bar:
+        bar.close()
+
+    # 重跑成功的標的捨棄先前的 無資料 / 錯誤 列 (ma_lab 的失敗列策略名為 ma_lab，與成功列的戰法名不同)
+    results = _read_parts(part_dir)
+    ok_tickers = set(results.loc[results['status'] == 'ok', 'ticker'].astype(str))
+    results = results[(results['status'] == 'ok') | ~results['ticker'].astype(str).isin(ok_tickers)]
+    results = results.drop_duplicates(subset=['ticker', 'strategy'], keep='last')
+    results = results[results['ticker'].astype(str).isin(universe)]
+    results_path = _write_frame(results, out / "results", args.format)
+    summary = summarize_results(results)
+    summary_path = _write_frame(summary, out / "summary", args.format)
+    failed = results.loc[results['status'] != 'ok', 'ticker'].nunique()
+    print(f"\n[完成] 逐檔結果: {results_path} | 彙總: {summary_path} | 無資料/失敗: {failed} 檔")
+    if not summary.empty:
+        print(summary.to_string(index=False))
+    return 0
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py", description="Titan SOP 指揮介面 (無參數時進入互動選單)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bt = sub.add_parser("backtest", help="無互動批次回測 (行程池、Parquet/CSV 輸出、斷點續跑)")
+    bt.add_argument("--cb-file", help="CB 清單檔 (.xlsx/.csv)，取標的代號欄")
+    bt.add_argument("--theater", nargs="+", help="戰區名稱 (config.WAR_THEATERS)，可多個")
+    bt.add_argument("--tickers", help="代號清單檔 (每行一檔或以逗號分隔)")
+    bt.add_argument("--strategy", choices=BATCH_STRATEGIES, default="trend",
+                    help="trend: 20MA 趨勢追蹤 (同 4.2)；ma_lab: 15 種均線戰法 (同 4.3)")
+    bt.add_argument("--start", default="2015-01-01", help="回測起始日")
+    bt.add_argument("--capital", type=float, default=1000000, help="初始資金")
+    bt.add_argument("--workers", type=int, default=Config.BACKTEST_WORKERS, help="工作行程數")
+    bt.add_argument("--chunk", type=int, default=50, help="每批下載 / 寫出的檔數 (續跑的最小單位)")
+    bt.add_argument("--out", default=str(DATA_DIR / "batch_backtest"), help="輸出資料夾")
+    bt.add_argument("--format", choices=("parquet", "csv"), default="parquet", help="輸出格式 (parquet 不可用時自動改 csv)")
+    bt.add_argument("--fresh", action="store_true", help="清除既有分批結果重新執行")
+    args = parser.parse_args(argv)
+    if args.command == "backtest":
+        return run_batch_backtest(args)
+    return 1
+
 if __name__ == "__main__":
-    main()```
\ No newline at end of file
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
+    main()
\ No newline at end of file
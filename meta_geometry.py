@@ -0,0 +1,278 @@
+# meta_geometry.py
+# Titan SOP V82.1 - Meta-Trend Geometry Engine & Backtest Sandbox
+# 狀態: 元趨勢 7D 幾何 (月K對數回歸角度 / R²) 的全歷史滾動計算、向量化信評與回測沙盒
+# 修正重點:
+# 1. [前綴和回歸] 每檔只做一次 y、y²、x·y 累加，任一月份、任一窗口的斜率與 R² 皆為 O(1) 差分，
+#    不再逐月逐窗口呼叫 linregress；結果與原 get_time_slice + linregress (含歷史不足取全部) 相同。
+# 2. [向量化信評] 22 階信評邏輯樹改寫為依序條件 np.select (先符合者優先，與原 if 鏈同序)，整個戰區全歷史一次評等。
+# 3. [回測沙盒] 月底評等 → 次月持倉 (無前視)，進出場信評集合 + 遲滯狀態機，
+#    等權 / 信評加權 / 波動反比動態倉位，績效 (Sharpe、MDD...) 統一由 metrics.py 計算。
+
+import numpy as np
+import pandas as pd
+import metrics
+from backtest import hysteresis_position
+from price_panel import TitanPricePanel
+from typing import Dict, Iterable, Optional, Sequence
+
+# 7 個時間窗口 (月)
+GEOMETRY_WINDOWS = {'35Y': 420, '10Y': 120, '5Y': 60, '3Y': 36, '1Y': 12, '6M': 6, '3M': 3}
+
+# 月底頻率代號 (新版 pandas 為 'ME'，舊版為 'M')
+try:
+    pd.Series(dtype=float, index=pd.DatetimeIndex([])).resample('ME')
+    MONTH_END = 'ME'
+except ValueError:
+    MONTH_END = 'M'
+
+# 信評代號 → (名稱, 說明, 顏色)
+RATING_TABLE = {
+    "SSS": ("Titan (泰坦)", "全週期超過45度，神級標的", "#FFD700"),
+    "AAA": ("Dominator (統治者)", "短期加速向上，完美趨勢", "#FF4500"),
+    "Phoenix": ("Phoenix (浴火重生)", "長空短多，逆轉信號", "#FF6347"),
+    "Launchpad": ("Launchpad (發射台)", "線性度極高，蓄勢待發", "#32CD32"),
+    "AA+": ("Elite (精英)", "一年期強勢上攻", "#FFA500"),
+    "AA": ("Strong Bull (強多)", "中短期穩定上升", "#FFD700"),
+    "AA-": ("Steady Bull (穩健多)", "趨勢健康向上", "#ADFF2F"),
+    "A+": ("Moderate Bull (溫和多)", "短期表現良好", "#7FFF00"),
+    "A": ("Weak Bull (弱多)", "短期微幅上揚", "#98FB98"),
+    "BBB+": ("Neutral+ (中性偏多)", "盤整偏多", "#F0E68C"),
+    "BBB": ("Neutral (中性)", "橫盤震蕩", "#D3D3D3"),
+    "BBB-": ("Neutral- (中性偏空)", "盤整偏弱", "#DDA0DD"),
+    "Divergence": ("Divergence (背離)", "價格創高但動能衰竭", "#FF1493"),
+    "BB+": ("Weak Bear (弱空)", "短期下跌", "#FFA07A"),
+    "BB": ("Moderate Bear (中等空)", "下跌趨勢明確", "#FF6347"),
+    "BB-": ("Strong Bear (強空)", "跌勢凌厲", "#DC143C"),
+    "B+": ("Severe Bear (重度空)", "崩跌模式", "#8B0000"),
+    "B": ("Depression (蕭條)", "長期熊市", "#800000"),
+    "C": ("Structural Decline (結構衰退)", "世代熊市", "#4B0082"),
+    "D": ("Collapse (崩盤)", "極度危險", "#000000"),
+    "Reversal": ("Reversal (觸底反彈)", "熊市中的V型反轉", "#00CED1"),
+    "N/A": ("Unknown (未分類)", "無法歸類", "#808080"),
+}
+
+# 信評加權倉位使用的強度分數 (空方與未分類為 0)
+RATING_SCORE = {"SSS": 10, "AAA": 9, "Phoenix": 8, "Launchpad": 8, "AA+": 7, "AA": 6, "AA-": 5,
+                "A+": 4, "Reversal": 3, "A": 3, "BBB+": 2, "BBB": 1}
+
+DEFAULT_ENTRY = ("SSS", "AAA", "Phoenix", "Launchpad", "AA+", "AA", "AA-")
+DEFAULT_EXIT = ("BBB-", "Divergence", "BB+", "BB", "BB-", "B+", "B", "C", "D")
+SIZING_MODES = ("equal", "rating", "inverse_vol")
+
+
+# ==========================================
+# 前綴和滾動對數回歸
+# ==========================================
+def rolling_log_regression(close: np.ndarray, window: int) -> Dict[str, np.ndarray]:
+    """
+    月收盤價 (1-D，無缺值) → 每個月份以最近 window 個月 (不足則取全部歷史) 的對數價格回歸。
+    回傳 angle / r2 / slope 陣列；樣本少於 3 個月的位置為 0 (與原 calculate_geometry_metrics 相同)。
+    """
+    y = np.log(np.asarray(close, dtype=float))
+    T = len(y)
+    if T == 0:
+        return {"angle": np.array([]), "r2": np.array([]), "slope": np.array([])}
+    y = y - y[0]  # 平移不影響斜率與 R²，降低累加的數值誤差
+    x = np.arange(T, dtype=float)
+    zero = np.zeros(1)
+    cs = {k: np.concatenate([zero, np.cumsum(v)]) for k, v in
+          {"x": x, "xx": x * x, "y": y, "yy": y * y, "xy": x * y}.items()}
+
+    end = np.arange(1, T + 1)
+    n = np.minimum(window, end).astype(float)
+    start = end - n.astype(int)
+    S = {k: v[end] - v[start] for k, v in cs.items()}
+    sxx = n * S["xx"] - S["x"] ** 2
+    syy = n * S["yy"] - S["y"] ** 2
+    sxy = n * S["xy"] - S["x"] * S["y"]
+
+    enough = n >= 3
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(enough & (sxx > 0), sxy / sxx, 0.0)
+        r2 = np.where(enough & (sxx > 0) & (syy > 1e-18), sxy ** 2 / (sxx * syy), 0.0)
+    angle = np.clip(np.degrees(np.arctan(slope * 100)), -90, 90)
+    return {"angle": np.where(enough, angle, 0.0), "r2": np.clip(r2, 0, 1), "slope": slope}
+
+
+def rolling_geometry(close: pd.Series, windows: Dict[str, int] = GEOMETRY_WINDOWS) -> pd.DataFrame:
+    """
+    單檔月收盤 → 每個月份的 7D 幾何 (angle_*/r2_*/slope_*、acceleration、phoenix)。
+    四捨五入位數與原 7D 掃描一致 (角度 2 位、R² 4 位、斜率 6 位)，信評門檻判斷結果相同。
+    """
+    close = close.dropna()
+    cols = {}
+    for label, months in windows.items():
+        reg = rolling_log_regression(close.to_numpy(), months)
+        cols[f"angle_{label}"] = np.round(reg["angle"], 2)
+        cols[f"r2_{label}"] = np.round(reg["r2"], 4)
+        cols[f"slope_{label}"] = np.round(reg["slope"], 6)
+    frame = pd.DataFrame(cols, index=close.index)
+    frame["acceleration"] = np.round(frame["angle_3M"] - frame["angle_1Y"], 2)
+    frame["phoenix"] = (frame["angle_10Y"] < 0) & (frame["angle_6M"] > 25)
+    return frame
+
+
+def geometry_snapshot(features: pd.DataFrame) -> Optional[Dict]:
+    """最新一個月的幾何特徵 → 原 compute_7d_geometry 的字典格式"""
+    if features is None or features.empty:
+        return None
+    last = features.iloc[-1]
+    geo = {label: {"angle": float(last[f"angle_{label}"]), "r2": float(last[f"r2_{label}"]),
+                   "slope": float(last[f"slope_{label}"])} for label in GEOMETRY_WINDOWS}
+    geo["acceleration"] = float(last["acceleration"])
+    geo["phoenix_signal"] = bool(last["phoenix"])
+    return geo
+
+
+# ==========================================
+# 向量化 22 階信評
+# ==========================================
+def rate_geometry(features: pd.DataFrame) -> np.ndarray:
+    """
+    幾何特徵 (任意列數) → 信評代號陣列。
+    條件順序與原逐筆 if 鏈完全相同，np.select 取第一個成立者。
+    """
+    a35, a10 = features["angle_35Y"].to_numpy(), features["angle_10Y"].to_numpy()
+    a1y, a6m, a3m = (features[f"angle_{k}"].to_numpy() for k in ('1Y', '6M', '3M'))
+    r2_1y, r2_3m = features["r2_1Y"].to_numpy(), features["r2_3M"].to_numpy()
+    acc = features["acceleration"].to_numpy()
+    phoenix = features["phoenix"].to_numpy(dtype=bool)
+
+    rules = [
+        ("SSS", (a35 > 45) & (a10 > 45) & (a1y > 45) & (a3m > 45)),
+        ("AAA", (a1y > 40) & (a6m > 45) & (a3m > 50) & (acc > 20)),
+        ("Phoenix", phoenix & (a3m > 30)),
+        ("Launchpad", (r2_1y > 0.95) & (20 < a1y) & (a1y < 40) & (acc > 0)),
+        ("AA+", (a1y > 35) & (a3m > 40) & (r2_3m > 0.85)),
+        ("AA", (a1y > 30) & (a6m > 35)),
+        ("AA-", (a1y > 25) & (a3m > 30)),
+        ("A+", (a6m > 20) & (a3m > 25)),
+        ("A", a3m > 15),
+        ("BBB+", (-5 < a3m) & (a3m < 15) & (a1y > 0)),
+        ("BBB", (-10 < a3m) & (a3m < 10) & (-10 < a1y) & (a1y < 10)),
+        ("BBB-", (-15 < a3m) & (a3m < 5) & (a1y < 0)),
+        ("Divergence", (a1y > 20) & (a3m < -10)),
+        ("BB+", (-25 < a3m) & (a3m < -15) & (a1y > -10)),
+        ("BB", (-35 < a3m) & (a3m < -25)),
+        ("BB-", (-45 < a3m) & (a3m < -35)),
+        ("B+", (a3m < -45) & (a1y < -30)),
+        ("B", (a10 < -30) & (a3m < -40)),
+        ("C", (a35 < -20) & (a10 < -35)),
+        ("D", a3m < -60),
+        ("Reversal", (a10 < -20) & (a3m > 15) & (acc > 30)),
+    ]
+    return np.select([cond for _, cond in rules], [code for code, _ in rules], default="N/A")
+
+
+# ==========================================
+# 回測沙盒
+# ==========================================
+def monthly_closes(daily: pd.DataFrame) -> pd.DataFrame:
+    """日收盤面板 → 月收盤面板 (該月無成交者為 NaN)"""
+    if daily is None or daily.empty:
+        return pd.DataFrame()
+    return daily.resample(MONTH_END).last()
+
+
+class TitanGeometrySandbox:
+    """
+    7D 幾何信評回測沙盒
+    load(): 批次下載戰區全歷史並一次算好所有月份的幾何特徵與信評 (之後換參數回測不需重算)。
+    run(): 月底信評 → 次月持倉，回傳權益、回撤、權重與 metrics 績效。
+    """
+
+    def __init__(self, panel: Optional[TitanPricePanel] = None, start_date: str = "1990-01-01"):
+        self.panel = panel or TitanPricePanel()
+        self.start_date = start_date
+        self.closes = pd.DataFrame()
+        self.features: Dict[str, pd.DataFrame] = {}
+        self.ratings = pd.DataFrame()
+
+    def load(self, codes: Iterable[str]) -> 'TitanGeometrySandbox':
+        daily = self.panel.close_panel(list(codes), start=self.start_date)
+        return self.load_closes(monthly_closes(daily))
+
+    def load_closes(self, closes: pd.DataFrame) -> 'TitanGeometrySandbox':
+        """以月收盤面板建立特徵；全部標的的特徵合併後只呼叫一次向量化信評"""
+        closes = closes.sort_index()
+        first = closes.notna().any(axis=1)
+        self.closes = closes[first.cummax()] if first.any() else closes
+        self.features = {c: rolling_geometry(self.closes[c]) for c in self.closes.columns}
+        self.features = {c: f for c, f in self.features.items() if not f.empty}
+        if not self.features:
+            self.ratings = pd.DataFrame(index=self.closes.index)
+            return self
+        stacked = pd.concat(self.features, names=['code', 'date'])
+        codes = pd.Series(rate_geometry(stacked), index=stacked.index)
+        self.ratings = codes.unstack('code').reindex(index=self.closes.index, columns=self.closes.columns)
+        return self
+
+    def _weights(self, position: np.ndarray, returns: np.ndarray, sizing: str,
+                 max_weight: Optional[float], vol_window: int) -> np.ndarray:
+        held = position.astype(bool)
+        if sizing == "rating":
+            score = self.ratings.apply(lambda s: s.map(RATING_SCORE)).fillna(0).to_numpy(dtype=float)
+            raw = np.where(held, np.maximum(score, 1.0), 0.0)
+        elif sizing == "inverse_vol":
+            vol = pd.DataFrame(returns).rolling(vol_window, min_periods=3).std().to_numpy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inv = np.where(np.isfinite(vol) & (vol > 0), 1 / vol, np.nan)
+            # 波動資料不足的持股以同月其他持股的中位數權重代替
+            fallback = pd.DataFrame(np.where(held, inv, np.nan)).median(axis=1).fillna(1.0).to_numpy()[:, None]
+            raw = np.where(held, np.where(np.isfinite(inv), inv, fallback), 0.0)
+        elif sizing == "equal":
+            raw = held.astype(float)
+        else:
+            raise ValueError(f"未知的倉位模式: {sizing} (可用: {SIZING_MODES})")
+        total = raw.sum(axis=1, keepdims=True)
+        weights = np.divide(raw, total, out=np.zeros_like(raw), where=total > 0)
+        if max_weight:
+            weights = np.minimum(weights, max_weight)  # 超過上限的部分留作現金
+        return weights
+
+    def run(self, entry: Sequence[str] = DEFAULT_ENTRY, exit: Sequence[str] = DEFAULT_EXIT,
+            sizing: str = "equal", max_weight: Optional[float] = None, cost: float = 0.0,
+            vol_window: int = 12, initial_capital: float = 1000000) -> Dict:
+        """
+        entry / exit: 觸發進場 / 出場的信評代號；兩者皆非則維持前一狀態 (遲滯)。
+        cost: 每單位換手的交易成本 (例 0.003)。
+        """
+        if self.ratings.empty:
+            return {}
+        codes = self.ratings.to_numpy(dtype=object)
+        has_data = pd.notna(self.ratings).to_numpy()
+        position = hysteresis_position(np.isin(codes, list(entry)) & has_data,
+                                       np.isin(codes, list(exit)) | ~has_data)
+
+        returns = self.closes.pct_change(fill_method=None).to_numpy(dtype=float)
+        weights = self._weights(position, returns, sizing, max_weight, vol_window)
+        held_weights = np.vstack([np.zeros((1, weights.shape[1])), weights[:-1]])  # 月底評等 → 次月持有
+        turnover = np.abs(np.diff(held_weights, axis=0, prepend=0)).sum(axis=1)
+        port = (held_weights * np.nan_to_num(returns)).sum(axis=1) - cost * turnover
+
+        index = self.closes.index
+        port_returns = pd.Series(port, index=index, name='Return')
+        stats = metrics.summarize(port, position=held_weights.sum(axis=1) > 0, periods_per_year=12)
+        stats["trades"] = int((np.diff(position, axis=0, prepend=0) == 1).sum())
+        stats["avg_holdings"] = float((held_weights > 0).sum(axis=1).mean())
+        stats["turnover"] = float(turnover.sum() / max(len(index) / 12, 1e-9))
+        return {
+            "returns": port_returns,
+            "equity": pd.Series(metrics.equity_curve(port, initial_capital), index=index, name='Equity'),
+            "drawdown": pd.Series(metrics.drawdown(port), index=index, name='Drawdown'),
+            "weights": pd.DataFrame(held_weights, index=index, columns=self.closes.columns),
+            "stats": stats,
+            "rating_returns": self.rating_forward_returns(),
+        }
+
+    def rating_forward_returns(self) -> pd.DataFrame:
+        """各信評等級的次月報酬統計 (樣本數、平均、中位數、上漲機率)，檢驗信評本身的預測力"""
+        forward = self.closes.pct_change(fill_method=None).shift(-1)
+        frame = pd.DataFrame({"rating": self.ratings.stack(), "forward": forward.stack()}).dropna()
+        if frame.empty:
+            return pd.DataFrame(columns=['months', 'mean', 'median', 'hit_rate'])
+        grouped = frame.groupby('rating')['forward']
+        table = pd.DataFrame({"months": grouped.size(), "mean": grouped.mean(), "median": grouped.median(),
+                              "hit_rate": grouped.apply(lambda s: (s > 0).mean())})
+        order = [r for r in RATING_TABLE if r in table.index]
+        return table.loc[order]
@@ -0,0 +1,262 @@
+# metrics.py
+# Titan SOP V82.1 - Shared Performance Metrics
+# 狀態: 全系統共用的向量化績效指標 (所有回測引擎與 UI 同一套定義)
+# 修正重點:
+# 1. [單一定義] CAGR、Sharpe、Sortino、MDD 與回撤天數、Calmar、勝率、獲利因子、賺賠比、凱利、曝險度只在此計算一次。
+# 2. [向量化] 輸入為報酬 (或權益) 陣列，1-D 為單一序列，2-D 為 (時間 × 策略/標的) 一次計算所有欄位。
+# 3. [滾動指標] rolling_return / rolling_sharpe / rolling_volatility 以前綴和求得，rolling_max_drawdown 以滑動視窗計算。
+#
+# 慣例: 報酬中的 NaN 視為 0 (空手 / 停牌)；年化以 periods_per_year (預設 252) 換算，年數 = 筆數 / periods_per_year。
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Union
+
+ArrayLike = Union[np.ndarray, pd.Series, pd.DataFrame, list]
+TRADING_DAYS = 252
+
+
+def _returns(returns: ArrayLike) -> np.ndarray:
+    return np.nan_to_num(np.asarray(returns, dtype=float))
+
+
+def _wrap(values: np.ndarray, like: ArrayLike):
+    """2-D DataFrame 輸入時以其欄名回傳 Series，1-D 回傳 float"""
+    if np.ndim(values) == 0:
+        return float(values)
+    if isinstance(like, pd.DataFrame):
+        return pd.Series(values, index=like.columns)
+    return values
+
+
+# ==========================================
+# 權益 / 報酬轉換
+# ==========================================
+def equity_curve(returns: ArrayLike, initial: float = 1.0) -> np.ndarray:
+    """報酬 → 複利權益 (沿時間軸)"""
+    return np.cumprod(1 + _returns(returns), axis=0) * initial
+
+
+def to_returns(equity: ArrayLike) -> np.ndarray:
+    """權益 → 報酬 (首筆為 0)"""
+    eq = np.asarray(equity, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = eq[1:] / eq[:-1] - 1
+    return np.concatenate([np.zeros((1,) + eq.shape[1:]), np.nan_to_num(ret)], axis=0)
+
+
+def drawdown(returns: ArrayLike) -> np.ndarray:
+    """每個時間點距離前高的回落 (<= 0)"""
+    eq = equity_curve(returns)
+    return eq / np.maximum.accumulate(eq, axis=0) - 1
+
+
+# ==========================================
+# 報酬型指標
+# ==========================================
+def cagr(returns: ArrayLike, periods_per_year: int = TRADING_DAYS):
+    r = _returns(returns)
+    if len(r) == 0:
+        return _wrap(np.zeros(r.shape[1:]), returns)
+    growth = np.prod(1 + r, axis=0)
+    with np.errstate(invalid='ignore'):
+        out = np.maximum(growth, 0) ** (periods_per_year / len(r)) - 1
+    return _wrap(out, returns)
+
+
+def volatility(returns: ArrayLike, periods_per_year: int = TRADING_DAYS):
+    r = _returns(returns)
+    return _wrap(r.std(axis=0, ddof=1) * np.sqrt(periods_per_year) if len(r) > 1 else np.zeros(r.shape[1:]), returns)
+
+
+def sharpe(returns: ArrayLike, risk_free: float = 0.0, periods_per_year: int = TRADING_DAYS):
+    """(年化平均報酬 - 無風險利率) / 年化標準差；標準差為 0 時回傳 0"""
+    r = _returns(returns)
+    std = r.std(axis=0, ddof=1) if len(r) > 1 else np.zeros(r.shape[1:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.where(std > 0, (r.mean(axis=0) * periods_per_year - risk_free) / (std * np.sqrt(periods_per_year)), 0.0)
+    return _wrap(out, returns)
+
+
+def sortino(returns: ArrayLike, risk_free: float = 0.0, periods_per_year: int = TRADING_DAYS):
+    """Sharpe 的下檔版本: 分母只計負報酬的半變異 (target = 0)"""
+    r = _returns(returns)
+    downside = np.sqrt(np.mean(np.minimum(r, 0) ** 2, axis=0)) if len(r) else np.zeros(r.shape[1:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.where(downside > 0, (r.mean(axis=0) * periods_per_year - risk_free) / (downside * np.sqrt(periods_per_year)), 0.0)
+    return _wrap(out, returns)
+
+
+def max_drawdown(returns: ArrayLike):
+    r = _returns(returns)
+    return _wrap(drawdown(r).min(axis=0) if len(r) else np.zeros(r.shape[1:]), returns)
+
+
+def max_drawdown_duration(returns: ArrayLike):
+    """最長水下期間 (筆數): 由前一個新高到回到新高 (或期末) 的最長距離"""
+    r = _returns(returns)
+    if len(r) == 0:
+        return _wrap(np.zeros(r.shape[1:], dtype=int), returns)
+    underwater = drawdown(r) < 0
+    t = np.arange(len(r)).reshape((-1,) + (1,) * (r.ndim - 1))
+    last_high = np.maximum.accumulate(np.where(underwater, -1, t), axis=0)
+    return _wrap(np.where(underwater, t - last_high, 0).max(axis=0), returns)
+
+
+def calmar(returns: ArrayLike, periods_per_year: int = TRADING_DAYS):
+    """CAGR / |MDD|；無回撤時回傳 0"""
+    r = _returns(returns)
+    c, m = np.asarray(cagr(r, periods_per_year)), np.asarray(max_drawdown(r))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap(np.where(m < 0, c / -m, 0.0), returns)
+
+
+def exposure(position: ArrayLike):
+    """持倉比例 (position 非 0 的時間佔比)"""
+    pos = np.nan_to_num(np.asarray(position, dtype=float))
+    return _wrap((pos != 0).mean(axis=0) if len(pos) else np.zeros(pos.shape[1:]), position)
+
+
+# ==========================================
+# 勝負型指標 (日報酬或交易報酬皆可)
+# ==========================================
+def _active(r: np.ndarray, active: Optional[ArrayLike]) -> np.ndarray:
+    return (r != 0) if active is None else np.asarray(active, dtype=bool)
+
+
+def win_rate(returns: ArrayLike, active: Optional[ArrayLike] = None):
+    """獲利筆數 / 有效筆數；active 省略時以非零報酬為有效 (可傳入持倉遮罩，讓持有但零報酬的日子計入分母)"""
+    r = _returns(returns)
+    act = _active(r, active)
+    n = act.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap(np.where(n > 0, ((r > 0) & act).sum(axis=0) / n, 0.0), returns)
+
+
+def profit_factor(returns: ArrayLike):
+    """總獲利 / 總虧損 (無虧損時為 inf，無交易為 0)"""
+    r = _returns(returns)
+    gains = np.where(r > 0, r, 0).sum(axis=0)
+    losses = -np.where(r < 0, r, 0).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.where(losses > 0, gains / losses, np.where(gains > 0, np.inf, 0.0))
+    return _wrap(out, returns)
+
+
+def payoff_ratio(returns: ArrayLike):
+    """平均獲利 / 平均虧損 (無虧損時平均虧損以 1 計，沿用原 run_fast_backtest 定義)"""
+    r = _returns(returns)
+    win, loss = r > 0, r < 0
+    n_win, n_loss = win.sum(axis=0), loss.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_win = np.where(n_win > 0, np.where(win, r, 0).sum(axis=0) / n_win, 0.0)
+        avg_loss = np.where(n_loss > 0, -np.where(loss, r, 0).sum(axis=0) / n_loss, 1.0)
+    return _wrap(avg_win / avg_loss, returns)
+
+
+def kelly(returns: ArrayLike, active: Optional[ArrayLike] = None):
+    """凱利值 = 勝率 - (1 - 勝率) / 賺賠比 (賺賠比 <= 0 時為 0；未截斷負值)"""
+    r = _returns(returns)
+    w = np.asarray(win_rate(r, active))
+    b = np.asarray(payoff_ratio(r))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap(np.where(b > 0, w - (1 - w) / b, 0.0), returns)
+
+
+# ==========================================
+# 滾動指標
+# ==========================================
+def _window_sums(values: np.ndarray, window: int) -> np.ndarray:
+    cs = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)], axis=0)
+    out = np.full(values.shape, np.nan)
+    if window <= len(values):
+        out[window - 1:] = cs[window:] - cs[:-window]
+    return out
+
+
+def rolling_return(returns: ArrayLike, window: int) -> np.ndarray:
+    """滾動 window 筆的累積報酬 (以對數報酬前綴和計算)"""
+    return np.exp(_window_sums(np.log1p(_returns(returns)), window)) - 1
+
+
+def rolling_volatility(returns: ArrayLike, window: int, periods_per_year: int = TRADING_DAYS) -> np.ndarray:
+    r = _returns(returns)
+    s1, s2 = _window_sums(r, window), _window_sums(r ** 2, window)
+    var = np.maximum(s2 / window - (s1 / window) ** 2, 0) * window / max(window - 1, 1)
+    return np.sqrt(var) * np.sqrt(periods_per_year)
+
+
+def rolling_sharpe(returns: ArrayLike, window: int, risk_free: float = 0.0,
+                   periods_per_year: int = TRADING_DAYS) -> np.ndarray:
+    r = _returns(returns)
+    mean = _window_sums(r, window) / window
+    vol = rolling_volatility(r, window, periods_per_year)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(vol > 1e-12, (mean * periods_per_year - risk_free) / vol, 0.0)
+
+
+def rolling_max_drawdown(returns: ArrayLike, window: int) -> np.ndarray:
+    """滾動 window 筆內的最大回撤 (滑動視窗一次計算)"""
+    r = _returns(returns)
+    out = np.full(r.shape, np.nan)
+    if window > len(r):
+        return out
+    windows = np.lib.stride_tricks.sliding_window_view(r, window, axis=0)   # (T-w+1, ..., w)
+    eq = np.cumprod(1 + windows, axis=-1)
+    out[window - 1:] = (eq / np.maximum.accumulate(eq, axis=-1) - 1).min(axis=-1)
+    return out
+
+
+# ==========================================
+# 彙總
+# ==========================================
+def summarize(returns: ArrayLike, position: Optional[ArrayLike] = None, risk_free: float = 0.0,
+              periods_per_year: int = TRADING_DAYS) -> Union[Dict[str, float], pd.DataFrame]:
+    """
+    完整指標組: cagr / volatility / sharpe / sortino / max_drawdown / max_drawdown_duration / calmar /
+    win_rate / profit_factor / payoff_ratio / kelly / exposure。
+    position 提供時，勝率與凱利以持倉日為分母、exposure 以持倉計；1-D 回傳 dict，2-D 回傳 DataFrame (欄 × 指標)。
+    """
+    r = _returns(returns)
+    active = None
+    if position is not None:
+        active = np.asarray(position, dtype=float) != 0
+    table = {
+        "cagr": cagr(r, periods_per_year),
+        "volatility": volatility(r, periods_per_year),
+        "sharpe": sharpe(r, risk_free, periods_per_year),
+        "sortino": sortino(r, risk_free, periods_per_year),
+        "max_drawdown": max_drawdown(r),
+        "max_drawdown_duration": max_drawdown_duration(r),
+        "calmar": calmar(r, periods_per_year),
+        "win_rate": win_rate(r, active),
+        "profit_factor": profit_factor(np.where(active, r, 0) if active is not None else r),
+        "payoff_ratio": payoff_ratio(np.where(active, r, 0) if active is not None else r),
+        "kelly": kelly(r, active),
+        "exposure": exposure(active if active is not None else r),
+    }
+    if r.ndim == 1:
+        return {k: float(v) for k, v in table.items()}
+    index = returns.columns if isinstance(returns, pd.DataFrame) else None
+    return pd.DataFrame({k: np.asarray(v) for k, v in table.items()}, index=index)
+
+
+def trade_summary(roi: ArrayLike, trades_per_year: Optional[float] = None) -> Dict[str, float]:
+    """
+    交易報酬率序列 (依時間排序) 的指標: 勝率、獲利因子、賺賠比、凱利、
+    逐筆複利的最大回撤，以及 (提供每年交易次數時) 的年化報酬。
+    """
+    r = _returns(roi)
+    out = {
+        "trades": int(len(r)),
+        "win_rate": float(win_rate(r, np.ones(len(r), bool))) if len(r) else 0.0,
+        "profit_factor": float(profit_factor(r)) if len(r) else 0.0,
+        "payoff_ratio": float(payoff_ratio(r)) if len(r) else 0.0,
+        "kelly": float(kelly(r, np.ones(len(r), bool))) if len(r) else 0.0,
+        "max_drawdown": float(max_drawdown(r)) if len(r) else 0.0,
+        "best": float(r.max()) if len(r) else 0.0,
+        "worst": float(r.min()) if len(r) else 0.0,
+    }
+    if trades_per_year and len(r):
+        out["cagr"] = float(cagr(r, periods_per_year=trades_per_year))
+    return out
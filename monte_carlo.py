@@ -0,0 +1,94 @@
+# monte_carlo.py
+# Titan SOP V82.1 - Monte Carlo Bootstrap
+# 狀態: 交易序列 / 日報酬重抽樣的穩健度檢驗 (CAGR / MDD / 凱利 信賴區間)
+# 修正重點:
+# 1. [批次路徑] 重抽樣索引一次產生 (路徑 × 步數)，權益、回撤與凱利 (metrics.kelly) 皆為整批陣列運算，不逐條路徑迴圈。
+# 2. [區塊抽樣] block > 1 時以固定長度區塊重抽 (保留趨勢 / 波動聚集)，block = 1 為獨立重抽。
+# 3. [記憶體] 路徑分批計算 (chunk)，扇形圖只保留粗時間格點，10,000 條 × 10 年不需一次配置整個權益矩陣。
+
+import numpy as np
+import pandas as pd
+import metrics
+from typing import Dict, Optional, Sequence
+
+BANDS = (5, 25, 50, 75, 95)
+
+
+def bootstrap_indices(n: int, n_paths: int, horizon: int, block: int = 1,
+                      rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """(路徑 × 步數) 的重抽樣索引；block > 1 時為連續區塊 (起點均勻抽樣)"""
+    rng = rng or np.random.default_rng()
+    block = int(max(1, min(block, n)))
+    if block == 1:
+        return rng.integers(0, n, size=(n_paths, horizon))
+    n_blocks = -(-horizon // block)
+    starts = rng.integers(0, n - block + 1, size=(n_paths, n_blocks))
+    return (starts[:, :, None] + np.arange(block)).reshape(n_paths, -1)[:, :horizon]
+
+
+class TitanMonteCarlo:
+    """
+    蒙地卡羅穩健度引擎
+    from_returns: 日報酬重抽 (例: 策略權益曲線的日報酬)；from_trades: 交易報酬率重抽 (依每年交易次數換算年期)。
+    兩者皆回傳 bands (指標 × 百分位)、prob_loss、fan (權益百分位路徑) 與 paths 數。
+    """
+
+    def __init__(self, n_paths: int = 10000, block: int = 1, seed: Optional[int] = None, chunk: int = 1000,
+                 bands: Sequence[int] = BANDS):
+        self.n_paths = n_paths
+        self.block = block
+        self.seed = seed
+        self.chunk = chunk
+        self.bands = tuple(bands)
+
+    def _simulate(self, sample: np.ndarray, horizon: int, steps_per_year: float,
+                  fraction: float = 1.0, fan_points: int = 120) -> Dict:
+        sample = np.asarray(sample, dtype=float)
+        sample = sample[np.isfinite(sample)]
+        if len(sample) < 2 or horizon < 1:
+            return {}
+        rng = np.random.default_rng(self.seed)
+        grid = np.unique(np.linspace(0, horizon - 1, min(fan_points, horizon)).astype(int))
+
+        cagr = np.empty(self.n_paths)
+        mdd = np.empty(self.n_paths)
+        kelly = np.empty(self.n_paths)
+        fan = np.empty((self.n_paths, len(grid)))
+        years = horizon / steps_per_year
+
+        for lo in range(0, self.n_paths, self.chunk):
+            hi = min(lo + self.chunk, self.n_paths)
+            draws = sample[bootstrap_indices(len(sample), hi - lo, horizon, self.block, rng)]
+            equity = np.cumprod(1 + fraction * draws, axis=1)
+            peak = np.maximum.accumulate(equity, axis=1)
+            mdd[lo:hi] = (equity / peak - 1).min(axis=1)
+            with np.errstate(invalid='ignore'):
+                cagr[lo:hi] = np.maximum(equity[:, -1], 0) ** (1 / years) - 1
+            kelly[lo:hi] = metrics.kelly(draws.T)
+            fan[lo:hi] = equity[:, grid]
+
+        paths = pd.DataFrame({"cagr": cagr, "mdd": mdd, "kelly": kelly})
+        bands = paths.quantile(np.array(self.bands) / 100).T
+        bands.columns = [f"p{b}" for b in self.bands]
+        return {
+            "bands": bands,
+            "prob_loss": float((cagr < 0).mean()),
+            "fan": pd.DataFrame(np.percentile(fan, self.bands, axis=0).T, index=(grid + 1) / steps_per_year,
+                                columns=[f"p{b}" for b in self.bands]),
+            "paths": self.n_paths,
+            "horizon_years": years,
+        }
+
+    def from_returns(self, returns, horizon_years: float = 10, periods_per_year: int = 252) -> Dict:
+        """日 (或其他週期) 報酬序列 → horizon_years 年的重抽樣權益路徑統計"""
+        sample = np.asarray(pd.Series(returns).dropna(), dtype=float)
+        return self._simulate(sample, int(round(horizon_years * periods_per_year)), periods_per_year)
+
+    def from_trades(self, roi, trades_per_year: float, horizon_years: float = 10, fraction: float = 1.0) -> Dict:
+        """
+        交易報酬率 → 依每年交易次數重抽 horizon_years 年份的交易序列 (每筆投入 fraction 比例資金並複利)。
+        """
+        if not trades_per_year or trades_per_year <= 0:
+            return {}
+        horizon = max(1, int(round(horizon_years * trades_per_year)))
+        return self._simulate(np.asarray(roi, dtype=float), horizon, trades_per_year, fraction=fraction)
@@ -0,0 +1,131 @@
+# price_panel.py
+# Titan SOP V82.1 - Shared Price Panel
+# 狀態: 全系統共用行情面板 (一次批次下載，多模組共用)
+# 修正重點:
+# 1. [批次雙軌] 台股代號先整批抓 .TW，缺漏者再整批補抓 .TWO (最多兩次網路往返)。
+# 2. [行程內快取] 同一期間的行情於 max_age 秒內重複使用，普查、排名、回測不再各自下載。
+# 3. [向量化統計] trailing_stats 以「有效值壓實」一次算出所有標的的現價與多條均線。
+
+import re
+import time
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def is_tw_code(code: str) -> bool:
+    """4-6 碼且數字開頭視為台股代號 (含 00675L 類 ETF)"""
+    return bool(re.match(r'^[0-9]', code)) and 4 <= len(code) <= 6
+
+
+def to_yahoo_symbol(code: str, board: str = "TW") -> str:
+    """台股代號補上交易所後綴，其餘 (美股、指數、已帶後綴) 原樣回傳"""
+    code = str(code).strip().upper()
+    return f"{code}.{board}" if is_tw_code(code) else code
+
+
+def compact_valid(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    將每欄的有效值 (非 NaN) 依原順序推到底部，NaN 移到頂部。
+    回傳 (壓實後陣列, 每欄有效筆數)；壓實後末 N 列即每檔「最近 N 筆有效行情」。
+    """
+    valid = ~np.isnan(values)
+    order = np.argsort(valid, axis=0, kind='stable')
+    return np.take_along_axis(values, order, axis=0), valid.sum(axis=0)
+
+
+def trailing_stats(panel: pd.DataFrame, windows: Iterable[int]) -> pd.DataFrame:
+    """
+    面板 (日期 × 標的) → 每檔最新價、有效筆數與各視窗的最新均線。
+    停牌造成的中間缺值會被略過，結果等同逐檔 dropna 後 rolling(w).mean().iloc[-1]。
+    """
+    values = panel.to_numpy(dtype=float)
+    compact, count = compact_valid(values)
+    stats = {"last": compact[-1] if len(compact) else np.full(values.shape[1], np.nan), "count": count}
+    for w in windows:
+        if len(compact) >= w:
+            ma = compact[-w:].mean(axis=0)
+            stats[f"ma{w}"] = np.where(count >= w, ma, np.nan)
+        else:
+            stats[f"ma{w}"] = np.full(values.shape[1], np.nan)
+    return pd.DataFrame(stats, index=panel.columns)
+
+
+class TitanPricePanel:
+    """
+    共用行情面板
+    以 (代號, period, start) 為鍵快取每檔 OHLCV；代號一律使用原始代號 (例 '2330')，
+    實際下載的 Yahoo 代號記錄於 self.symbols。
+    """
+
+    def __init__(self, max_age: int = 600):
+        self.max_age = max_age
+        self._cache: Dict[tuple, Tuple[float, pd.DataFrame]] = {}
+        self.symbols: Dict[str, str] = {}
+        self.download_count = 0
+
+    @staticmethod
+    def _split(data: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+        """拆解 yf.download(group_by='ticker') 結果為 {ticker: OHLCV}"""
+        frames = {}
+        if data is None or data.empty:
+            return frames
+        for ticker in tickers:
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                frame = data[ticker]
+            elif len(tickers) == 1:
+                frame = data
+            else:
+                continue
+            frame = frame.dropna(how='all')
+            if not frame.empty and 'Close' in frame.columns and frame['Close'].notna().any():
+                frames[ticker] = frame
+        return frames
+
+    def _download(self, tickers: List[str], period: Optional[str], start: Optional[str]) -> Dict[str, pd.DataFrame]:
+        if not tickers:
+            return {}
+        self.download_count += 1
+        kwargs = {"start": start} if start else {"period": period}
+        try:
+            data = yf.download(tickers, group_by='ticker', progress=False, threads=True, **kwargs)
+        except Exception:
+            return {}
+        return self._split(data, tickers)
+
+    def fetch(self, codes: Iterable[str], period: str = "2y", start: Optional[str] = None,
+              refresh: bool = False) -> Dict[str, pd.DataFrame]:
+        """
+        批次取得多檔 OHLCV (代號 → DataFrame)。
+        快取未命中者整批下載 .TW (或原代號)，缺漏的台股代號再整批補抓 .TWO；查無資料者不回傳。
+        """
+        codes = [str(c).strip() for c in dict.fromkeys(codes) if str(c).strip()]
+        now = time.time()
+        todo = [c for c in codes
+                if refresh or (c, period, start) not in self._cache
+                or now - self._cache[(c, period, start)][0] > self.max_age]
+
+        if todo:
+            primary = {to_yahoo_symbol(c): c for c in todo}
+            got = self._download(list(primary), period, start)
+            fallback = {to_yahoo_symbol(c, "TWO"): c for t, c in primary.items() if t not in got and is_tw_code(c)}
+            got.update(self._download(list(fallback), period, start))
+
+            resolved = {code: ticker for ticker, code in {**primary, **fallback}.items() if ticker in got}
+            for code in todo:
+                if code in resolved:
+                    self.symbols[code] = resolved[code]
+                self._cache[(code, period, start)] = (now, got[resolved[code]] if code in resolved else pd.DataFrame())
+
+        return {c: self._cache[(c, period, start)][1] for c in codes if not self._cache[(c, period, start)][1].empty}
+
+    def close_panel(self, codes: Iterable[str], period: str = "2y", start: Optional[str] = None,
+                    refresh: bool = False) -> pd.DataFrame:
+        """收盤價面板 (日期 × 代號)，查無資料的代號不列入"""
+        frames = self.fetch(codes, period=period, start=start, refresh=refresh)
+        if not frames:
+            return pd.DataFrame()
+        return pd.DataFrame({c: f['Close'] for c, f in frames.items()}).sort_index()
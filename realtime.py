@@ -0,0 +1,213 @@
+# realtime.py
+# Titan SOP V82.1 - Intraday Realtime Rescoring
+# 狀態: 盤中即時模式 (報價串流 → 增量更新 → 變化事件推播)
+# 修正重點:
+# 1. [報價來源] ReplayQuoteSource (本地 CSV 回放) 與 SocketQuoteSource (本地 socket 逐行報價) 作為即時源替身。
+# 2. [增量狀態] 以最近一次掃描的 enriched 資料為底，每筆報價只更新受影響的 CB 列 (價格/理論價/溢價/評分)。
+# 3. [變化事件] 甜蜜點進出、87MA 上下、評分與操作建議改變時推播給訂閱者，不再定時重跑全市場掃描。
+
+import csv
+import json
+import socket
+import time
+import numpy as np
+import pandas as pd
+from config import Config
+from scoring import TitanScoringEngine
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# ==========================================
+# 報價來源 (Quote Sources)
+# ==========================================
+class ReplayQuoteSource:
+    """
+    本地檔案回放: CSV 欄位 ts,symbol,price (選填 kind=cb/stock)
+    path 可為檔案路徑或已開啟的檔案物件 (例: Streamlit 上傳檔)。
+    speed=0 表示不等待、盡速回放；speed=1 依原始時間間隔回放。
+    """
+
+    def __init__(self, path, speed: float = 0.0):
+        self.path = path
+        self.speed = speed
+
+    def _lines(self) -> Iterator[str]:
+        if hasattr(self.path, 'read'):
+            self.path.seek(0)
+            raw = self.path.read()
+            yield from (raw.decode('utf-8-sig') if isinstance(raw, bytes) else raw).splitlines()
+        else:
+            with open(self.path, newline='', encoding='utf-8-sig') as f:
+                yield from f
+
+    def __iter__(self) -> Iterator[Dict]:
+        last_ts = None
+        for rec in csv.DictReader(self._lines()):
+            quote = _parse_quote(rec)
+            if quote is None:
+                continue
+            if self.speed > 0 and last_ts is not None and quote['ts'] is not None:
+                time.sleep(max(0.0, (quote['ts'] - last_ts).total_seconds() / self.speed))
+            last_ts = quote['ts'] or last_ts
+            yield quote
+
+
+class SocketQuoteSource:
+    """本地 TCP 逐行報價 (每行為 JSON 或 'ts,symbol,price')，連線關閉即結束"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9999, timeout: Optional[float] = None):
+        self.host, self.port, self.timeout = host, port, timeout
+
+    def __iter__(self) -> Iterator[Dict]:
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+            for line in conn.makefile('r', encoding='utf-8'):
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith('{'):
+                    rec = json.loads(line)
+                else:
+                    parts = line.split(',')
+                    rec = dict(zip(['ts', 'symbol', 'price', 'kind'], parts))
+                quote = _parse_quote(rec)
+                if quote is not None:
+                    yield quote
+
+
+def _parse_quote(rec: Dict) -> Optional[Dict]:
+    try:
+        price = float(rec['price'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    ts = pd.to_datetime(rec.get('ts'), errors='coerce')
+    return {
+        "ts": None if pd.isna(ts) else ts,
+        "symbol": str(rec.get('symbol', '')).strip(),
+        "price": price,
+        "kind": (rec.get('kind') or '').strip().lower() or None,
+    }
+
+
+def compute_parity_premium(price: np.ndarray, stock_price: np.ndarray, conversion_price: np.ndarray):
+    """理論價與溢價率 (公式同 TitanStrategyEngine._calculate_risk_metrics)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        parity = np.where(conversion_price > 0, stock_price / conversion_price * 100, 0.0)
+        parity = np.nan_to_num(parity)
+        premium = np.where(parity > 0, (price - parity) / parity * 100, 0.0)
+    return parity, np.nan_to_num(premium)
+
+
+# ==========================================
+# 即時狀態 (Realtime State)
+# ==========================================
+class TitanRealtimeState:
+    """
+    盤中即時評分狀態
+    底稿為一次完整掃描的 enriched 資料 (含 MA87/MA284、身份、故事等日線條件)，
+    盤中只有 CB 價格與標的現價會變動，其餘條件沿用收盤結果。
+    """
+
+    WATCH_FIELDS = ['price', 'stock_price', 'parity', 'premium', 'score', 'action', 'in_sweet_spot', 'above_ma87']
+    # 盤中不需帶入狀態的大型物件欄位
+    _SKIP_COLUMNS = {'events', 'role', 'story', 'full_report'}
+
+    def __init__(self, enriched: pd.DataFrame, scoring: Optional[TitanScoringEngine] = None):
+        if enriched.empty:
+            raise ValueError("即時模式需要先完成一次全市場掃描 (enriched 資料為空)")
+        self.scoring = scoring or TitanScoringEngine()
+        frame = enriched.drop(columns=[c for c in self._SKIP_COLUMNS if c in enriched.columns]).reset_index(drop=True)
+        self.columns: Dict[str, np.ndarray] = {c: frame[c].to_numpy().copy() for c in frame.columns}
+        for col in ['price', 'stock_price', 'conversion_price', 'MA87', 'MA284', 'parity', 'premium']:
+            self.columns[col] = pd.to_numeric(frame.get(col, pd.Series(0.0, index=frame.index)), errors='coerce').fillna(0).to_numpy(dtype=float).copy()
+        self.columns['in_sweet_spot'] = self._sweet_spot(self.columns['price'])
+        self.columns['above_ma87'] = self.columns['stock_price'] > self.columns['MA87']
+
+        codes = frame['code'].astype(str).str.strip().to_numpy()
+        self._cb_index = {c: i for i, c in enumerate(codes)}
+        stock_codes = frame['stock_code'].astype(str).str.strip().to_numpy()
+        self._stock_index: Dict[str, np.ndarray] = {
+            s: np.flatnonzero(stock_codes == s) for s in pd.unique(stock_codes)
+        }
+        self._subscribers: List[Callable[[Dict], None]] = []
+        self.last_update: Dict[str, pd.Timestamp] = {}
+        self.quote_count = 0
+
+    @classmethod
+    def from_strategy(cls, strategy) -> 'TitanRealtimeState':
+        """以策略引擎最近一次掃描的 enriched 資料與評分設定檔建立即時狀態"""
+        return cls(strategy.last_enriched, strategy.scoring)
+
+    @staticmethod
+    def _sweet_spot(price: np.ndarray) -> np.ndarray:
+        return (price >= Config.SWEET_SPOT_LOW) & (price <= Config.SWEET_SPOT_HIGH)
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        """註冊變化事件回呼 (每筆事件一次呼叫)"""
+        self._subscribers.append(callback)
+
+    def snapshot(self) -> pd.DataFrame:
+        """目前完整狀態表"""
+        return pd.DataFrame(self.columns)
+
+    def _rows_for(self, symbol: str, kind: Optional[str]) -> Tuple[np.ndarray, str]:
+        if kind != 'stock' and symbol in self._cb_index:
+            return np.array([self._cb_index[symbol]]), 'cb'
+        if kind != 'cb' and symbol in self._stock_index:
+            return self._stock_index[symbol], 'stock'
+        return np.array([], dtype=int), ''
+
+    def on_quote(self, symbol: str, price: float, kind: Optional[str] = None, ts=None) -> List[Dict]:
+        """處理一筆報價，只重算受影響的列；回傳 (並推播) 變化事件"""
+        rows, kind = self._rows_for(str(symbol).strip(), kind)
+        if not len(rows) or not np.isfinite(price) or price <= 0:
+            return []
+        self.quote_count += 1
+        cols = self.columns
+        before = {f: cols[f][rows].copy() for f in self.WATCH_FIELDS}
+
+        if kind == 'cb':
+            cols['price'][rows] = price
+        else:
+            cols['stock_price'][rows] = price
+
+        parity, premium = compute_parity_premium(cols['price'][rows], cols['stock_price'][rows], cols['conversion_price'][rows])
+        cols['parity'][rows] = parity
+        cols['premium'][rows] = premium
+        cols['in_sweet_spot'][rows] = self._sweet_spot(cols['price'][rows])
+        cols['above_ma87'][rows] = cols['stock_price'][rows] > cols['MA87'][rows]
+
+        subset = pd.DataFrame({c: a[rows] for c, a in cols.items()})
+        score, action = self.scoring.score(subset)
+        cols['score'][rows] = score
+        cols['action'][rows] = action
+
+        ts = pd.Timestamp(ts) if ts is not None else pd.Timestamp.now()
+        events = []
+        for k, row in enumerate(rows):
+            changes = {f: (before[f][k], cols[f][row]) for f in self.WATCH_FIELDS if before[f][k] != cols[f][row]}
+            if not changes:
+                continue
+            code = str(cols['code'][row])
+            self.last_update[code] = ts
+            events.append({
+                "ts": ts, "code": code, "name": cols['name'][row], "stock_code": cols['stock_code'][row],
+                "source": kind, "changes": changes,
+                **{f: cols[f][row] for f in self.WATCH_FIELDS},
+                "MA87": cols['MA87'][row], "MA284": cols['MA284'][row],
+                "converted_ratio": cols['converted_ratio'][row] if 'converted_ratio' in cols else 0.0,
+            })
+
+        for event in events:
+            for callback in self._subscribers:
+                callback(event)
+        return events
+
+    def run(self, source, max_quotes: Optional[int] = None) -> int:
+        """消化整個報價來源 (回放或 socket)，回傳處理筆數"""
+        n = 0
+        for quote in source:
+            self.on_quote(quote['symbol'], quote['price'], quote.get('kind'), quote.get('ts'))
+            n += 1
+            if max_quotes and n >= max_quotes:
+                break
+        return n
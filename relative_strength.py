@@ -0,0 +1,161 @@
+# relative_strength.py
+# Titan SOP V82.1 - Cross-sectional Relative Strength
+# 狀態: 橫斷面相對強度排行 (多週期報酬 → 綜合 RS → 百分位排名)
+# 修正重點:
+# 1. [向量化] 收盤價面板經「有效值壓實」後，一次算出全體標的各週期報酬 (停牌缺值自動略過)。
+# 2. [增量更新] 首次建立下載完整歷史；之後每日只抓近 5 日行情併入面板，新加入的標的才補抓完整歷史。
+# 3. [查詢] 前 N 名、依產業 / 戰區 (WAR_THEATERS) 篩選、族群內落後補漲 (風口豬) 與領漲者一次查出。
+
+import numpy as np
+import pandas as pd
+from config import WAR_THEATERS
+from price_panel import TitanPricePanel, compact_valid
+from typing import Dict, Iterable, List, Optional, Sequence
+
+
+def multi_horizon_returns(closes: pd.DataFrame, horizons: Sequence[int]) -> pd.DataFrame:
+    """面板 (日期 × 標的) → 每檔各週期報酬 (%)，以各自最近的有效收盤價為基準；歷史不足者為 NaN"""
+    values = closes.to_numpy(dtype=float)
+    compact, count = compact_valid(values)
+    out = {}
+    last = compact[-1] if len(compact) else np.full(values.shape[1], np.nan)
+    for h in horizons:
+        if len(compact) > h:
+            base = compact[-1 - h]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ret = (last / base - 1) * 100
+            out[f"ret_{h}d"] = np.where((count > h) & (base > 0), ret, np.nan)
+        else:
+            out[f"ret_{h}d"] = np.full(values.shape[1], np.nan)
+    return pd.DataFrame(out, index=closes.columns)
+
+
+def _bare_symbols(symbols: pd.Index) -> pd.Index:
+    """台股代號去掉 .TW / .TWO 後綴 (其他市場代號原樣保留)"""
+    return symbols.astype(str).str.strip().str.upper().str.replace(r'\.TWO?$', '', regex=True)
+
+
+class TitanRelativeStrength:
+    """
+    相對強度排行引擎
+    綜合 RS = 各週期報酬百分位的加權平均 (預設最近 20 日權重加倍)，再於全體標的中排出 1-99 的 RS Rating。
+    """
+
+    DEFAULT_HORIZONS = (20, 60, 120, 250)
+    DEFAULT_WEIGHTS = (0.4, 0.2, 0.2, 0.2)
+
+    def __init__(self, panel: Optional[TitanPricePanel] = None, horizons: Sequence[int] = DEFAULT_HORIZONS,
+                 weights: Sequence[float] = DEFAULT_WEIGHTS, period: str = "2y"):
+        if len(horizons) != len(weights):
+            raise ValueError("horizons 與 weights 長度必須相同")
+        self.panel = panel or TitanPricePanel()
+        self.horizons = tuple(horizons)
+        self.weights = np.asarray(weights, dtype=float)
+        self.period = period
+        self.closes = pd.DataFrame()
+        self.groups = pd.DataFrame(columns=['sector'])
+        self.table = pd.DataFrame()
+
+    # ------------------------------------------------------------------
+    # 建立與更新
+    # ------------------------------------------------------------------
+    def build(self, codes: Iterable[str], sectors: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """下載完整歷史並建立排行；sectors 為 代號 → 產業/族群"""
+        codes = [str(c).strip() for c in dict.fromkeys(codes) if str(c).strip()]
+        self.closes = self.panel.close_panel(codes, period=self.period)
+        self.set_sectors(sectors or {})
+        return self._rank()
+
+    def update(self, codes: Optional[Iterable[str]] = None, sectors: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """
+        每日增量更新: 既有標的只抓近 5 日行情覆寫/附加到面板，新標的補抓完整歷史；
+        codes 省略時沿用目前的標的池，傳入時以其為新的標的池 (移除不在其中者)。
+        """
+        if self.closes.empty:
+            return self.build(codes or [], sectors)
+        universe = list(self.closes.columns) if codes is None else [str(c).strip() for c in dict.fromkeys(codes)]
+        known = [c for c in universe if c in self.closes.columns]
+        new = [c for c in universe if c not in self.closes.columns]
+
+        recent = self.panel.close_panel(known, period="5d", refresh=True)
+        closes = recent.combine_first(self.closes[known]) if not recent.empty else self.closes[known]
+        if new:
+            fresh = self.panel.close_panel(new, period=self.period)
+            closes = closes.join(fresh, how='outer') if not fresh.empty else closes
+        # 面板長度維持在原歷史長度 (最長週期所需之外不無限成長)
+        keep = max(len(self.closes), max(self.horizons) + 1)
+        self.closes = closes.sort_index().iloc[-keep:]
+        if sectors is not None:
+            self.set_sectors(sectors)
+        return self._rank()
+
+    def set_sectors(self, sectors: Dict[str, str]):
+        self.groups = pd.DataFrame({"sector": pd.Series(sectors, dtype=object)}).reindex(self.closes.columns)
+
+    def _rank(self) -> pd.DataFrame:
+        """全體標的: 各週期報酬、百分位、綜合 RS 與 RS Rating"""
+        if self.closes.empty:
+            self.table = pd.DataFrame()
+            return self.table
+        rets = multi_horizon_returns(self.closes, self.horizons)
+        pct = rets.rank(pct=True) * 100
+        pct.columns = [c.replace('ret_', 'pct_') for c in rets.columns]
+
+        # 缺少某些週期 (上市未滿) 者以其餘週期重新正規化權重
+        available = pct.notna().to_numpy()
+        w = np.where(available, self.weights, 0.0)
+        w_sum = w.sum(axis=1)
+        composite = np.where(w_sum > 0, np.nansum(pct.to_numpy() * w, axis=1) / np.where(w_sum > 0, w_sum, 1), np.nan)
+
+        table = pd.concat([rets, pct], axis=1)
+        table['rs_composite'] = composite
+        table['rs_rating'] = (table['rs_composite'].rank(pct=True) * 98 + 1).round()
+        table['last_price'] = compact_valid(self.closes.to_numpy(dtype=float))[0][-1]
+        table['sector'] = self.groups['sector'].reindex(table.index)
+        table['sector_rank_pct'] = table.groupby('sector')['rs_composite'].rank(pct=True) * 100
+        self.table = table.sort_values('rs_composite', ascending=False, na_position='last')
+        return self.table
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def query(self, n: Optional[int] = None, sector: Optional[str] = None, theater: Optional[str] = None,
+              ascending: bool = False) -> pd.DataFrame:
+        """依綜合 RS 排序的前 N 名 (ascending=True 為最弱)，可限定產業或戰區"""
+        table = self.table
+        if table.empty:
+            return table
+        if sector is not None:
+            table = table[table['sector'] == sector]
+        if theater is not None:
+            # 戰區清單的台股帶 .TW / .TWO 後綴，CB 標的池建表時為裸代號: 兩邊都去掉台股後綴再比對
+            members = _bare_symbols(pd.Index(WAR_THEATERS.get(theater, []), dtype=str))
+            table = table[_bare_symbols(table.index).isin(members)]
+        table = table.sort_values('rs_composite', ascending=ascending, na_position='last')
+        return table.head(n) if n else table
+
+    def sector_split(self, sector: str, threshold: float = 50.0) -> Dict[str, pd.DataFrame]:
+        """族群內以 RS 百分位切分: 領漲者 (> threshold) 與落後者 (<= threshold)"""
+        members = self.query(sector=sector)
+        return {
+            "leaders": members[members['sector_rank_pct'] > threshold],
+            "laggards": members[members['sector_rank_pct'] <= threshold].sort_values('rs_composite'),
+        }
+
+    def sector_summary(self) -> pd.DataFrame:
+        """各族群 RS 中位數、成員數與最強者"""
+        if self.table.empty:
+            return pd.DataFrame()
+        valid = self.table.dropna(subset=['sector', 'rs_composite'])
+        summary = valid.groupby('sector').agg(members=('rs_composite', 'size'), rs_median=('rs_composite', 'median'))
+        summary['top'] = valid.groupby('sector')['rs_composite'].idxmax()
+        return summary.sort_values('rs_median', ascending=False)
+
+    @staticmethod
+    def theater_universe(names: Optional[List[str]] = None) -> Dict[str, str]:
+        """戰區標的池: 代號 → 所屬 (第一個) 戰區，可作為 sectors 傳入以戰區分組"""
+        universe: Dict[str, str] = {}
+        for name in (names or list(WAR_THEATERS.keys())):
+            for ticker in WAR_THEATERS.get(name, []):
+                universe.setdefault(ticker, name)
+        return universe
@@ -0,0 +1,120 @@
+# result_store.py
+# Titan SOP V82.1 - Persistent Backtest Result Store
+# 狀態: 回測結果持久化快取 (重啟、清除 st.cache 後仍有效，多行程共用)
+# 修正重點:
+# 1. [快取鍵] (策略代號, 參數, 使用到的 K 棒資料指紋) 三者雜湊；資料或參數任一改變即自然失效，不靠 TTL。
+# 2. [壓縮權益] 權益曲線以 (日期天數 int32, 數值 float32) 壓縮存放，指標以 JSON 存放。
+# 3. [SQLite] 存於 DB_DIR 的單一 .db 檔 (WAL 模式)，每次存取各自連線，Streamlit 多執行緒 / 多行程皆可安全讀寫。
+
+import hashlib
+import io
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from config import DB_DIR
+from fingerprint import frame_fingerprint
+from typing import Any, Dict, Iterator, Optional
+
+
+def data_fingerprint(bars: pd.DataFrame, columns=('Close',)) -> str:
+    """回測實際使用的 K 棒指紋 (含日期索引)；只取策略用到的欄位，成交量等無關欄位變動不會失效"""
+    if bars is None or bars.empty:
+        return "empty"
+    cols = [c for c in columns if c in bars.columns] or list(bars.columns)
+    return frame_fingerprint(bars[cols].reset_index())
+
+
+def _encode_curves(curves: Dict[str, pd.Series]) -> bytes:
+    arrays = {}
+    for i, (name, series) in enumerate(curves.items()):
+        index = pd.DatetimeIndex(series.index)
+        arrays[f"d{i}"] = index.values.astype('datetime64[D]').astype(np.int32)
+        arrays[f"v{i}"] = series.to_numpy(dtype=np.float32)
+    buf = io.BytesIO()
+    np.savez_compressed(buf, names=np.array(list(curves.keys()), dtype=str), **arrays)
+    return buf.getvalue()
+
+
+def _decode_curves(blob: bytes) -> Dict[str, pd.Series]:
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        names = data['names']
+        return {str(name): pd.Series(data[f"v{i}"].astype(float),
+                                     index=pd.DatetimeIndex(data[f"d{i}"].astype('datetime64[D]')), name=str(name))
+                for i, name in enumerate(names)}
+
+
+class TitanResultStore:
+    """回測結果庫: get / put 以 (strategy_id, params, data_fp) 定位一筆結果"""
+
+    def __init__(self, path: Path = DB_DIR / "backtest_results.db"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY, strategy TEXT, params TEXT, data_fp TEXT,
+                    created TEXT, metrics TEXT, curves BLOB
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_strategy ON results(strategy)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """單次存取的連線: 區塊結束時 commit (例外時 rollback) 並關閉，長駐的結果庫不累積連線與 WAL 檔案控制代碼"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(strategy_id: str, params: Dict[str, Any], data_fp: str) -> str:
+        payload = json.dumps([strategy_id, params, data_fp], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def get(self, strategy_id: str, params: Dict[str, Any], data_fp: str) -> Optional[Dict]:
+        """命中時回傳 {'metrics': ..., 'curves': {名稱: Series}}，否則 None"""
+        key = self.make_key(strategy_id, params, data_fp)
+        with self._connect() as conn:
+            row = conn.execute("SELECT metrics, curves FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"metrics": json.loads(row[0]), "curves": _decode_curves(row[1]) if row[1] else {}}
+
+    def put(self, strategy_id: str, params: Dict[str, Any], data_fp: str, metrics: Any,
+            curves: Optional[Dict[str, pd.Series]] = None):
+        """寫入 (同鍵覆寫)；metrics 需可 JSON 序列化 (numpy 數值自動轉 float)"""
+        key = self.make_key(strategy_id, params, data_fp)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, strategy_id, json.dumps(params, sort_keys=True, ensure_ascii=False, default=str), data_fp,
+                 datetime.now().isoformat(timespec='seconds'),
+                 json.dumps(metrics, ensure_ascii=False, default=float),
+                 _encode_curves(curves) if curves else None),
+            )
+
+    def purge(self, strategy_id: Optional[str] = None, older_than_days: Optional[int] = None) -> int:
+        """刪除指定策略 / 早於 N 天的結果，回傳刪除筆數"""
+        clauses, args = [], []
+        if strategy_id is not None:
+            clauses.append("strategy = ?")
+            args.append(strategy_id)
+        if older_than_days is not None:
+            clauses.append("created < ?")
+            args.append((pd.Timestamp.now() - pd.Timedelta(days=older_than_days)).isoformat(timespec='seconds'))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            return conn.execute(f"DELETE FROM results{where}", args).rowcount
+
+    def summary(self) -> pd.DataFrame:
+        """各策略的結果筆數與最近寫入時間"""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT strategy, COUNT(*) AS results, MAX(created) AS last_run, SUM(LENGTH(curves)) AS curve_bytes "
+                "FROM results GROUP BY strategy", conn)
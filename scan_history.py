@@ -0,0 +1,116 @@
+# scan_history.py
+# Titan SOP V82.1 - Scan Snapshot History
+# 狀態: 每日普查結果持久化 (欄式快照 + 日對日差異)
+# 修正重點:
+# 1. [欄式快照] 每次普查以 np.savez_compressed 存成一份日期快照 (依 CB 代號排序的欄式陣列)。
+# 2. [快速比對] 兩日快照以排序代號對齊 (np.intersect1d)，新進強力買進、掉榜與分數變化皆為陣列運算。
+
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+from config import DATA_DIR
+from typing import Dict, List, Optional
+
+STRONG_BUY = "🔥 強力買進"
+
+
+class TitanScanHistory:
+    """普查快照庫: 一天一份 .npz (同日重跑覆寫)，檔名即日期"""
+
+    TEXT_COLUMNS = ['code', 'name', 'stock_code', 'action']
+    NUMERIC_COLUMNS = ['score', 'price', 'stock_price', 'parity', 'premium', 'converted_ratio']
+
+    def __init__(self, base_dir: Path = DATA_DIR / "scan_history"):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, date: str) -> Path:
+        return self.base_dir / f"scan_{date}.npz"
+
+    def save(self, results: pd.DataFrame, date: Optional[str] = None) -> Optional[Path]:
+        """將一次普查結果存為當日快照，回傳檔案路徑"""
+        if results is None or results.empty or 'code' not in results.columns:
+            return None
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        frame = results.drop_duplicates(subset='code', keep='first')
+        order = np.argsort(frame['code'].astype(str).to_numpy(), kind='stable')
+
+        arrays = {}
+        for col in self.TEXT_COLUMNS:
+            values = frame[col] if col in frame.columns else pd.Series('', index=frame.index)
+            arrays[col] = values.fillna('').astype(str).to_numpy()[order].astype(str)
+        for col in self.NUMERIC_COLUMNS:
+            values = frame[col] if col in frame.columns else pd.Series(np.nan, index=frame.index)
+            arrays[col] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)[order]
+
+        path = self._path(date)
+        np.savez_compressed(path, **arrays)
+        return path
+
+    def dates(self) -> List[str]:
+        """所有快照日期 (由舊到新)"""
+        return sorted(p.stem.replace("scan_", "") for p in self.base_dir.glob("scan_*.npz"))
+
+    def load(self, date: str) -> Dict[str, np.ndarray]:
+        with np.load(self._path(date), allow_pickle=False) as data:
+            return {k: data[k] for k in data.files}
+
+    def load_frame(self, date: str) -> pd.DataFrame:
+        return pd.DataFrame(self.load(date))
+
+    def previous_date(self, date: str) -> Optional[str]:
+        earlier = [d for d in self.dates() if d < date]
+        return earlier[-1] if earlier else None
+
+    def diff(self, new_date: Optional[str] = None, old_date: Optional[str] = None, action: str = STRONG_BUY) -> Dict:
+        """
+        兩日快照差異 (預設: 最新一份 vs 前一份)
+        - new_entries: 新進 action 名單 (前日不在名單或不存在)
+        - dropouts: 掉出 action 名單 (今日不在名單或已下市)
+        - score_delta: 兩日都存在的 CB 之分數/價格變化 (依變化幅度排序)
+        - listed / delisted: 新增與消失的 CB 代號
+        """
+        dates = self.dates()
+        if not dates:
+            return {}
+        new_date = new_date or dates[-1]
+        old_date = old_date or self.previous_date(new_date)
+        if old_date is None:
+            return {}
+
+        new, old = self.load(new_date), self.load(old_date)
+        common, i_new, i_old = np.intersect1d(new['code'], old['code'], assume_unique=True, return_indices=True)
+
+        # 以新快照的位置對齊舊快照的 action (不存在者視為空字串)
+        old_action_on_new = np.full(len(new['code']), '', dtype=object)
+        old_action_on_new[i_new] = old['action'][i_old]
+        new_action_on_old = np.full(len(old['code']), '', dtype=object)
+        new_action_on_old[i_old] = new['action'][i_new]
+
+        entry_mask = (new['action'] == action) & (old_action_on_new != action)
+        drop_mask = (old['action'] == action) & (new_action_on_old != action)
+
+        score_delta = pd.DataFrame({
+            "code": common,
+            "name": new['name'][i_new],
+            "score_old": old['score'][i_old],
+            "score_new": new['score'][i_new],
+            "score_delta": new['score'][i_new] - old['score'][i_old],
+            "price_old": old['price'][i_old],
+            "price_new": new['price'][i_new],
+            "action_old": old['action'][i_old],
+            "action_new": new['action'][i_new],
+        })
+        score_delta = score_delta.iloc[np.argsort(-np.abs(score_delta['score_delta'].to_numpy()), kind='stable')]
+
+        return {
+            "new_date": new_date,
+            "old_date": old_date,
+            "new_entries": pd.DataFrame({k: new[k][entry_mask] for k in ['code', 'name', 'score', 'price']}),
+            "dropouts": pd.DataFrame({k: old[k][drop_mask] for k in ['code', 'name', 'score', 'price']}).assign(
+                action_new=new_action_on_old[drop_mask]),
+            "score_delta": score_delta.reset_index(drop=True),
+            "listed": np.setdiff1d(new['code'], old['code'], assume_unique=True),
+            "delisted": np.setdiff1d(old['code'], new['code'], assume_unique=True),
+        }
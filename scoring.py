@@ -0,0 +1,196 @@
+# scoring.py
+# Titan SOP V82.1 - Scoring Profile Compiler
+# 狀態: 評分規則資料化 (四大天條權重、加減分、操作門檻皆以設定檔描述)
+# 修正重點:
+# 1. [規則即資料] 評分設定檔 (profile) 以 dict 描述條件、權重、門檻，不必修改掃描程式碼。
+# 2. [一次編譯] 條件編譯為 NumPy 運算式，多個設定檔共用同一份條件矩陣。
+# 3. [並排比較] 多個設定檔在同一份 enriched 資料上一次算完 (條件矩陣 × 權重矩陣)。
+
+import json
+import operator
+import numpy as np
+import pandas as pd
+from config import Config
+from typing import Callable, Dict, List, Optional, Tuple
+
+# --- 條件運算子 ---
+_OPS = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+    "==": operator.eq, "!=": operator.ne,
+}
+
+# ==========================================
+# 預設設定檔：SOP 四大天條 (與原 scan_entire_portfolio 寫死的規則一致)
+# ==========================================
+SOP_DEFAULT_PROFILE = {
+    "name": "SOP 四大天條",
+    "conditions": {
+        "price_ok": {"col": "price", "op": "<", "value": Config.FILTER_MAX_PRICE},
+        "magic_ma_ok": {"all": [
+            {"col": "stock_price", "op": ">", "ref": "MA87"},
+            {"col": "MA87", "op": ">", "ref": "MA284"},
+            {"col": "MA284", "op": ">", "value": 0},
+        ]},
+        "identity_ok": "identity_ok",
+        "story_ok": "story_ok",
+        "breakout": "is_recent_breakout",
+        "honeymoon": "is_honeymoon",
+        "put_rally": "is_put_rally",
+        "high_premium": {"col": "premium", "op": ">", "value": 20},
+        "chips_loose": {"col": "converted_ratio", "op": ">", "value": 30},
+        "illiquid": {"col": "avg_volume", "op": "<", "value": 10},
+    },
+    "weights": {
+        # 核心四大天條
+        "price_ok": 20, "magic_ma_ok": 40, "identity_ok": 10, "story_ok": 10,
+        # 加分項
+        "breakout": 5, "honeymoon": 5, "put_rally": 5,
+        # 風險扣分項
+        "high_premium": -10, "chips_loose": -20, "illiquid": -15,
+    },
+    "clip": [0, 100],
+    "actions": [
+        {"label": "🔥 強力買進", "min_score": 80, "require": ["price_ok", "magic_ma_ok"]},
+        {"label": "✅ 買進/觀察", "min_score": 60, "require": ["price_ok", "magic_ma_ok"]},
+    ],
+    "default_action": "-",
+}
+
+
+def _spec_key(spec) -> str:
+    """條件規格的標準化鍵值 (相同條件只計算一次)"""
+    return json.dumps(spec, sort_keys=True, ensure_ascii=False)
+
+
+def compile_condition(spec) -> Callable[[pd.DataFrame], np.ndarray]:
+    """
+    將條件規格編譯為「DataFrame → bool ndarray」的函式。
+    支援格式:
+    - "欄位名": 直接取布林欄位
+    - {"col": 欄位, "op": 運算子, "value": 常數} 或 {"col", "op", "ref": 另一欄位}
+    - {"col": 欄位, "between": [低, 高]} (含頭尾)
+    - {"all": [...]} / {"any": [...]} / {"not": 規格}
+    """
+    if isinstance(spec, str):
+        return lambda frame: frame[spec].fillna(False).to_numpy(dtype=bool)
+
+    if "all" in spec or "any" in spec:
+        parts = [compile_condition(s) for s in spec.get("all", spec.get("any"))]
+        reducer = np.logical_and.reduce if "all" in spec else np.logical_or.reduce
+        return lambda frame: reducer([p(frame) for p in parts])
+
+    if "not" in spec:
+        inner = compile_condition(spec["not"])
+        return lambda frame: ~inner(frame)
+
+    col = spec["col"]
+    if "between" in spec:
+        lo, hi = spec["between"]
+
+        def _between(frame):
+            v = _numeric(frame, col)
+            return (v >= lo) & (v <= hi)
+        return _between
+
+    op = _OPS[spec["op"]]
+    if "ref" in spec:
+        ref = spec["ref"]
+        return lambda frame: op(_numeric(frame, col), _numeric(frame, ref))
+    value = spec["value"]
+    return lambda frame: op(_numeric(frame, col), value)
+
+
+def _numeric(frame: pd.DataFrame, col: str) -> np.ndarray:
+    """取數值欄位 (缺欄或無法轉換一律視為 NaN，比較結果為 False)"""
+    if col not in frame.columns:
+        return np.full(len(frame), np.nan)
+    return pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=float)
+
+
+class TitanScoringEngine:
+    """
+    評分設定檔編譯器
+    所有設定檔的條件合併為一張條件矩陣 C (列數 × 條件數)，
+    權重矩陣 W (條件數 × 設定檔數)，分數 = C @ W 一次求出。
+    """
+
+    def __init__(self, profiles: Optional[List[Dict]] = None):
+        self.profiles: Dict[str, Dict] = {}
+        self._conditions: Dict[str, Callable] = {}
+        for profile in (profiles or [SOP_DEFAULT_PROFILE]):
+            self.register(profile)
+
+    @property
+    def default_profile(self) -> str:
+        return next(iter(self.profiles))
+
+    def register(self, profile: Dict):
+        """註冊 (或覆寫) 一個設定檔，條件於此時編譯並以規格去重"""
+        local_keys = {}
+        for name, spec in profile["conditions"].items():
+            key = _spec_key(spec)
+            if key not in self._conditions:
+                self._conditions[key] = compile_condition(spec)
+            local_keys[name] = key
+
+        unknown = set(profile["weights"]) - set(local_keys)
+        for action in profile.get("actions", []):
+            unknown |= set(action.get("require", [])) - set(local_keys)
+        if unknown:
+            raise ValueError(f"設定檔 {profile['name']} 引用未定義的條件: {sorted(unknown)}")
+
+        self.profiles[profile["name"]] = {**profile, "_keys": local_keys}
+
+    def _condition_matrix(self, frame: pd.DataFrame, keys: List[str]) -> np.ndarray:
+        if not keys:
+            return np.zeros((len(frame), 0), dtype=bool)
+        return np.column_stack([self._conditions[k](frame) for k in keys])
+
+    def evaluate(self, frame: pd.DataFrame, names: Optional[List[str]] = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """在同一份資料上一次評估多個設定檔，回傳 {名稱: (score, action)}"""
+        names = names or list(self.profiles)
+        profiles = [self.profiles[n] for n in names]
+
+        keys = list(dict.fromkeys(k for p in profiles for k in p["_keys"].values()))
+        col_of = {k: i for i, k in enumerate(keys)}
+        cond = self._condition_matrix(frame, keys)
+
+        weights = np.zeros((len(keys), len(profiles)), dtype=float)
+        for j, p in enumerate(profiles):
+            for name, w in p["weights"].items():
+                weights[col_of[p["_keys"][name]], j] += w
+        scores = cond.astype(float) @ weights
+
+        results = {}
+        for j, p in enumerate(profiles):
+            score = scores[:, j]
+            if p.get("clip"):
+                score = np.clip(score, *p["clip"])
+            score = score.astype(int)
+
+            conditions, choices = [], []
+            for action in p.get("actions", []):
+                mask = score >= action.get("min_score", -np.inf)
+                for req in action.get("require", []):
+                    mask = mask & cond[:, col_of[p["_keys"][req]]]
+                conditions.append(mask)
+                choices.append(action["label"])
+            default = p.get("default_action", "-")
+            action_arr = np.select(conditions, choices, default=default) if conditions else np.full(len(frame), default)
+            results[p["name"]] = (score, action_arr)
+        return results
+
+    def score(self, frame: pd.DataFrame, name: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """以單一設定檔評分 (預設為第一個註冊的設定檔)"""
+        name = name or self.default_profile
+        return self.evaluate(frame, [name])[name]
+
+    def compare(self, frame: pd.DataFrame, names: Optional[List[str]] = None, key_col: str = 'code') -> pd.DataFrame:
+        """多設定檔並排比較表: 每個設定檔一組 score/action 欄位"""
+        out = pd.DataFrame(index=frame.index)
+        if key_col in frame.columns:
+            out[key_col] = frame[key_col]
+        for name, (score, action) in self.evaluate(frame, names).items():
+            out[f"score[{name}]"] = score
+            out[f"action[{name}]"] = action
+        return out
@@ -1,19 +1,36 @@
 # strategy.py
 # Titan SOP V71.0 - Core Strategy Engine (Audited)
 # [V71.0 Audit]: No logic changes required. _get_granville_status will be called by the new Window 14 UI. Version bumped.
+# [V82.1]: 評分改由 scoring.py 設定檔驅動；新增 scan_incremental (逐列/K 棒指紋增量掃描)。
+# [V82.1]: 掃描時以 cb_pricing.py 批次二元樹計算理論價值與評價落差 (valuation_gap)。
+# [V82.1]: 族群身份改為全市場分組判定 (kb.assign_sector_roles)，風口豬判定終於有同族群比價資料。
 
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from config import Config
 from knowledge_base import TitanKnowledgeBase
 from execution import CalendarAgent
+from scoring import TitanScoringEngine
+from fingerprint import row_fingerprints, bar_fingerprint, config_fingerprint
+from price_panel import TitanPricePanel
+from cb_pricing import TitanCBPricer
+from macro_risk import STOCK_METADATA
 from datetime import datetime, timedelta
 
 class TitanStrategyEngine:
+    TECH_COLUMNS = ['stock_price', 'MA87', 'MA284', 'is_recent_breakout', 'is_making_high', 'volatility']
+
     def __init__(self):
         self.kb = TitanKnowledgeBase()
         self.calendar = CalendarAgent()
+        self.scoring = TitanScoringEngine()
+        self.price_panel = TitanPricePanel()
+        self.pricer = TitanCBPricer()
+        self.industry_map = {k.split('.')[0]: v['industry'] for k, v in STOCK_METADATA.items()}
+        self.last_enriched = pd.DataFrame()
+        self.last_scan_stats = {}
+        self._last_tech = pd.DataFrame()
+        self._scan_state = None
 
     def _get_granville_status(self, price, ma87, is_recent_breakout, bias_percent):
         """格蘭碧八大法則狀態判讀"""
@@ -135,23 +152,20 @@ class TitanStrategyEngine:
 
         return report
 
-    def _batch_enrich_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        work_df = df.copy()
-        stock_codes = work_df['stock_code'].dropna().unique()
-        tickers = [f"{code}.TW" for code in stock_codes]
-        
+    def _fetch_tech_data(self, stock_codes, period: str = "2y") -> pd.DataFrame:
+        """批次下載並計算技術指標，以 stock_code 為索引 (附最後一根 K 棒指紋供增量掃描比對)"""
         tech_data = {}
-        if not tickers:
-            for col in ['stock_price', 'MA87', 'MA284', 'is_recent_breakout', 'is_making_high']:
-                work_df[col] = 0 if 'price' in col or 'MA' in col else False
-            return work_df
+        if len(stock_codes) == 0:
+            return pd.DataFrame(columns=self.TECH_COLUMNS + ['bar_fp'])
 
-        data = yf.download(tickers, period="2y", group_by='ticker', progress=False, threads=True)
+        # 經由共用行情面板下載 (.TW 優先，缺漏者批次補抓 .TWO)，普查等模組可直接重用
+        frames = self.price_panel.fetch(stock_codes, period=period, refresh=True)
         
-        for ticker in tickers:
-            stock_code = ticker.split('.')[0]
+        for stock_code in map(str, stock_codes):
+            stock_df = frames.get(stock_code, pd.DataFrame())
+            tech_data[stock_code] = {col: np.nan for col in self.TECH_COLUMNS}
+            tech_data[stock_code]["bar_fp"] = bar_fingerprint(stock_df)
             try:
-                stock_df = data[ticker] if len(tickers) > 1 else data
                 if not stock_df.empty and len(stock_df) >= Config.MA_LONG_TERM:
                     close = stock_df['Close']
                     high = stock_df['High']
@@ -160,29 +174,37 @@ class TitanStrategyEngine:
                     
                     is_recent_breakout = (close.iloc[-1] > ma87) and (close.iloc[-5] < ma87)
                     is_making_high = close.iloc[-1] >= high.iloc[-3:].max()
+                    # 近一年年化波動率 (CB 二元樹定價用)
+                    volatility = np.log(close).diff().iloc[-252:].std() * np.sqrt(252)
 
                     if not np.isnan(ma87) and not np.isnan(ma284):
-                        tech_data[stock_code] = {
+                        tech_data[stock_code].update({
                             "stock_price": close.iloc[-1], 
                             "MA87": ma87, 
                             "MA284": ma284,
                             "is_recent_breakout": is_recent_breakout,
-                            "is_making_high": is_making_high
-                        }
+                            "is_making_high": is_making_high,
+                            "volatility": volatility
+                        })
             except (KeyError, IndexError):
                 continue
-        
-        tech_df = pd.DataFrame.from_dict(tech_data, orient='index').reset_index().rename(columns={'index': 'stock_code'})
-        work_df = work_df.merge(tech_df, on='stock_code', how='left')
-        
-        for col in ['stock_price', 'MA87', 'MA284', 'is_recent_breakout', 'is_making_high']:
-            if col not in work_df.columns: 
-                work_df[col] = 0 if 'MA' in col or 'price' in col else False
-            else: 
-                work_df[col].fillna(0 if 'MA' in col or 'price' in col else False, inplace=True)
-                
+
+        return pd.DataFrame.from_dict(tech_data, orient='index', columns=self.TECH_COLUMNS + ['bar_fp'])
+
+    def _merge_tech(self, df: pd.DataFrame, tech_df: pd.DataFrame) -> pd.DataFrame:
+        """將技術指標併回 CB 清單，缺值補 0 / False (波動率補 0 代表交由定價器使用預設值)"""
+        tech_df = tech_df[self.TECH_COLUMNS].rename_axis('stock_code').reset_index()
+        work_df = df.drop(columns=self.TECH_COLUMNS, errors='ignore').merge(tech_df, on='stock_code', how='left')
+        for col in self.TECH_COLUMNS:
+            work_df[col] = work_df[col].fillna(False if col.startswith('is_') else 0)
         return work_df
 
+    def _batch_enrich_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        work_df = df.copy()
+        stock_codes = work_df['stock_code'].dropna().unique()
+        self._last_tech = self._fetch_tech_data(stock_codes)
+        return self._merge_tech(work_df, self._last_tech)
+
     def _calculate_risk_metrics(self, df: pd.DataFrame) -> pd.DataFrame:
         """[V64.0] 向量化計算理論價、溢價率、轉換率"""
         work_df = df.copy()
@@ -218,78 +240,169 @@ class TitanStrategyEngine:
 
         return work_df
 
-    def scan_entire_portfolio(self, df: pd.DataFrame) -> pd.DataFrame:
-        if df.empty or 'code' not in df.columns or 'name' not in df.columns or 'stock_code' not in df.columns:
+    def compare_scoring_profiles(self, names=None, enriched: pd.DataFrame = None) -> pd.DataFrame:
+        """以最近一次掃描的 enriched 資料並排評估多個評分設定檔 (不重新下載或計算指標)"""
+        frame = self.last_enriched if enriched is None else enriched
+        if frame.empty:
             return pd.DataFrame()
+        table = self.scoring.compare(frame, names)
+        table.insert(1, 'name', frame['name'])
+        return table
 
-        # --- 確保數值與基礎資料 ---
+    def _prepare_scan_input(self, df: pd.DataFrame) -> pd.DataFrame:
+        """確保數值與基礎資料"""
         work_df = df.copy()
         work_df['avg_volume'] = pd.to_numeric(work_df.get('avg_volume', 0), errors='coerce').fillna(0)
         work_df['price'] = pd.to_numeric(work_df['close'], errors='coerce').fillna(0)
-        
-        # --- 1. 技術指標 & 風險指標計算 ---
-        work_df = self._batch_enrich_data(work_df)
+        return work_df
+
+    def _assign_roles(self, work_df: pd.DataFrame) -> pd.DataFrame:
+        """全市場族群身份 (sector / sector_leader_price / role)，需以完整清單計算才有同族群比價"""
+        return self.kb.assign_sector_roles(work_df, self.industry_map)
+
+    def _score_enriched(self, work_df: pd.DataFrame, roles: pd.DataFrame = None) -> pd.DataFrame:
+        """已併入技術指標的資料 → 風險指標、質化資訊、時間套利與評分 (roles 依列位置對齊，省略時以 work_df 本身分組)"""
         work_df = self._calculate_risk_metrics(work_df)
+        work_df = self.pricer.price_frame(work_df)
 
         # --- 2. 全市場賦予質化資訊 ---
-        work_df['role'] = work_df.apply(lambda row: self.kb.analyze_sector_role(str(row['name']), str(row['code']), "Auto", row['price'], []), axis=1)
+        roles = self._assign_roles(work_df) if roles is None else roles
+        for col in roles.columns:
+            work_df[col] = roles[col].to_numpy()
         work_df['story'] = work_df['stock_code'].apply(lambda x: self.kb.get_story(str(x)))
-        work_df['events'] = work_df.apply(lambda row: self.calendar.calculate_time_traps(str(row['code']), str(row.get('list_date', '')), str(row.get('put_date', ''))), axis=1)
-
-        # --- 3. 全市場評分 ---
-        work_df['score'] = 0
-        
-        # 條件檢核
-        price_ok = work_df['price'] < Config.FILTER_MAX_PRICE
-        magic_ma_ok = (work_df['stock_price'] > work_df['MA87']) & (work_df['MA87'] > work_df['MA284']) & (work_df['MA284'] > 0)
-        identity_ok = work_df['role'].apply(lambda x: x.get('role') in ["👑 領頭羊 (Leader)", "🔥 風口豬 (Laggard)"])
+        traps = self.calendar.calculate_time_traps_batch(
+            work_df['list_date'] if 'list_date' in work_df.columns else [None] * len(work_df),
+            work_df['put_date'] if 'put_date' in work_df.columns else [None] * len(work_df)
+        )
+        work_df['events'] = self.calendar.expand_time_traps(traps)
+
+        # --- 3. 全市場評分 (設定檔編譯為向量化運算式) ---
+        work_df['identity_ok'] = work_df['role'].apply(lambda x: x.get('role') in ["👑 領頭羊 (Leader)", "🔥 風口豬 (Laggard)"])
         story_regex = '|'.join(Config.STORY_KEYWORDS)
-        story_ok = work_df['story'].str.contains(story_regex, case=False, na=False)
-        
-        # 核心四大天條計分
-        work_df['score'] += np.where(price_ok, 20, 0)
-        work_df['score'] += np.where(magic_ma_ok, 40, 0)
-        work_df['score'] += np.where(identity_ok, 10, 0)
-        work_df['score'] += np.where(story_ok, 10, 0)
-        
-        # 加分項
-        work_df['score'] += np.where(work_df['is_recent_breakout'], 5, 0)
-        
-        now = datetime.now()
-        def check_events(events):
-            is_honeymoon = any("蜜月期" in e['event'] and pd.to_datetime(e['date']).date() >= now.date() for e in events)
-            is_put_rally = any("避稅" in e['event'] and pd.to_datetime(e['date']).date() >= now.date() for e in events)
-            return is_honeymoon, is_put_rally
-
-        event_scores = work_df['events'].apply(check_events)
-        work_df['score'] += np.where(event_scores.apply(lambda x: x[0]), 5, 0)
-        work_df['score'] += np.where(event_scores.apply(lambda x: x[1]), 5, 0)
-
-        # [V64.0] 風險扣分項
-        work_df['score'] -= np.where(work_df['premium'] > 20, 10, 0)
-        work_df['score'] -= np.where(work_df['converted_ratio'] > 30, 20, 0)
-        work_df['score'] -= np.where(work_df['avg_volume'] < 10, 15, 0)
-
-        work_df['score'] = work_df['score'].clip(0, 100)
-
-        # --- 4. 根據分數與核心條件決定操作建議 ---
-        action_conditions = [
-            (price_ok & magic_ma_ok & (work_df['score'] >= 80)),
-            (price_ok & magic_ma_ok & (work_df['score'] >= 60))
-        ]
-        action_choices = ['🔥 強力買進', '✅ 買進/觀察']
-        work_df['action'] = np.select(action_conditions, action_choices, default='-')
-        
-        # --- 5. 生成報告並回傳完整結果 ---
-        results_df = work_df.sort_values(by='score', ascending=False).reset_index(drop=True)
-        results_df['full_report'] = results_df.apply(self._generate_single_report, axis=1)
+        work_df['story_ok'] = work_df['story'].str.contains(story_regex, case=False, na=False)
+
+        # 時間套利加分 (欄式日期直接比較，NaT 一律為 False)
+        today = np.datetime64(datetime.now().date(), 'D')
+        work_df['is_honeymoon'] = traps['honeymoon_end'] >= today
+        work_df['is_put_rally'] = traps['tax_rally_start'] >= today
+
+        # --- 4. 根據設定檔的分數與核心條件決定操作建議 ---
+        work_df['score'], work_df['action'] = self.scoring.score(work_df)
+        return work_df
+
+    def _build_results(self, work_df: pd.DataFrame, input_columns) -> pd.DataFrame:
+        """生成報告並回傳完整結果"""
+        results_df = work_df.sort_values(by='score', ascending=False, kind='stable').reset_index(drop=True)
+        results_df['full_report'] = results_df.apply(self._generate_single_report, axis=1) if not results_df.empty else []
         
         # 確保所有需要的欄位都存在
-        final_cols = list(df.columns) + [
+        final_cols = list(input_columns) + [
             'price', 'stock_price', 'score', 'action', 'full_report', 
-            'parity', 'premium', 'converted_ratio', 'avg_volume'
+            'parity', 'premium', 'converted_ratio', 'avg_volume',
+            'fair_value', 'bond_floor', 'cb_delta', 'valuation_gap'
         ]
         # 去除重複欄位
         final_cols = list(dict.fromkeys(final_cols))
         
-        return results_df.reindex(columns=final_cols).fillna({'full_report': '報告生成失敗'})
\ No newline at end of file
+        return results_df.reindex(columns=final_cols).fillna({'full_report': '報告生成失敗'})
+
+    def _scan_signature(self, df: pd.DataFrame) -> tuple:
+        """增量掃描的前提: 同一天、同一組欄位、同一份評分設定 (設定檔內容 + Config 常數指紋，原地修改權重亦會失效)"""
+        profile = self.scoring.profiles[self.scoring.default_profile]
+        return (datetime.now().date(), tuple(sorted(map(str, df.columns))), config_fingerprint(profile))
+
+    def _remember_scan(self, df: pd.DataFrame, enriched: pd.DataFrame, results: pd.DataFrame, tech: pd.DataFrame):
+        codes = df['code'].astype(str)
+        if codes.duplicated().any():
+            self._scan_state = None
+            return
+        row_fp = row_fingerprints(df)
+        row_fp.index = codes.to_numpy()
+        self._scan_state = {
+            "signature": self._scan_signature(df),
+            "row_fp": row_fp,
+            "tech": tech,
+            "enriched": enriched.set_index(enriched['code'].astype(str).to_numpy()),
+            "results": results.set_index(results['code'].astype(str).to_numpy()),
+        }
+
+    def _fetch_last_bar_fingerprints(self, stock_codes) -> pd.Series:
+        """輕量下載近 5 日行情，只取最後一根 K 棒指紋"""
+        frames = self.price_panel.fetch(stock_codes, period="5d", refresh=True)
+        return pd.Series({str(c): bar_fingerprint(frames.get(str(c))) for c in stock_codes}, dtype=object)
+
+    def scan_entire_portfolio(self, df: pd.DataFrame) -> pd.DataFrame:
+        if df.empty or 'code' not in df.columns or 'name' not in df.columns or 'stock_code' not in df.columns:
+            return pd.DataFrame()
+
+        work_df = self._prepare_scan_input(df)
+        
+        # --- 1. 技術指標 & 風險指標計算 ---
+        work_df = self._batch_enrich_data(work_df)
+        work_df = self._score_enriched(work_df)
+        self.last_enriched = work_df
+        
+        # --- 5. 生成報告並回傳完整結果 ---
+        results_df = self._build_results(work_df, df.columns)
+        self._remember_scan(df, work_df, results_df, self._last_tech)
+        self.last_scan_stats = {"rows": len(df), "rescored": len(df), "refetched": len(self._last_tech)}
+        return results_df
+
+    def scan_incremental(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        [增量掃描] 以逐列指紋與標的最後一根 K 棒指紋比對上一次掃描：
+        只有內容異動、新增或標的出現新 K 棒的 CB 列會重新計算與評分，其餘沿用上次結果。
+        族群身份以完整清單重新分組 (純本地運算)，身份或領頭羊價格改變的同族群 CB 也一併重新評分。
+        換日、欄位組成或評分設定檔改變時自動退回全量掃描。
+        """
+        state = self._scan_state
+        if (state is None or df.empty or 'code' not in df.columns or 'stock_code' not in df.columns
+                or state["signature"] != self._scan_signature(df) or df['code'].astype(str).duplicated().any()):
+            return self.scan_entire_portfolio(df)
+
+        codes = pd.Index(df['code'].astype(str).to_numpy())
+        row_fp = row_fingerprints(df)
+        row_fp.index = codes
+
+        # --- 1. 標的行情: 最後一根 K 棒有變化者才重新下載完整歷史 ---
+        stock_codes = df['stock_code'].dropna().unique()
+        tech = state["tech"]
+        latest_fp = self._fetch_last_bar_fingerprints(stock_codes)
+        known_fp = tech['bar_fp'].reindex(stock_codes)
+        changed_stocks = [c for c in stock_codes if c not in tech.index or latest_fp.get(c, "") != known_fp[c]]
+        if changed_stocks:
+            tech = pd.concat([tech.drop(index=changed_stocks, errors='ignore'), self._fetch_tech_data(changed_stocks)])
+
+        # --- 2. CB 列: 新增 / 內容異動 / 標的有新行情 ---
+        prev_fp = state["row_fp"]
+        dirty = ~codes.isin(prev_fp.index)
+        known = ~dirty
+        dirty[known] = prev_fp.loc[codes[known]].to_numpy() != row_fp.to_numpy()[known]
+        dirty |= df['stock_code'].isin(changed_stocks).to_numpy()
+
+        # --- 3. 同族群連動: 任一成員價格異動或進出清單都可能改變其他成員的身份 ---
+        roles = self._assign_roles(self._prepare_scan_input(df))
+        prev = state["enriched"].reindex(codes)
+        prev_role = prev['role'].map(lambda r: r.get('role') if isinstance(r, dict) else None).to_numpy()
+        new_role = roles['role'].map(lambda r: r['role']).to_numpy()
+        prev_top = pd.to_numeric(prev['sector_leader_price'], errors='coerce').to_numpy()
+        new_top = pd.to_numeric(roles['sector_leader_price'], errors='coerce').to_numpy()
+        same_top = (prev_top == new_top) | (np.isnan(prev_top) & np.isnan(new_top))
+        dirty |= (prev_role != new_role) | ~same_top
+        clean_codes = codes[~dirty]
+
+        enriched_parts = [state["enriched"].loc[clean_codes]]
+        result_parts = [state["results"].loc[clean_codes]]
+        if dirty.any():
+            work_df = self._merge_tech(self._prepare_scan_input(df[dirty]), tech)
+            work_df = self._score_enriched(work_df, roles[dirty])
+            enriched_parts.append(work_df)
+            result_parts.append(self._build_results(work_df, df.columns))
+
+        enriched = pd.concat(enriched_parts, ignore_index=True)
+        results_df = (pd.concat(result_parts, ignore_index=True)
+                      .sort_values(by='score', ascending=False, kind='stable').reset_index(drop=True))
+        self.last_enriched = enriched
+        self._remember_scan(df, enriched, results_df, tech)
+        self.last_scan_stats = {"rows": len(df), "rescored": int(dirty.sum()), "refetched": len(changed_stocks)}
+        return results_df
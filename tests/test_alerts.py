@@ -0,0 +1,74 @@
+# tests/test_alerts.py
+# 警示引擎: 以收盤底稿 prime 建立基準後，回放期間新成立的條件必須送出
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alerts import MemoryAlertSink, TitanAlertEngine  # noqa: E402
+
+
+def _baseline(n: int = 80) -> pd.DataFrame:
+    # 每檔皆觸發 ma87_break / death_cross / high_premium，足以用光每分鐘 60 則的額度
+    return pd.DataFrame({
+        "code": [f"C{i:03d}" for i in range(n)], "name": [f"cb{i}" for i in range(n)],
+        "stock_code": [f"{1000 + i}" for i in range(n)], "price": 120.0,
+        "stock_price": 40.0, "MA87": 45.0, "MA284": 50.0, "converted_ratio": 5.0, "premium": 25.0,
+    })
+
+
+def test_prime_does_not_emit_or_consume_limits():
+    sink = MemoryAlertSink()
+    engine = TitanAlertEngine(sinks=[sink])
+    assert engine.on_snapshot(_baseline(), prime=True) == []
+    assert len(sink) == 0 and engine.suppressed == 0
+    assert len(engine.active()) == 80 * 3
+
+
+def test_real_crossing_after_prime_is_delivered():
+    sink = MemoryAlertSink()
+    engine = TitanAlertEngine(sinks=[sink])
+    engine.on_snapshot(_baseline(), prime=True)
+
+    # 盤中: C000 標的站上 87MA 且 CB 跌入甜蜜點 → sweet_spot_entry 由否轉是
+    alerts = engine.on_event({"code": "C000", "ts": "2024-01-02 09:05:00", "stock_price": 46.0, "price": 108.0})
+    assert [(a["rule"], a["key"]) for a in alerts] == [("sweet_spot_entry", "C000")]
+    assert len(sink) == 1 and engine.suppressed == 0
+
+
+def test_baseline_rule_reentry_is_not_on_cooldown():
+    engine = TitanAlertEngine()
+    engine.on_snapshot(_baseline(), prime=True)
+    engine.on_event({"code": "C001", "premium": 10.0})
+    alerts = engine.on_event({"code": "C001", "premium": 22.0})
+    assert [(a["rule"], a["key"]) for a in alerts] == [("high_premium", "C001")]
+
+
+def test_cooldown_follows_event_time_not_wall_clock():
+    engine = TitanAlertEngine(cooldown=3600)
+    engine.on_snapshot(_baseline(3), prime=True)
+
+    def cross(premium, ts):
+        return engine.on_event({"code": "C000", "ts": ts, "premium": premium})
+
+    cross(10.0, "2024-01-02 09:00:00")
+    assert len(cross(22.0, "2024-01-02 09:01:00")) == 1
+    cross(10.0, "2024-01-02 09:30:00")
+    assert cross(22.0, "2024-01-02 09:31:00") == [] and engine.suppressed == 1   # 冷卻中 (事件時間僅過 30 分)
+    cross(10.0, "2024-01-02 10:30:00")
+    assert len(cross(22.0, "2024-01-02 10:31:00")) == 1                          # 事件時間已過 1 小時
+
+
+def test_sink_failure_is_logged(caplog):
+    def broken(alert):
+        raise RuntimeError("down")
+
+    engine = TitanAlertEngine(sinks=[broken])
+    engine.on_snapshot(_baseline(1), prime=True)
+    with caplog.at_level("WARNING", logger="alerts"):
+        alerts = engine.on_event({"code": "C000", "premium": 10.0})
+        alerts = engine.on_event({"code": "C000", "premium": 22.0})
+    assert len(alerts) == 1 and "down" in caplog.text
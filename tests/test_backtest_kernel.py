@@ -0,0 +1,78 @@
+# tests/test_backtest_kernel.py
+# 向量化狀態機 hysteresis_position / extract_trades 與逐根 K 棒參考迴圈一致 (含進出場同根觸發)
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtest import extract_trades, hysteresis_position  # noqa: E402
+
+
+def _reference_position(entry, exit, initial=0):
+    state, out = initial, []
+    for e, x in zip(entry, exit):
+        if e and not x:
+            state = 1
+        elif x and not e:
+            state = 0
+        elif e and x:
+            state = 1 - state
+        out.append(state)
+    return np.array(out, dtype=np.int8)
+
+
+def _reference_trades(position, prices, include_open=False):
+    trades, entry_i = [], None
+    for t, held in enumerate(position):
+        if held and entry_i is None:
+            entry_i = t
+        elif not held and entry_i is not None:
+            trades.append((entry_i, t, False))
+            entry_i = None
+    if entry_i is not None and include_open:
+        trades.append((entry_i, len(position) - 1, True))
+    return [(a, b, prices[a], prices[b], prices[b] / prices[a] - 1, o) for a, b, o in trades]
+
+
+def test_same_bar_entry_and_exit_flips_state():
+    entry = np.array([1, 0, 1, 1, 0, 1, 0], dtype=bool)
+    exit = np.array([0, 0, 1, 1, 1, 1, 0], dtype=bool)
+    np.testing.assert_array_equal(hysteresis_position(entry, exit), [1, 1, 0, 1, 0, 1, 1])
+    np.testing.assert_array_equal(hysteresis_position(entry, exit, initial=1),
+                                  _reference_position(entry, exit, initial=1))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_hysteresis_matches_reference_loop(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 80))
+    entry, exit = rng.random((n, 4)) < rng.random(), rng.random((n, 4)) < rng.random()
+    initial = int(rng.integers(0, 2))
+    got = hysteresis_position(entry, exit, initial)
+    expected = np.column_stack([_reference_position(entry[:, k], exit[:, k], initial) for k in range(4)])
+    np.testing.assert_array_equal(got, expected)
+    np.testing.assert_array_equal(hysteresis_position(entry[:, 0], exit[:, 0], initial), expected[:, 0])
+
+
+@pytest.mark.parametrize("include_open", [False, True])
+def test_extract_trades_matches_reference_loop(include_open):
+    rng = np.random.default_rng(7)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (120, 3)), axis=0))
+    position = hysteresis_position(rng.random((120, 3)) < 0.2, rng.random((120, 3)) < 0.2)
+    position[-5:, 0] = 1
+    trades = extract_trades(position, prices, columns=["a", "b", "c"], include_open=include_open)
+
+    for k, name in enumerate(["a", "b", "c"]):
+        got = trades[trades["asset"] == name]
+        expected = _reference_trades(position[:, k], prices[:, k], include_open)
+        assert len(got) == len(expected)
+        for row, (a, b, pa, pb, roi, is_open) in zip(got.itertuples(), expected):
+            assert (row.entry_date, row.exit_date, bool(row.open)) == (a, b, is_open)
+            np.testing.assert_allclose([row.entry_price, row.exit_price, row.roi], [pa, pb, roi])
+
+    one_d = extract_trades(position[:, 0], prices[:, 0], include_open=include_open)
+    assert len(one_d) == len(_reference_trades(position[:, 0], prices[:, 0], include_open))
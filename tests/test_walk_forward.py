@@ -0,0 +1,42 @@
+# tests/test_walk_forward.py
+# Walk-forward: step_bars 與 test_bars 不同時 (測試窗重疊 / 有空檔) 樣本外序列仍須與日期對齊
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from walk_forward import TitanWalkForward, fold_windows  # noqa: E402
+
+
+def _streams(n: int = 2000, k: int = 5) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.normal(0.0003, 0.01, (n, k)), index=pd.bdate_range('2015-01-01', periods=n),
+                        columns=[f"s{i}" for i in range(k)])
+
+
+@pytest.mark.parametrize("step", [126, 252, 300])
+def test_oos_returns_follow_latest_fold(step):
+    streams = _streams()
+    wf = TitanWalkForward(train_bars=500, test_bars=252, step_bars=step, workers=1)
+    result = wf.run(streams)
+    folds = fold_windows(len(streams), 500, 252, step)
+
+    # 逐日參考: 每一天取涵蓋它的最後一個 fold 所選的候選
+    expected = {}
+    for (_, b, c), selected in zip(folds, result['folds']['selected']):
+        for t in range(b, c):
+            expected[streams.index[t]] = streams[selected].iloc[t]
+    expected = pd.Series(expected).sort_index()
+
+    oos = result['oos_returns']
+    assert oos.index.is_unique and oos.index.is_monotonic_increasing
+    pd.testing.assert_index_equal(oos.index, expected.index, check_names=False)
+    np.testing.assert_allclose(oos.to_numpy(), expected.to_numpy())
+    assert len(result['in_sample_equity']) == len(oos)
+    if step > 252:
+        assert len(oos) < folds[-1][2] - folds[0][1]
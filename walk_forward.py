@@ -0,0 +1,174 @@
+# walk_forward.py
+# Titan SOP V82.1 - Walk-forward Optimization
+# 狀態: 滾動樣本內挑選 / 樣本外驗證，串接樣本外權益曲線
+# 修正重點:
+# 1. [報酬串流快取] 每個候選 (參數組或均線戰法) 的每日報酬只計算一次 (網格部分走 grid_search 行程池)，所有 fold 皆為切片。
+# 2. [前綴和] 訓練窗的 CAGR / Sharpe 以對數報酬與平方的累加差分取得，重疊窗口不重算。
+# 3. [無前視] 持倉由完整歷史的均線狀態機決定 (只用當日以前的資料)，每個測試窗只使用前一訓練窗選出的候選。
+
+import numpy as np
+import pandas as pd
+import metrics
+from config import Config
+from backtest import moving_averages, hysteresis_position, MA_STRATEGY_RULES
+from fingerprint import frame_fingerprint
+from grid_search import TitanGridSearch, equal_weight_returns
+from typing import Dict, List, Optional, Tuple
+
+SELECTION_METRICS = ('sharpe', 'cagr', 'calmar')
+
+
+def _panel_key(closes: Optional[pd.DataFrame]) -> str:
+    """面板指紋 (含日期索引)"""
+    return frame_fingerprint(None if closes is None else closes.reset_index())
+
+
+def fold_windows(n: int, train: int, test: int, step: Optional[int] = None,
+                 anchored: bool = False) -> List[Tuple[int, int, int]]:
+    """(訓練起點, 訓練終點 = 測試起點, 測試終點) 列表；anchored=True 為擴張式訓練窗"""
+    step = step or test
+    folds = []
+    start = 0
+    while start + train + test <= n:
+        folds.append((0 if anchored else start, start + train, start + train + test))
+        start += step
+    if folds and folds[-1][2] < n and n - folds[-1][2] >= test // 2:
+        # 尾端剩餘不足一個完整測試窗: 至少半個窗口時另開一段較短的 fold
+        last_train_end = folds[-1][2]
+        folds.append((0 if anchored else last_train_end - train, last_train_end, n))
+    return folds
+
+
+def window_metrics(returns: np.ndarray) -> Dict[str, np.ndarray]:
+    """每日報酬 (日期 × 候選) → 各候選的 cagr / sharpe / mdd / calmar (metrics.py 定義)"""
+    returns = np.asarray(returns, dtype=float)
+    return {"cagr": metrics.cagr(returns), "sharpe": metrics.sharpe(returns),
+            "mdd": metrics.max_drawdown(returns), "calmar": metrics.calmar(returns)}
+
+
+def ma_strategy_streams(closes: pd.DataFrame, names: Optional[List[str]] = None) -> pd.DataFrame:
+    """15 種均線戰法套用在整個標的池 → 每日等權重組合報酬 (日期 × 戰法)；均線只計算一次"""
+    names = list(names or MA_STRATEGY_RULES.keys())
+    values = closes.to_numpy(dtype=float)
+    mas = moving_averages(values)
+    streams = {}
+    for name in names:
+        entry, exit = MA_STRATEGY_RULES[name](mas)
+        streams[name] = equal_weight_returns(hysteresis_position(entry, exit), values)
+    return pd.DataFrame(streams, index=closes.index)
+
+
+class TitanWalkForward:
+    """
+    Walk-forward 驗證器
+    1. 先取得所有候選的每日報酬串流 (快取，同一份資料與候選集只算一次)。
+    2. 每個訓練窗依 metric 選出最佳候選，於緊接的測試窗持有該候選。
+    3. 各測試窗報酬串接成樣本外權益曲線，並與「全期樣本內最佳」對照。
+    """
+
+    def __init__(self, train_bars: int = 756, test_bars: int = 252, step_bars: Optional[int] = None,
+                 metric: str = 'sharpe', anchored: bool = False, workers: int = Config.BACKTEST_WORKERS):
+        if metric not in SELECTION_METRICS:
+            raise ValueError(f"metric 必須為 {SELECTION_METRICS} 之一")
+        self.train_bars = train_bars
+        self.test_bars = test_bars
+        self.step_bars = step_bars or test_bars
+        self.metric = metric
+        self.anchored = anchored
+        self.workers = workers
+        self._stream_cache: Dict[str, pd.DataFrame] = {}
+
+    # ------------------------------------------------------------------
+    # 候選報酬串流 (快取)
+    # ------------------------------------------------------------------
+    def grid_streams(self, closes: pd.DataFrame, grid: List[Dict], cb_closes: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        key = "grid:" + _panel_key(closes) + _panel_key(cb_closes) + repr(grid)
+        if key not in self._stream_cache:
+            search = TitanGridSearch(closes, cb_closes=cb_closes, workers=self.workers)
+            self._stream_cache[key] = search.return_streams(grid)
+        return self._stream_cache[key]
+
+    def ma_streams(self, closes: pd.DataFrame, names: Optional[List[str]] = None) -> pd.DataFrame:
+        key = "ma:" + _panel_key(closes) + repr(names)
+        if key not in self._stream_cache:
+            self._stream_cache[key] = ma_strategy_streams(closes, names)
+        return self._stream_cache[key]
+
+    # ------------------------------------------------------------------
+    # 訓練窗評分
+    # ------------------------------------------------------------------
+    def _train_scores(self, streams: np.ndarray, folds: List[Tuple[int, int, int]]) -> np.ndarray:
+        """所有 fold × 候選 的訓練窗分數；cagr / sharpe 由前綴和 O(1) 取得，calmar 才需切片算回撤"""
+        zeros = np.zeros((1, streams.shape[1]))
+        log_cs = np.vstack([zeros, np.cumsum(np.log1p(streams), axis=0)])
+        cs = np.vstack([zeros, np.cumsum(streams, axis=0)])
+        sq_cs = np.vstack([zeros, np.cumsum(streams ** 2, axis=0)])
+
+        scores = np.empty((len(folds), streams.shape[1]))
+        for i, (a, b, _) in enumerate(folds):
+            n = b - a
+            if self.metric == 'cagr':
+                scores[i] = np.exp((log_cs[b] - log_cs[a]) * 252 / n) - 1
+            elif self.metric == 'sharpe':
+                mean = (cs[b] - cs[a]) / n
+                var = np.maximum((sq_cs[b] - sq_cs[a]) / n - mean ** 2, 0) * n / max(n - 1, 1)
+                std = np.sqrt(var)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    scores[i] = np.where(std > 1e-12, mean / std * np.sqrt(252), 0.0)
+            else:
+                scores[i] = window_metrics(streams[a:b])['calmar']
+        return scores
+
+    # ------------------------------------------------------------------
+    # 主流程
+    # ------------------------------------------------------------------
+    def run(self, streams: pd.DataFrame, initial_capital: float = 1000000) -> Dict:
+        """
+        streams: 候選每日報酬 (日期 × 候選)。
+        回傳 folds (每段選擇與樣本外績效)、oos_equity (串接權益)、oos_returns、stats 與 in_sample (全期最佳候選同期間績效)。
+        """
+        values = np.nan_to_num(streams.to_numpy(dtype=float))
+        folds = fold_windows(len(values), self.train_bars, self.test_bars, self.step_bars, self.anchored)
+        if not folds or values.shape[1] == 0:
+            return {}
+
+        scores = self._train_scores(values, folds)
+        chosen = scores.argmax(axis=1)
+        names = list(streams.columns)
+
+        rows, pieces, spans = [], [], []
+        for (a, b, c), pick, fold_scores in zip(folds, chosen, scores):
+            oos = values[b:c, pick]
+            pieces.append(oos)
+            spans.append(np.arange(b, c))
+            test = window_metrics(oos[:, None])
+            rows.append({
+                "train_start": streams.index[a], "test_start": streams.index[b], "test_end": streams.index[c - 1],
+                "selected": names[pick], f"train_{self.metric}": fold_scores[pick],
+                "test_cagr": test['cagr'][0], "test_mdd": test['mdd'][0], "test_sharpe": test['sharpe'][0],
+            })
+
+        # step < test 時相鄰測試窗重疊 (同一天以較新的 fold 為準)，step > test 時測試窗之間有空檔 (不計入)
+        positions = np.concatenate(spans)
+        latest = ~pd.Index(positions).duplicated(keep='last')
+        positions = positions[latest]
+        oos_returns = pd.Series(np.concatenate(pieces)[latest], index=streams.index[positions])
+        oos_equity = (1 + oos_returns).cumprod() * initial_capital
+
+        # 樣本內對照: 以全期最佳候選在相同樣本外期間的表現 (即「只看全期回測」會相信的數字)
+        full = window_metrics(values)[self.metric]
+        best = int(np.nanargmax(full))
+        in_sample = values[positions, best]
+
+        oos_stats = {k: float(v[0]) for k, v in window_metrics(oos_returns.to_numpy()[:, None]).items()}
+        is_stats = {k: float(v[0]) for k, v in window_metrics(in_sample[:, None]).items()}
+        return {
+            "metric": self.metric,
+            "folds": pd.DataFrame(rows),
+            "oos_returns": oos_returns,
+            "oos_equity": oos_equity,
+            "in_sample_equity": pd.Series((1 + in_sample).cumprod() * initial_capital, index=oos_returns.index),
+            "stats": oos_stats,
+            "in_sample": {"candidate": names[best], **is_stats},
+            "selection_counts": pd.Series([r['selected'] for r in rows]).value_counts(),
+        }